@@ -0,0 +1,71 @@
+"""
+JSON编码器微基准：比较标准库json与orjson编码100条学生列表响应的耗时
+
+用法：
+    python benchmarks/bench_json_encoder.py [--items 100] [--repeat 2000]
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wxcloudrun import response  # noqa: E402
+
+
+def build_payload(items):
+    """
+    构造与 /api/students 相同结构的列表响应数据
+    """
+    now = datetime.now()
+    return {
+        'code': 0,
+        'data': {
+            'items': [{
+                'id': i,
+                'name': '学生{}'.format(i),
+                'phone': '138{:08d}'.format(i),
+                'email': 'student{}@example.com'.format(i),
+                'birthdate': date(2015, 1 + i % 12, 1 + i % 28),
+                'address': '上海市浦东新区世纪大道{}号'.format(i),
+                'notes': '备注' * 10,
+                'status': 'active',
+                'registerDate': date(2024, 1 + i % 12, 1 + i % 28),
+                'totalHours': 48.0,
+                'usedHours': float(i % 48),
+                'remainingHours': float(48 - i % 48),
+                'activePackageCount': 1,
+                'lastConsumptionTime': now
+            } for i in range(items)],
+            'pagination': {'page': 1, 'per_page': items, 'total': 100000, 'pages': 100000 // items}
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    payload = build_payload(args.items)
+    encoders = [('json', response._stdlib_dumps)]
+    if response.orjson is not None:
+        encoders.append(('orjson', response._orjson_dumps))
+    else:
+        print('orjson is not installed, only measuring the stdlib encoder')
+
+    results = {}
+    for name, dumps in encoders:
+        best = min(timeit.repeat(lambda: dumps(payload), number=args.repeat, repeat=5))
+        results[name] = best / args.repeat * 1e6
+        print('{:<8} {:>9.1f} us/response'.format(name, results[name]))
+
+    if 'orjson' in results:
+        print('speedup  {:>9.1f}x'.format(results['json'] / results['orjson']))
+
+
+if __name__ == '__main__':
+    main()
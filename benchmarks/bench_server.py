@@ -0,0 +1,161 @@
+"""
+服务模式吞吐量对比：分别以开发服务器（DEBUG=true）和生产服务（gunicorn多进程）启动 run.py，
+并发请求同一个接口，统计每秒请求数和延迟
+
+使用临时SQLite数据库，不需要MySQL：
+    python benchmarks/bench_server.py [--concurrency 16] [--duration 10] [--students 1000]
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USERNAME = 'bench'
+PASSWORD = 'bench'
+
+
+def prepare_database(uri, students):
+    """
+    创建表结构、测试账户和学生数据
+    """
+    os.environ['DATABASE_URI'] = uri
+    from wxcloudrun import create_app, db, migrations
+    from wxcloudrun.model import Student, StudentBalance, User
+
+    app = create_app()
+    with app.app_context():
+        migrations.upgrade(echo=lambda message: None)
+        user = User(username=USERNAME, is_admin=True)
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.execute(Student.__table__.insert(), [{
+            'name': '学生{}'.format(i),
+            'phone': '138{:08d}'.format(i),
+            'register_date': date(2024, 1, 1),
+            'status': 'active'
+        } for i in range(students)])
+        db.session.execute(StudentBalance.__table__.insert(), [{
+            'student_id': i + 1, 'total_hours': 48, 'used_hours': 0, 'remaining_hours': 48, 'active_package_count': 1
+        } for i in range(students)])
+        db.session.commit()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start on port {}'.format(port))
+
+
+def run_load(base_url, path, concurrency, duration):
+    """
+    concurrency 个线程在 duration 秒内循环请求
+    :return: 请求数、错误数和各请求耗时（秒）
+    """
+    login = requests.Session()
+    login.post(base_url + '/login', data={'username': USERNAME, 'password': PASSWORD}, allow_redirects=False)
+    cookies = login.cookies.get_dict()
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        session = requests.Session()
+        session.cookies.update(cookies)
+        local = []
+        local_errors = 0
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                response = session.get(base_url + path, allow_redirects=False, timeout=30)
+                if response.status_code != 200 or response.json().get('code') != 0:
+                    local_errors += 1
+            except requests.RequestException:
+                local_errors += 1
+            local.append(time.monotonic() - started)
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(latencies), errors[0], sorted(latencies)
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))] if values else 0.0
+
+
+def bench_mode(name, env, args):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'run.py'), '127.0.0.1', str(port)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+    try:
+        wait_for_port(port)
+        base_url = 'http://127.0.0.1:{}'.format(port)
+        run_load(base_url, args.path, args.concurrency, 2)  # 预热
+        count, errors, latencies = run_load(base_url, args.path, args.concurrency, args.duration)
+    finally:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=60)
+
+    print('{:<6} {:>9.1f} req/s  p50 {:>7.1f} ms  p99 {:>7.1f} ms  errors {}'.format(
+        name, count / args.duration, percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, errors))
+    return count / args.duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=int, default=10)
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--path', default='/api/students?per_page=20&count=approx')
+    parser.add_argument('--workers', type=int, default=None, help='生产服务的工作进程数，默认使用配置值')
+    parser.add_argument('--threads', type=int, default=None, help='生产服务每个进程的线程数，默认使用配置值')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = 'sqlite:///{}'.format(os.path.join(tmp, 'bench.db'))
+        prepare_database(uri, args.students)
+
+        env = dict(os.environ, DATABASE_URI=uri)
+        dev = bench_mode('dev', dict(env, DEBUG='true', FLASK_RUN_FROM_CLI='false'), args)
+        prod_env = dict(env, DEBUG='false')
+        if args.workers:
+            prod_env['WEB_WORKERS'] = str(args.workers)
+        if args.threads:
+            prod_env['WEB_THREADS'] = str(args.threads)
+        prod = bench_mode('prod', prod_env, args)
+        print('speedup {:>8.1f}x'.format(prod / dev if dev else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+本地微信接口模拟服务，用于在不访问微信服务器的情况下测试 access_token 管理和消息发送
+
+用法：
+    python benchmarks/wechat_stub.py [--port 8091] [--latency 0.05] [--expires-in 7200]
+    WECHAT_API_BASE=http://127.0.0.1:8091 python run.py
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class WechatStub:
+    """
+    模拟 stable_token、模板消息发送和 jscode2session 接口，记录各接口调用次数
+    fail_next 大于0时接下来的请求返回503，用于测试重试
+    """
+
+    def __init__(self, latency=0.0, expires_in=7200):
+        self.latency = latency
+        self.expires_in = expires_in
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.tokens = set()
+        self.fail_next = 0
+
+    def count(self, path):
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+
+    def handle(self, method, path, query, body):
+        self.count(path)
+        time.sleep(self.latency)
+        with self.lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return None
+        if path == '/cgi-bin/stable_token':
+            token = 'stub-token-{}'.format(uuid.uuid4().hex[:8])
+            with self.lock:
+                self.tokens.add(token)
+            return {'access_token': token, 'expires_in': self.expires_in}
+        if path == '/cgi-bin/message/template/send':
+            if query.get('access_token', [None])[0] not in self.tokens:
+                return {'errcode': 40001, 'errmsg': 'invalid credential'}
+            return {'errcode': 0, 'errmsg': 'ok', 'msgid': int(time.time() * 1000)}
+        if path == '/sns/jscode2session':
+            return {'openid': 'stub-openid', 'session_key': 'stub-session-key'}
+        return {'errcode': 404, 'errmsg': 'not found'}
+
+    def serve(self, host='127.0.0.1', port=0):
+        """
+        在后台线程中启动服务
+        :return: (服务实例, 接口地址)
+        """
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+                result = stub.handle(method, url.path, parse_qs(url.query), body)
+                if result is None:
+                    self.send_error(503)
+                    return
+                data = json.dumps(result).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, 'http://{}:{}'.format(host, server.server_address[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--latency', type=float, default=0.05, help='每个请求的模拟延迟（秒）')
+    parser.add_argument('--expires-in', type=int, default=7200)
+    args = parser.parse_args()
+
+    stub = WechatStub(args.latency, args.expires_in)
+    server, url = stub.serve(port=args.port)
+    print('WeChat stub listening on {}'.format(url))
+    try:
+        while True:
+            time.sleep(10)
+            print(stub.calls)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,93 @@
 import os
+import tempfile
 
-# 是否开启debug模式
-DEBUG = True
+# 是否开启debug模式，开启时 run.py 使用Flask开发服务器
+DEBUG = os.environ.get("DEBUG", "false").lower() in ("1", "true", "yes")
+
+# 生产服务（gunicorn）的工作进程数、每个进程的线程数和超时时间（秒）
+# 工作进程数默认 2*CPU+1，最多4个：每个进程各自建立连接池，进程数决定数据库连接总数（见 DB_MAX_CONNECTIONS）
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", min(2 * (os.cpu_count() or 1) + 1, 4)))
+WEB_THREADS = int(os.environ.get("WEB_THREADS", 4))
+WEB_TIMEOUT = int(os.environ.get("WEB_TIMEOUT", 60))
+WEB_GRACEFUL_TIMEOUT = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", 30))
 
 # 读取数据库环境变量
 username = os.environ.get("MYSQL_USERNAME", 'worker')
 password = os.environ.get("MYSQL_PASSWORD", 'Atlas040310631')
 db = os.environ.get("MYSQL_DB", 'funroom')
 db_address = os.environ.get("MYSQL_ADDRESS", 'sh-cynosdbmysql-grp-kukvu26y.sql.tencentcdb.com:28249')
+
+# 完整的数据库连接串（可选），设置后代替上面的MySQL配置，例如本地测试使用 sqlite:///funroom.db
+DATABASE_URI = os.environ.get("DATABASE_URI")
+
+# 数据库连接池配置
+# 每个工作进程各有一个连接池，最多同时占用 WEB_WORKERS * (DB_POOL_SIZE + DB_MAX_OVERFLOW) 个连接，
+# 应小于MySQL的 max_connections 并为命令行、迁移等留出余量。
+# 未单独设置时按 DB_MAX_CONNECTIONS 平分到各进程：常驻连接数为线程数加2（定时任务、后台发送），其余为溢出连接
+DB_MAX_CONNECTIONS = int(os.environ.get("DB_MAX_CONNECTIONS", 100))
+_worker_connections = max(1, DB_MAX_CONNECTIONS // (1 if DEBUG else max(1, WEB_WORKERS)))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", min(WEB_THREADS + 2, _worker_connections)))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", max(0, _worker_connections - DB_POOL_SIZE)))
+# 获取连接的最长等待时间（秒）
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 10))
+# 连接的最长使用时间（秒），应小于MySQL的wait_timeout
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 280))
+# 取出连接前检测连接是否可用
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# 列表总数缓存的有效期（秒）：近似总数（count=approx）使用 COUNT_CACHE_TTL，
+# 精确总数只复用 EXACT_COUNT_CACHE_TTL 秒内的统计。缓存在每个进程内，其他进程的增删最多滞后对应的时间
+COUNT_CACHE_TTL = int(os.environ.get("COUNT_CACHE_TTL", 60))
+EXACT_COUNT_CACHE_TTL = int(os.environ.get("EXACT_COUNT_CACHE_TTL", 5))
+
+# 登录用户信息缓存的有效期（秒），多进程部署时其他进程最多在该时间后看到用户变更
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 60))
+
+# 微信接口地址（测试时可指向本地模拟服务）和服务端使用的appid、appsecret
+WECHAT_API_BASE = os.environ.get("WECHAT_API_BASE", 'https://api.weixin.qq.com')
+WECHAT_APPID = os.environ.get("WECHAT_APPID")
+WECHAT_SECRET = os.environ.get("WECHAT_SECRET")
+# access_token 在过期前多少秒提前刷新
+WECHAT_TOKEN_REFRESH_MARGIN = int(os.environ.get("WECHAT_TOKEN_REFRESH_MARGIN", 300))
+# 访问微信接口的连接超时、读取超时（秒）、幂等请求的最大重试次数和每个主机保持的连接数
+WECHAT_CONNECT_TIMEOUT = float(os.environ.get("WECHAT_CONNECT_TIMEOUT", 3))
+WECHAT_READ_TIMEOUT = float(os.environ.get("WECHAT_READ_TIMEOUT", 10))
+WECHAT_RETRIES = int(os.environ.get("WECHAT_RETRIES", 2))
+WECHAT_HTTP_POOL_SIZE = int(os.environ.get("WECHAT_HTTP_POOL_SIZE", 20))
+# 批量发送模板消息的并发数（每个进程）和每秒最多发送条数（每个实例，由各工作进程平分）
+WECHAT_SEND_WORKERS = int(os.environ.get("WECHAT_SEND_WORKERS", 8))
+WECHAT_SEND_RATE = float(os.environ.get("WECHAT_SEND_RATE", 20))
+# 批量发送任务心跳超过多少秒未更新视为发送进程已退出，以及检查中断任务的间隔（秒，0为不自动恢复）
+MESSAGE_JOB_STALE_SECONDS = int(os.environ.get("MESSAGE_JOB_STALE_SECONDS", 300))
+MESSAGE_JOB_RESUME_INTERVAL = int(os.environ.get("MESSAGE_JOB_RESUME_INTERVAL", 120))
+
+# 按请求统计SQL语句数和耗时：是否开启、抽样比例（0-1）和慢查询日志阈值（毫秒）
+SQL_PROFILE_ENABLED = os.environ.get("SQL_PROFILE_ENABLED", "false").lower() in ("1", "true", "yes")
+SQL_PROFILE_SAMPLE_RATE = float(os.environ.get("SQL_PROFILE_SAMPLE_RATE", 1.0))
+SQL_SLOW_QUERY_MS = float(os.environ.get("SQL_SLOW_QUERY_MS", 200))
+
+# 请求统计：是否开启、/metrics 接口的访问令牌（为空时只有登录的管理员可以访问）、
+# 多进程部署时各进程写入统计文件的目录和写入间隔（秒）
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(tempfile.gettempdir(), 'funclassroom-metrics'))
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+
+# 是否在Web进程中运行定时任务，以及检查定时任务的间隔（秒）
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+SCHEDULER_TICK = int(os.environ.get("SCHEDULER_TICK", 30))
+# 定时任务执行超过该时间（秒）仍为 running 时视为执行进程已退出，标记为失败，同一周期可以重新认领
+# 应大于最长任务的正常耗时，超时后仍在执行的任务结束时会覆盖为实际结果
+JOB_RUN_TIMEOUT = int(os.environ.get("JOB_RUN_TIMEOUT", 3600))
+
+# 课时包提醒：执行间隔（秒，0为不自动执行）、剩余课时阈值、到期前天数
+REMINDER_INTERVAL = int(os.environ.get("REMINDER_INTERVAL", 3600))
+REMINDER_LOW_HOURS = float(os.environ.get("REMINDER_LOW_HOURS", 2))
+REMINDER_EXPIRE_DAYS = int(os.environ.get("REMINDER_EXPIRE_DAYS", 7))
+# 课时包过期清理的执行间隔（秒，0为不自动执行）
+PACKAGE_EXPIRY_INTERVAL = int(os.environ.get("PACKAGE_EXPIRY_INTERVAL", 3600))
+# 提醒使用的模板ID和模板数据，模板数据中可使用 {name}、{packageName}、{reason}、{remainingHours}、{expireDate}
+REMINDER_TEMPLATE_ID = os.environ.get("REMINDER_TEMPLATE_ID")
+REMINDER_TEMPLATE_DATA = os.environ.get(
+    "REMINDER_TEMPLATE_DATA", '{"thing1": {"value": "{name}"}, "thing2": {"value": "{packageName}"}, '
+                              '"thing3": {"value": "{reason}"}}')
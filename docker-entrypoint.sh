@@ -0,0 +1,16 @@
+#!/bin/sh
+# 容器启动脚本：先执行数据库迁移（和首次部署时创建管理员），再启动Web服务
+set -e
+
+export FLASK_APP=run.py
+
+# MIGRATE_ON_START=false 时跳过迁移（例如由发布流程单独执行）
+if [ "${MIGRATE_ON_START:-true}" != "false" ]; then
+    python3 -m flask db upgrade
+    # 设置了 ADMIN_PASSWORD 时创建初始管理员，已存在管理员时不做任何操作
+    if [ -n "$ADMIN_PASSWORD" ]; then
+        python3 -m flask db create-admin
+    fi
+fi
+
+exec python3 run.py "$@"
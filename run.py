@@ -1,11 +1,59 @@
 import os
+import sys
 
+import config
 from wxcloudrun import create_app
 
 # 创建应用实例
 app = create_app()
 
-# 启动Flask Web服务
+
+def run_production(host, port):
+    """
+    使用gunicorn启动多进程、多线程的生产服务
+    应用在主进程中预加载后fork出工作进程；启动时不连接数据库，各进程各自建立连接池
+    收到SIGTERM后停止接收新请求，等待处理中的请求完成后退出
+    """
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', '{}:{}'.format(host, port))
+            self.cfg.set('workers', config.WEB_WORKERS)
+            self.cfg.set('threads', config.WEB_THREADS)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('preload_app', True)
+            self.cfg.set('timeout', config.WEB_TIMEOUT)
+            self.cfg.set('graceful_timeout', config.WEB_GRACEFUL_TIMEOUT)
+            self.cfg.set('keepalive', 5)
+            self.cfg.set('accesslog', '-')
+            self.cfg.set('errorlog', '-')
+
+        def load(self):
+            return app
+
+    # 所有工作进程的连接池加起来最多占用的数据库连接数
+    connections = config.WEB_WORKERS * (config.DB_POOL_SIZE + config.DB_MAX_OVERFLOW)
+    if connections > config.DB_MAX_CONNECTIONS:
+        app.logger.warning(
+            '{} workers x ({} pool + {} overflow) = {} database connections exceeds DB_MAX_CONNECTIONS {}'.format(
+                config.WEB_WORKERS, config.DB_POOL_SIZE, config.DB_MAX_OVERFLOW, connections,
+                config.DB_MAX_CONNECTIONS))
+
+    # 多个工作进程通过共享目录汇总 /metrics 的统计
+    if config.METRICS_ENABLED and config.WEB_WORKERS > 1:
+        from wxcloudrun.metrics import metrics
+        metrics.multiprocess(config.METRICS_DIR)
+
+    Server().run()
+
+
+# 启动Web服务：python run.py [host] [port]，未指定时读取环境变量 HOST、PORT
 if __name__ == '__main__':
-    # app.run(host=sys.argv[1], port=sys.argv[2])
-    app.run(host='127.0.0.1', port=8090)
\ No newline at end of file
+    host = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('HOST', '127.0.0.1')
+    port = int(sys.argv[2] if len(sys.argv) > 2 else os.environ.get('PORT', 8090))
+    if config.DEBUG:
+        # 本地开发使用Flask开发服务器
+        app.run(host=host, port=port)
+    else:
+        run_production(host, port)
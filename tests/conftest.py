@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+# 测试使用内存SQLite数据库，不启动定时任务和请求统计
+os.environ['DATABASE_URI'] = 'sqlite://'
+os.environ['SCHEDULER_ENABLED'] = 'false'
+os.environ['METRICS_ENABLED'] = 'false'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wxcloudrun import create_app, db  # noqa: E402
+from wxcloudrun.model import User  # noqa: E402
+
+USERNAME = 'admin'
+PASSWORD = 'admin'
+
+
+def make_app():
+    """
+    创建应用和全部表，以及一个管理员账户，在应用上下文中返回应用
+    """
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        user = User(username=USERNAME, is_admin=True)
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def app():
+    yield from make_app()
+
+
+@pytest.fixture
+def client(app):
+    """
+    已登录管理员的测试客户端
+    """
+    client = app.test_client()
+    client.post('/login', data={'username': USERNAME, 'password': PASSWORD})
+    return client
@@ -0,0 +1,66 @@
+"""
+批量登记出勤：课时包ID的校验和逐项结果
+"""
+from datetime import date, timedelta
+
+from wxcloudrun import db
+from wxcloudrun.model import CoursePackage, Student, StudentCoursePackage
+
+
+def create_student_with_package(name, phone, hours=10):
+    course_package = CoursePackage.query.first()
+    if course_package is None:
+        course_package = CoursePackage(name='10课时', total_hours=10, status='active')
+        db.session.add(course_package)
+        db.session.flush()
+    student = Student(name=name, phone=phone, status='active')
+    db.session.add(student)
+    db.session.flush()
+    package = StudentCoursePackage(student_id=student.id, course_package_id=course_package.id, used_hours=0,
+                                   remaining_hours=hours, purchase_date=date.today(), status='active')
+    db.session.add(package)
+    db.session.commit()
+    return student.id, package.id
+
+
+def test_mixed_package_ids(client):
+    first, first_package = create_student_with_package('学生一', '13800000001')
+    second, second_package = create_student_with_package('学生二', '13800000002')
+    third, _ = create_student_with_package('学生三', '13800000003')
+
+    response = client.post('/api/attendance/batch', json={'items': [
+        {'studentId': first, 'packageId': str(first_package), 'hours': 1},
+        {'studentId': second, 'hours': 2},
+        {'studentId': third, 'packageId': 'abc', 'hours': 1},
+        {'studentId': third, 'packageId': 1.5, 'hours': 1},
+    ]})
+    body = response.get_json()
+    assert body['code'] == 0, body
+    items = body['data']['items']
+    assert items[0]['success'] and items[0]['packageId'] == first_package
+    assert items[1]['success'] and items[1]['packageId'] == second_package
+    assert items[2] == {'studentId': third, 'success': False, 'errorMsg': '课时包ID无效', 'index': 2}
+    assert not items[3]['success']
+    assert body['data']['succeeded'] == 2
+
+    db.session.expire_all()
+    assert db.session.get(StudentCoursePackage, first_package).remaining_hours == 9
+    assert db.session.get(StudentCoursePackage, second_package).remaining_hours == 8
+
+
+def test_expired_package_is_not_deducted(client):
+    student, package_id = create_student_with_package('学生四', '13800000004')
+    package = db.session.get(StudentCoursePackage, package_id)
+    # 已过有效期，定时任务尚未标记为 expired
+    package.expire_date = date.today() - timedelta(days=1)
+    db.session.commit()
+
+    body = client.post('/api/attendance/batch', json={'items': [
+        {'studentId': student, 'packageId': package_id, 'hours': 1},
+        {'studentId': student, 'hours': 1},
+    ]}).get_json()
+    assert body['code'] == 0, body
+    assert [item['success'] for item in body['data']['items']] == [False, False]
+
+    db.session.expire_all()
+    assert db.session.get(StudentCoursePackage, package_id).remaining_hours == 10
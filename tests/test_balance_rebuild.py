@@ -0,0 +1,57 @@
+"""
+重新计算学生课时汇总：逐个学生重新聚合，管理员接口在后台执行
+"""
+import time
+from datetime import date
+
+from wxcloudrun import db
+from wxcloudrun.dao import rebuild_student_balances
+from wxcloudrun.model import CoursePackage, JobRun, Student, StudentBalance, StudentCoursePackage
+
+
+def create_students(count):
+    course_package = CoursePackage(name='10课时', total_hours=10, status='active')
+    db.session.add(course_package)
+    db.session.flush()
+    for i in range(count):
+        student = Student(name='学生{}'.format(i), status='active')
+        db.session.add(student)
+        db.session.flush()
+        db.session.add(StudentCoursePackage(student_id=student.id, course_package_id=course_package.id,
+                                            used_hours=i, remaining_hours=10 - i, purchase_date=date.today(),
+                                            status='active'))
+    db.session.commit()
+
+
+def test_rebuild_fixes_wrong_and_missing_balances(app):
+    create_students(5)
+    students = Student.query.order_by(Student.id).all()
+    db.session.add(StudentBalance(student_id=students[0].id, total_hours=99, used_hours=99,
+                                  remaining_hours=99, active_package_count=9))
+    db.session.commit()
+
+    reports = []
+    assert rebuild_student_balances(batch_size=2, progress=lambda done, total: reports.append((done, total))) == 5
+    assert reports == [(2, 5), (4, 5), (5, 5)]
+
+    db.session.expire_all()
+    balances = {b.student_id: (b.total_hours, b.used_hours, b.remaining_hours, b.active_package_count)
+                for b in StudentBalance.query.all()}
+    assert balances == {s.id: (10, i, 10 - i, 1) for i, s in enumerate(students)}
+
+
+def test_rebuild_api_runs_in_background(client):
+    create_students(3)
+    body = client.post('/api/admin/student-balances/rebuild').get_json()
+    assert body['code'] == 0, body
+    run_id = body['data']['runId']
+
+    deadline = time.monotonic() + 10
+    while True:
+        db.session.expire_all()
+        run = db.session.get(JobRun, run_id)
+        if run.status != 'running' or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    assert run.status == 'finished', run.error
+    assert StudentBalance.query.count() == 3
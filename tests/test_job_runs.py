@@ -0,0 +1,45 @@
+"""
+定时任务执行记录：执行进程退出后遗留的 running 记录可以重新认领
+"""
+from datetime import datetime, timedelta
+
+import config
+from wxcloudrun import db
+from wxcloudrun.dao import JOB_RUN_EXCLUSIVE_SLOT, claim_job_run, finish_job_run
+from wxcloudrun.model import JobRun
+
+
+def test_running_slot_is_claimed_once(app):
+    assert claim_job_run('reminders', 1) is not None
+    assert claim_job_run('reminders', 1) is None
+
+
+def test_stale_running_runs_are_reclaimed_and_failed(app):
+    stale = datetime.now() - timedelta(seconds=config.JOB_RUN_TIMEOUT + 60)
+    db.session.add_all([
+        JobRun(name='reminders', slot=1, status='running', started_at=stale),
+        JobRun(name='reminders', slot=2, status='running', started_at=stale),
+    ])
+    db.session.commit()
+    first = JobRun.query.filter_by(slot=1).one().id
+
+    # 同一周期超时后重新认领，复用原记录
+    assert claim_job_run('reminders', 1) == first
+    assert claim_job_run('reminders', 1) is None
+
+    db.session.expire_all()
+    assert JobRun.query.filter_by(slot=1).one().status == 'running'
+    other = JobRun.query.filter_by(slot=2).one()
+    assert other.status == 'failed' and other.finished_at is not None
+
+
+def test_exclusive_slot_is_released_when_finished(app):
+    first = claim_job_run('rebuild_balances', JOB_RUN_EXCLUSIVE_SLOT)
+    assert first is not None
+    assert claim_job_run('rebuild_balances', JOB_RUN_EXCLUSIVE_SLOT) is None
+
+    finish_job_run(first, {'rebuilt': 0})
+    second = claim_job_run('rebuild_balances', JOB_RUN_EXCLUSIVE_SLOT)
+    assert second not in (None, first)
+    db.session.expire_all()
+    assert db.session.get(JobRun, first).slot == -first
@@ -0,0 +1,34 @@
+"""
+/metrics 接口的访问控制
+"""
+import pytest
+
+import config
+from conftest import PASSWORD, USERNAME, make_app
+from wxcloudrun import metrics
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.setattr(config, 'METRICS_ENABLED', True)
+    monkeypatch.setattr(config, 'METRICS_TOKEN', None)
+    monkeypatch.setattr(metrics.metrics, 'directory', None)
+    yield from make_app()
+
+
+def test_metrics_is_not_public(app, monkeypatch):
+    anonymous = app.test_client()
+    assert anonymous.get('/metrics').status_code == 401
+
+    monkeypatch.setattr(config, 'METRICS_TOKEN', 'secret')
+    assert anonymous.get('/metrics').status_code == 401
+    assert anonymous.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = anonymous.get('/metrics', headers={'Authorization': 'Bearer secret'})
+    assert response.status_code == 200
+    assert 'http_requests_total' in response.get_data(as_text=True)
+
+
+def test_metrics_allows_admin(app, client):
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert 'endpoint="auth.login"' in response.get_data(as_text=True)
@@ -0,0 +1,77 @@
+"""
+学生的上课记录、课消记录和课时包接口的SQL语句数不随记录数增加（关联对象随查询一起加载）
+"""
+from datetime import date, datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from wxcloudrun import db
+from wxcloudrun.model import (
+    ClassRecord, ConsumptionRecord, CoursePackage, Student, StudentCoursePackage, User
+)
+
+
+def create_student(rows):
+    """
+    创建一个学生及 rows 条课时包、上课记录和课消记录，每条记录关联不同的操作人和基础课时包，
+    逐条懒加载时语句数会随 rows 增加
+    """
+    student = Student(name='学生{}'.format(rows), phone='1380000{:04d}'.format(rows), status='active')
+    db.session.add(student)
+    db.session.flush()
+    for i in range(rows):
+        operator = User(username='operator{}_{}'.format(rows, i))
+        course_package = CoursePackage(name='课时包{}_{}'.format(rows, i), total_hours=10, status='active')
+        db.session.add_all([operator, course_package])
+        db.session.flush()
+        package = StudentCoursePackage(
+            student_id=student.id, course_package_id=course_package.id, used_hours=1, remaining_hours=9,
+            purchase_date=date.today() - timedelta(days=i), status='active'
+        )
+        db.session.add(package)
+        db.session.flush()
+        db.session.add(ClassRecord(student_id=student.id, class_date=date.today() - timedelta(days=i),
+                                   content='第{}课'.format(i), operator_id=operator.id))
+        db.session.add(ConsumptionRecord(student_id=student.id, package_id=package.id, consumption_hours=1,
+                                         remaining_hours=9, used_hours=1, operator_id=operator.id,
+                                         operation_time=datetime.now() - timedelta(minutes=i)))
+    db.session.commit()
+    return student.id
+
+
+def count_queries(client, path):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    body = response.get_json()
+    assert body['code'] == 0, body
+    return len(statements), body['data']
+
+
+@pytest.mark.parametrize('path', [
+    '/api/students/{}/records',
+    '/api/students/{}/consumption-records',
+    '/api/students/{}/packages',
+])
+def test_query_count_does_not_grow_with_rows(app, client, path):
+    few = create_student(3)
+    many = create_student(60)
+    # 预热：登录用户信息进入缓存，不计入后续请求
+    client.get(path.format(few))
+    db.session.expunge_all()
+
+    few_queries, few_rows = count_queries(client, path.format(few))
+    db.session.expunge_all()
+    many_queries, many_rows = count_queries(client, path.format(many))
+
+    assert len(few_rows) == 3
+    assert len(many_rows) == 60
+    assert few_queries == many_queries
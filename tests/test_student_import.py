@@ -0,0 +1,64 @@
+"""
+批量导入学生：重复姓名的ID对应关系、每批提交和整体回滚
+"""
+import pytest
+
+from wxcloudrun import db
+from wxcloudrun.dao import import_students, validate_student_import
+from wxcloudrun.model import CoursePackage, Student, StudentBalance, StudentCoursePackage
+
+
+def create_course_packages():
+    small = CoursePackage(name='10课时', total_hours=10, status='active')
+    large = CoursePackage(name='20课时', total_hours=20, status='active')
+    db.session.add_all([small, large])
+    db.session.commit()
+    return small.id, large.id
+
+
+def test_duplicate_names_get_their_own_packages(app):
+    small, large = create_course_packages()
+    # 已有同名且无手机号的学生
+    db.session.add(Student(name='同名', status='active'))
+    db.session.commit()
+
+    records, errors = validate_student_import([
+        {'name': '同名', 'coursePackageId': str(small)},
+        {'name': '同名', 'coursePackageId': str(large)},
+        {'name': '同名'},
+    ])
+    assert not errors
+    assert import_students(records, chunk_size=2) == (3, 2)
+
+    db.session.expire_all()
+    imported = Student.query.filter(Student.import_batch.isnot(None)).order_by(Student.id).all()
+    assert len(imported) == 3
+    packages = {p.student_id: p.course_package_id for p in StudentCoursePackage.query.all()}
+    assert packages == {imported[0].id: small, imported[1].id: large}
+    balances = {b.student_id: b.total_hours for b in StudentBalance.query.all()}
+    assert balances == {imported[0].id: 10, imported[1].id: 20, imported[2].id: 0}
+
+
+def test_atomic_import_rolls_back_on_failure(app):
+    small, _ = create_course_packages()
+    records, errors = validate_student_import([
+        {'name': '学生{}'.format(i), 'coursePackageId': str(small)} for i in range(3)
+    ])
+    assert not errors
+
+    def fail_after_first_chunk(done, total):
+        if done > 1:
+            raise RuntimeError('中途失败')
+
+    with pytest.raises(RuntimeError):
+        import_students(records, chunk_size=1, progress=fail_after_first_chunk, atomic=True)
+    assert Student.query.count() == 0
+    assert StudentCoursePackage.query.count() == 0
+    assert StudentBalance.query.count() == 0
+
+    # 默认每批提交，出错前的批次已导入
+    with pytest.raises(RuntimeError):
+        import_students(records, chunk_size=1, progress=fail_after_first_chunk)
+    assert Student.query.count() == 2
+    assert StudentCoursePackage.query.count() == 2
+    assert StudentBalance.query.count() == 2
@@ -24,9 +24,20 @@ def create_app():
     # 配置数据库
     app.config['DEBUG'] = config.DEBUG
     app.secret_key = os.environ.get('SECRET_KEY', 'dev-key-for-testing-only')
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql://{}:{}@{}/{}'.format(
+    app.config['SQLALCHEMY_DATABASE_URI'] = config.DATABASE_URI or 'mysql://{}:{}@{}/{}'.format(
         config.username, config.password, config.db_address, config.db)
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # 连接池配置，SQLite不使用连接池参数
+    if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        from wxcloudrun.pool import TimedQueuePool
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'poolclass': TimedQueuePool,
+            'pool_size': config.DB_POOL_SIZE,
+            'max_overflow': config.DB_MAX_OVERFLOW,
+            'pool_timeout': config.DB_POOL_TIMEOUT,
+            'pool_recycle': config.DB_POOL_RECYCLE,
+            'pool_pre_ping': config.DB_POOL_PRE_PING
+        }
     
     # 初始化扩展
     db.init_app(app)
@@ -34,18 +45,32 @@ def create_app():
     login_manager.login_view = 'auth.login'
     login_manager.login_message = '请先登录'
     
+    # 按请求统计SQL（SQL_PROFILE_ENABLED开启时）
+    from wxcloudrun import profiling
+    profiling.init_app(app)
+    
+    # 请求统计和 /metrics 接口（METRICS_ENABLED开启时）
+    from wxcloudrun import metrics
+    metrics.init_app(app)
+    
     # 注册蓝图
     from wxcloudrun.blueprints import init_app
     init_app(app)
     
-    # 用户加载回调
-    @login_manager.user_loader
-    def load_user(user_id):
-        from wxcloudrun.model import User
-        return User.query.get(int(user_id))
+    # 注册命令行命令
+    from wxcloudrun import commands
+    commands.init_app(app)
+    
+    # 注册定时任务，每个Web进程在处理第一个请求时启动调度线程
+    from wxcloudrun import tasks  # noqa: F401
+    from wxcloudrun.scheduler import scheduler
+    if config.SCHEDULER_ENABLED:
+        app.before_first_request(lambda: scheduler.start(app))
+    
+    # 用户加载回调，使用缓存
+    from wxcloudrun.dao import load_user
+    login_manager.user_loader(load_user)
     
-    # 确保数据库表已创建
-    with app.app_context():
-        db.create_all()
+    # 数据库表结构由 flask db upgrade 创建和升级，启动时不连接数据库
     
     return app
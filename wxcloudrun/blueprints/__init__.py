@@ -3,6 +3,7 @@ from .students import students_bp
 from .packages import packages_bp
 from .records import records_bp
 from .wechat import wechat_bp
+from .export import export_bp
 
 def init_app(app):
     """
@@ -13,3 +14,4 @@ def init_app(app):
     app.register_blueprint(packages_bp)
     app.register_blueprint(records_bp)
     app.register_blueprint(wechat_bp)
+    app.register_blueprint(export_bp)
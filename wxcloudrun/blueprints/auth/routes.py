@@ -4,7 +4,10 @@ from sqlalchemy import func
 
 from wxcloudrun.model import User
 from wxcloudrun import db
-from wxcloudrun.response import make_succ_empty_response, make_succ_response, make_err_response
+from wxcloudrun.dao import invalidate_user, user_cache, student_count_cache, get_job_runs
+from wxcloudrun.pool import pool_stats
+from wxcloudrun.wechat import wechat_client, token_manager
+from wxcloudrun.response import make_succ_empty_response, make_succ_response, make_err_response, serialize
 
 # 创建蓝图
 auth_bp = Blueprint('auth', __name__)
@@ -32,14 +35,6 @@ def login():
             flash('请输入用户名和密码')
             return redirect(url_for('auth.login'))
 
-        # 首次使用时，创建一个默认管理员账户
-        admin_exists = User.query.filter(func.lower(User.username) == func.lower('admin')).first()
-        if not admin_exists:
-            default_admin = User(username='admin', is_admin=True)
-            default_admin.set_password('admin')
-            db.session.add(default_admin)
-            db.session.commit()
-
         # 用户身份验证
         user = User.query.filter(func.lower(User.username) == func.lower(username)).first()
         if user and user.check_password(password):
@@ -101,6 +96,7 @@ def admin():
             new_user.set_password(password)
             db.session.add(new_user)
             db.session.commit()
+            invalidate_user(new_user.id)
             
             flash('用户添加成功')
             return redirect(url_for('auth.admin'))
@@ -124,6 +120,7 @@ def admin():
                 
             db.session.delete(user)
             db.session.commit()
+            invalidate_user(user_id)
             
             flash('用户删除成功')
             return redirect(url_for('auth.admin'))
@@ -148,10 +145,59 @@ def admin():
                 
             user.set_password(new_password)
             db.session.commit()
+            invalidate_user(user_id)
             
             flash('密码修改成功')
             return redirect(url_for('auth.admin'))
     
     # 获取所有用户
     users = User.query.all()
-    return render_template('admin.html', users=users) 
\ No newline at end of file
+    return render_template('admin.html', users=users)
+
+@auth_bp.route('/api/admin/cache-stats', methods=['GET'])
+@login_required
+def cache_stats():
+    """
+    获取进程内缓存的命中统计（仅管理员）
+    """
+    if not current_user.is_admin:
+        return make_err_response('权限不足，您不是管理员')
+    return make_succ_response({
+        'user': user_cache.stats(),
+        'student_count': student_count_cache.stats()
+    })
+
+@auth_bp.route('/api/admin/pool-stats', methods=['GET'])
+@login_required
+def db_pool_stats():
+    """
+    获取当前进程数据库连接池的状态和获取连接的等待时间分布（仅管理员）
+    """
+    if not current_user.is_admin:
+        return make_err_response('权限不足，您不是管理员')
+    return make_succ_response(pool_stats(db.engine))
+
+@auth_bp.route('/api/admin/wechat-stats', methods=['GET'])
+@login_required
+def wechat_stats():
+    """
+    获取当前进程访问微信接口的耗时统计和 access_token 缓存统计（仅管理员）
+    """
+    if not current_user.is_admin:
+        return make_err_response('权限不足，您不是管理员')
+    return make_succ_response({
+        'endpoints': wechat_client.metrics.snapshot(),
+        'access_token': token_manager.stats()
+    })
+
+@auth_bp.route('/api/admin/job-runs', methods=['GET'])
+@login_required
+def job_runs():
+    """
+    获取定时任务的执行记录（仅管理员）
+    """
+    if not current_user.is_admin:
+        return make_err_response('权限不足，您不是管理员')
+    name = request.args.get('name')
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return make_succ_response(serialize(get_job_runs(name, limit)))
@@ -0,0 +1 @@
+from .routes import export_bp
@@ -0,0 +1,84 @@
+import csv
+import io
+from datetime import datetime
+
+from flask import Blueprint, Response, request, stream_with_context
+from flask_login import login_required
+from wxcloudrun.dao import EXPORT_ENTITIES, get_export_columns, iter_export_rows
+from wxcloudrun import response
+from wxcloudrun.response import make_err_response
+
+# 创建蓝图
+export_bp = Blueprint('export', __name__)
+
+# 每批从数据库读取并写出的行数
+EXPORT_CHUNK_SIZE = 1000
+
+
+def _csv_chunks(columns, batches):
+    """
+    逐批生成CSV内容，首行为列名；带BOM以便Excel正确识别中文
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(columns, batches):
+    """
+    逐批生成NDJSON内容，每行一个JSON对象
+    """
+    for rows in batches:
+        lines = []
+        for row in rows:
+            line = response.json_dumps(dict(zip(columns, row)))
+            lines.append(line if isinstance(line, bytes) else line.encode('utf-8'))
+        lines.append(b'')
+        yield b'\n'.join(lines)
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+
+@export_bp.route('/api/export/<entity>', methods=['GET'])
+@login_required
+def api_export(entity):
+    """
+    流式导出数据，不一次性加载全部数据
+    支持的实体：students、packages、records、consumption
+    参数：format=csv|ndjson，start/end=YYYY-MM-DD（可选），status（可选，学生和课时包）
+    """
+    if entity not in EXPORT_ENTITIES:
+        return make_err_response('不支持导出的数据类型: {}'.format(entity))
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        return make_err_response('format 仅支持 csv 或 ndjson')
+
+    try:
+        start_date = _parse_date(request.args.get('start'))
+        end_date = _parse_date(request.args.get('end'))
+    except ValueError:
+        return make_err_response('日期格式错误，应为 YYYY-MM-DD')
+
+    columns = get_export_columns(entity)
+    batches = iter_export_rows(entity, start_date, end_date, request.args.get('status'), EXPORT_CHUNK_SIZE)
+    if fmt == 'csv':
+        body, mimetype = _csv_chunks(columns, batches), 'text/csv; charset=utf-8'
+    else:
+        body, mimetype = _ndjson_chunks(columns, batches), 'application/x-ndjson'
+
+    filename = '{}-{}.{}'.format(entity, datetime.now().strftime('%Y%m%d%H%M%S'), fmt)
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': 'attachment; filename={}'.format(filename),
+        'X-Accel-Buffering': 'no'
+    })
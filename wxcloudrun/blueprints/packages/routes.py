@@ -1,11 +1,14 @@
+import math
+
 from flask import Blueprint, request
 from flask_login import login_required, current_user
 from wxcloudrun.dao import (
     get_student_course_packages, get_active_course_packages,
     get_package_by_id, add_course_package, update_course_package,
-    delete_course_package, get_all_course_packages
+    delete_course_package, get_course_packages_page, add_student_course_package,
+    get_student_by_id
 )
-from wxcloudrun.response import make_succ_empty_response, make_succ_response, make_err_response
+from wxcloudrun.response import make_succ_empty_response, make_succ_response, make_err_response, serialize
 
 # 创建蓝图
 packages_bp = Blueprint('packages', __name__)
@@ -26,29 +29,41 @@ def api_get_student_packages(student_id):
         else:
             packages = get_student_course_packages(student_id)
         
-        # 格式化输出数据
-        items = []
-        for package in packages:
-            items.append({
-                'id': package.id,
-                'studentId': package.student_id,
-                'basePackageId': package.base_package_id,
-                'name': package.name,
-                'totalHours': package.total_hours,
-                'usedHours': package.used_hours,
-                'remainingHours': package.remaining_hours,
-                'isActive': package.is_active,
-                'startDate': package.start_date.isoformat() if package.start_date else None,
-                'endDate': package.end_date.isoformat() if package.end_date else None,
-                'createdAt': package.created_at.isoformat() if package.created_at else None,
-                'operatorId': package.operator_id,
-                'operatorName': package.operator.username if package.operator else None
-            })
+        # 格式化输出数据（基础课时包已随查询一起加载）
+        items = serialize(packages)
         
         return make_succ_response(items)
     except Exception as e:
         return make_err_response(str(e))
 
+@packages_bp.route('/api/students/<int:student_id>/packages', methods=['POST'])
+@login_required
+def api_add_student_package(student_id):
+    """
+    为学生分配课时包
+    """
+    try:
+        # 获取请求数据
+        request_data = request.get_json() or {}
+        
+        if not request_data.get('coursePackageId'):
+            return make_err_response('课时包ID不能为空')
+        
+        # 验证学生是否存在
+        if not get_student_by_id(student_id):
+            return make_err_response('学生不存在')
+        
+        package = add_student_course_package(student_id, request_data)
+        if not package:
+            return make_err_response('分配课时包失败')
+        
+        # 格式化输出数据
+        result = serialize(package)
+        
+        return make_succ_response(result)
+    except Exception as e:
+        return make_err_response(str(e))
+
 @packages_bp.route('/api/packages/<int:package_id>', methods=['GET'])
 @login_required
 def api_get_package(package_id):
@@ -62,15 +77,7 @@ def api_get_package(package_id):
             return make_err_response('课时包不存在', 404)
         
         # 格式化输出数据
-        result = {
-            'id': package.id,
-            'name': package.name,
-            'totalHours': package.total_hours,
-            'isActive': package.is_active,
-            'startDate': package.start_date.isoformat() if package.start_date else None,
-            'endDate': package.end_date.isoformat() if package.end_date else None,
-            'createdAt': package.created_at.isoformat() if package.created_at else None
-        }
+        result = serialize(package)
         
         return make_succ_response(result)
     except Exception as e:
@@ -95,20 +102,16 @@ def api_add_package():
             return make_err_response('总课时必须大于0')
         
         # 添加课时包
-        package = add_course_package(
-            name=request_data.get('name'),
-            total_hours=total_hours,
-            is_active=request_data.get('isActive', True),
-        )
+        package = add_course_package({
+            'name': request_data.get('name'),
+            'total_hours': total_hours,
+            'notes': request_data.get('notes')
+        })
+        if not package:
+            return make_err_response('添加课时包失败')
         
         # 格式化输出数据
-        result = {
-            'id': package.id,
-            'name': package.name,
-            'totalHours': package.total_hours,
-            'isActive': package.is_active,
-            'createdAt': package.created_at.isoformat() if package.created_at else None
-        }
+        result = serialize(package)
         
         return make_succ_response(result)
     except Exception as e:
@@ -137,27 +140,16 @@ def api_get_packages():
             per_page = 100
         
         # 获取分页数据
-        pagination = get_all_course_packages(page, per_page, status)
-        
-        # 格式化输出数据
-        items = []
-        for package in pagination.items:
-            items.append({
-                'id': package.id,
-                'name': package.name,
-                'totalHours': package.total_hours,
-                'isActive': package.is_active,
-                'createdAt': package.created_at.isoformat() if package.created_at else None
-            })
+        packages, total_count = get_course_packages_page(page, per_page, status)
         
         # 返回结果
         result = {
-            'items': items,
+            'items': serialize(packages),
             'pagination': {
-                'page': pagination.page,
-                'per_page': pagination.per_page,
-                'total': pagination.total,
-                'pages': pagination.pages
+                'page': page,
+                'per_page': per_page,
+                'total': total_count,
+                'pages': math.ceil(total_count / per_page)
             }
         }
         
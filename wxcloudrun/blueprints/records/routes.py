@@ -1,10 +1,13 @@
+from datetime import datetime
+
 from flask import Blueprint, request
 from flask_login import login_required, current_user
 from wxcloudrun.dao import (
     get_student_records, add_class_record,
-    get_student_consumption_records, add_consumption_record
+    get_student_consumption_records, add_consumption_record, InsufficientHoursError,
+    add_attendance_batch
 )
-from wxcloudrun.response import make_succ_empty_response, make_succ_response, make_err_response
+from wxcloudrun.response import make_succ_empty_response, make_succ_response, make_err_response, serialize
 
 # 创建蓝图
 records_bp = Blueprint('records', __name__)
@@ -19,17 +22,7 @@ def api_get_student_records(student_id):
         records = get_student_records(student_id)
         
         # 格式化输出数据
-        result = []
-        for record in records:
-            result.append({
-                'id': record.id,
-                'studentId': record.student_id,
-                'date': record.class_date.isoformat() if record.class_date else None,
-                'content': record.content,
-                'createdAt': record.created_at.isoformat() if record.created_at else None,
-                'operatorId': record.operator_id,
-                'operatorName': record.operator.username if record.operator else None
-            })
+        result = serialize(records)
         
         return make_succ_response(result)
     except Exception as e:
@@ -56,23 +49,17 @@ def api_add_class_record():
             return make_err_response('上课内容不能为空')
         
         # 添加上课记录
-        record = add_class_record(
-            student_id=request_data.get('studentId'),
-            class_date=request_data.get('date'),
-            content=request_data.get('content'),
-            operator_id=current_user.id
-        )
+        record = add_class_record({
+            'studentId': request_data.get('studentId'),
+            'date': request_data.get('date'),
+            'content': request_data.get('content'),
+            'operatorId': current_user.id
+        })
+        if not record:
+            return make_err_response('添加上课记录失败')
         
         # 格式化输出数据
-        result = {
-            'id': record.id,
-            'studentId': record.student_id,
-            'date': record.class_date.isoformat() if record.class_date else None,
-            'content': record.content,
-            'createdAt': record.created_at.isoformat() if record.created_at else None,
-            'operatorId': record.operator_id,
-            'operatorName': record.operator.username if record.operator else None
-        }
+        result = serialize(record)
         
         return make_succ_response(result)
     except Exception as e:
@@ -92,19 +79,7 @@ def api_get_student_consumption_records(student_id):
         records = get_student_consumption_records(student_id, package_id)
         
         # 格式化输出数据
-        result = []
-        for record in records:
-            result.append({
-                'id': record.id,
-                'studentId': record.student_id,
-                'packageId': record.package_id,
-                'packageName': record.package.name if record.package else f'课时包 #{record.package_id}',
-                'consumptionHours': record.consumption_hours,
-                'remainingHours': record.remaining_hours,
-                'operationTime': record.operation_time.isoformat() if record.operation_time else None,
-                'operatorId': record.operator_id,
-                'operatorName': record.operator.username if record.operator else None
-            })
+        result = serialize(records)
         
         return make_succ_response(result)
     except Exception as e:
@@ -135,27 +110,106 @@ def api_add_consumption_record():
         if consumption_hours <= 0:
             return make_err_response('消耗课时必须大于0')
         
-        # 添加消耗记录
-        record = add_consumption_record(
-            student_id=request_data.get('studentId'),
-            package_id=request_data.get('packageId'),
-            consumption_hours=consumption_hours,
-            operator_id=current_user.id
-        )
+        # 添加消耗记录（课时不足时返回明确的错误信息）
+        try:
+            record = add_consumption_record({
+                'studentId': request_data.get('studentId'),
+                'packageId': request_data.get('packageId'),
+                'consumptionHours': consumption_hours,
+                'operationTime': request_data.get('operationTime'),
+                'operatorId': current_user.id,
+                'operatorName': current_user.username
+            })
+        except InsufficientHoursError as e:
+            return make_err_response(str(e))
         
         # 格式化输出数据
-        result = {
-            'id': record.id,
-            'studentId': record.student_id,
-            'packageId': record.package_id,
-            'packageName': record.package.name if record.package else f'课时包 #{record.package_id}',
-            'consumptionHours': record.consumption_hours,
-            'remainingHours': record.remaining_hours,
-            'operationTime': record.operation_time.isoformat() if record.operation_time else None,
-            'operatorId': record.operator_id,
-            'operatorName': record.operator.username if record.operator else None
-        }
+        result = serialize(record)
         
         return make_succ_response(result)
     except Exception as e:
-        return make_err_response(str(e)) 
\ No newline at end of file
+        return make_err_response(str(e))
+
+@records_bp.route('/api/attendance/batch', methods=['POST'])
+@login_required
+def api_add_attendance_batch():
+    """
+    批量登记一节课的出勤，一次请求完成全班的课时扣减和上课记录
+    """
+    try:
+        # 获取请求数据
+        request_data = request.get_json() or {}
+        raw_items = request_data.get('items')
+        
+        if not raw_items or not isinstance(raw_items, list):
+            return make_err_response('出勤列表不能为空')
+        
+        if len(raw_items) > 500:
+            return make_err_response('单次最多登记500名学生')
+        
+        # 解析上课日期
+        class_date = None
+        if request_data.get('date'):
+            try:
+                class_date = datetime.strptime(request_data.get('date'), '%Y-%m-%d').date()
+            except ValueError:
+                return make_err_response('无效的上课日期')
+        
+        # 逐项校验，校验失败的项不进入事务
+        results = [None] * len(raw_items)
+        items = []
+        positions = []
+        for index, raw in enumerate(raw_items):
+            try:
+                student_id = int(raw.get('studentId'))
+                hours = float(raw.get('hours'))
+            except (TypeError, ValueError, AttributeError):
+                results[index] = {'studentId': None if not isinstance(raw, dict) else raw.get('studentId'),
+                                  'success': False, 'errorMsg': '学生ID或课时无效'}
+                continue
+            if hours <= 0:
+                results[index] = {'studentId': student_id, 'success': False, 'errorMsg': '消耗课时必须大于0'}
+                continue
+            # 课时包ID可选，未指定时自动选择
+            package_id = raw.get('packageId')
+            if package_id in (None, ''):
+                package_id = None
+            else:
+                try:
+                    package_id = int(str(package_id))
+                except (TypeError, ValueError):
+                    package_id = 0
+                if package_id <= 0:
+                    results[index] = {'studentId': student_id, 'success': False, 'errorMsg': '课时包ID无效'}
+                    continue
+            items.append({
+                'studentId': student_id,
+                'packageId': package_id,
+                'hours': hours,
+                'content': raw.get('content') or request_data.get('content')
+            })
+            positions.append(index)
+        
+        # 批量扣减课时并写入记录
+        if items:
+            batch_results = add_attendance_batch(
+                items,
+                class_date=class_date,
+                operator_id=current_user.id,
+                operator_name=current_user.username
+            )
+            for index, item_result in zip(positions, batch_results):
+                results[index] = item_result
+        
+        # 格式化输出数据
+        for index, item_result in enumerate(results):
+            item_result['index'] = index
+        succeeded = sum(1 for r in results if r['success'])
+        
+        return make_succ_response({
+            'items': results,
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded
+        })
+    except Exception as e:
+        return make_err_response(str(e))
@@ -1,11 +1,18 @@
-from flask import Blueprint, render_template, request, jsonify
+import io
+import math
+import time
+
+from flask import Blueprint, render_template, request, jsonify, current_app
 from flask_login import login_required, current_user
 from wxcloudrun.dao import (
     get_all_students, get_student_by_id, add_student, update_student, delete_student,
-    recalculate_student_hours
+    recalculate_student_hours, get_students_by_cursor, encode_cursor, decode_cursor,
+    count_students, get_student_overview,
+    read_import_csv, validate_student_import, import_students, search_students
 )
 from wxcloudrun.model import Student
-from wxcloudrun.response import make_succ_empty_response, make_succ_response, make_err_response
+from wxcloudrun.response import make_succ_empty_response, make_succ_response, make_err_response, serialize
+from wxcloudrun.scheduler import scheduler
 
 # 创建蓝图
 students_bp = Blueprint('students', __name__)
@@ -34,42 +41,110 @@ def api_get_students():
         if status not in valid_statuses:
             return make_err_response('无效的状态筛选值')
         
+        # 总数统计方式：exact-精确，approx-近似，none-不统计
+        # 游标分页默认不统计总数
+        cursor_mode = request.args.get('mode') == 'cursor' or 'after_id' in request.args or 'before_id' in request.args
+        count = request.args.get('count', 'none' if cursor_mode else 'exact')
+        if count not in ('exact', 'approx', 'none'):
+            return make_err_response('无效的总数统计方式')
+        
+        # 排序方式，游标分页只支持按ID倒序
+        sort = request.args.get('sort', 'id')
+        order = request.args.get('order', 'desc')
+        if sort not in ('id', 'remaining_hours') or order not in ('asc', 'desc'):
+            return make_err_response('无效的排序方式')
+        if cursor_mode and (sort != 'id' or order != 'desc'):
+            return make_err_response('游标分页只支持按ID倒序排列')
+        
         # 限制每页数量范围
         if per_page < 1:
             per_page = 10
         elif per_page > 100:
             per_page = 100
         
-        # 获取分页数据
-        students,total_count = get_all_students(page, per_page, status)
+        # 传入游标参数时使用游标分页，避免深分页的OFFSET扫描和总数统计
+        after_cursor = request.args.get('after_id')
+        before_cursor = request.args.get('before_id')
+        
+        if cursor_mode:
+            after_id = decode_cursor(after_cursor)
+            before_id = decode_cursor(before_cursor)
+            if (after_cursor and after_id is None) or (before_cursor and before_id is None):
+                return make_err_response('无效的分页游标')
+            students, next_id, prev_id = get_students_by_cursor(per_page, status, after_id, before_id)
+            total_count = count_students(status, count)
+        else:
+            # 获取分页数据
+            students,total_count = get_all_students(page, per_page, status, count, sort, order)
         
         # 格式化输出数据
-        items = []
-        for student in students:
-            items.append({
-                'id': student.id,
-                'name': student.name,
-                'phone': student.phone,
-                'email': student.email,
-                'birthdate': student.birthdate.isoformat() if student.birthdate else None,
-                'address': student.address,
-                'notes': student.notes,
-                'status': student.status,
-                'registerDate': student.register_date.isoformat() if student.register_date else None
-            })
+        items = serialize(students)
         
         # 返回结果
-        result = {
-            'items': items,
+        if cursor_mode:
+            result = {
+                'items': items,
+                'pagination': {
+                    'mode': 'cursor',
+                    'per_page': per_page,
+                    'next_cursor': encode_cursor(next_id),
+                    'prev_cursor': encode_cursor(prev_id),
+                    'has_next': next_id is not None,
+                    'has_prev': prev_id is not None,
+                    'total': total_count
+                }
+            }
+        else:
+            result = {
+                'items': items,
+                'pagination': {
+                    'page': page,
+                    'per_page': per_page,
+                    'total': total_count,
+                    'pages': math.ceil(total_count / per_page) if total_count is not None else None
+                }
+            }
+        
+        return make_succ_response(result)
+    except Exception as e:
+        return make_err_response(str(e))
+
+@students_bp.route('/api/students/search', methods=['GET'])
+@login_required
+def api_search_students():
+    """
+    按姓名、手机号（支持尾号）或邮箱检索学生，分页返回，不统计总数
+    """
+    try:
+        q = request.args.get('q', '').strip()
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', 10, type=int)
+        status = request.args.get('status', 'all')
+        
+        if not q:
+            return make_err_response('检索关键字不能为空')
+        if len(q) > 50:
+            return make_err_response('检索关键字过长')
+        if status not in ['all', 'active', 'inactive', 'new']:
+            return make_err_response('无效的状态筛选值')
+        
+        # 限制页码和每页数量范围
+        page = max(page, 1)
+        if per_page < 1:
+            per_page = 10
+        elif per_page > 100:
+            per_page = 100
+        
+        students, has_more = search_students(q, page, per_page, status)
+        
+        return make_succ_response({
+            'items': serialize(students),
             'pagination': {
                 'page': page,
                 'per_page': per_page,
-                'total': total_count,
-                'pages': total_count / per_page
+                'has_next': has_more
             }
-        }
-        
-        return make_succ_response(result)
+        })
     except Exception as e:
         return make_err_response(str(e))
 
@@ -85,18 +160,46 @@ def api_get_student(student_id):
         if not student:
             return make_err_response('学生不存在', 404)
         
+        # 格式化输出数据
+        result = serialize(student)
+        
+        return make_succ_response(result)
+    except Exception as e:
+        return make_err_response(str(e))
+
+@students_bp.route('/api/students/<int:student_id>/overview', methods=['GET'])
+@login_required
+def api_get_student_overview(student_id):
+    """
+    获取学生详情概览：学生信息、课时包、上课记录和课消记录，一次请求返回
+    """
+    try:
+        # 各部分的数量上限（可选，为0时不返回该部分）
+        limits = {}
+        for name in ('packages_limit', 'records_limit', 'consumption_limit'):
+            value = request.args.get(name, type=int)
+            if value is not None and value < 0:
+                return make_err_response('无效的数量上限')
+            limits[name] = value
+        active_only = request.args.get('active_only', 'false').lower() == 'true'
+        
+        overview = get_student_overview(
+            student_id,
+            package_limit=limits['packages_limit'],
+            record_limit=limits['records_limit'],
+            consumption_limit=limits['consumption_limit'],
+            active_only=active_only
+        )
+        if not overview:
+            return make_err_response('学生不存在')
+        
         # 格式化输出数据
         result = {
-            'id': student.id,
-            'name': student.name,
-            'phone': student.phone,
-            'email': student.email,
-            'birthdate': student.birthdate.isoformat() if student.birthdate else None,
-            'address': student.address,
-            'notes': student.notes,
-            'status': student.status,
-            'registerDate': student.register_date.isoformat() if student.register_date else None,
-         }
+            'student': serialize(overview['student']),
+            'packages': serialize(overview['packages']),
+            'records': serialize(overview['records']),
+            'consumptionRecords': serialize(overview['consumptionRecords'])
+        }
         
         return make_succ_response(result)
     except Exception as e:
@@ -117,40 +220,69 @@ def api_add_student():
             return make_err_response('姓名不能为空')
         
         # 添加学生
-        student = add_student(
-            name=request_data.get('name'),
-            phone=request_data.get('phone'),
-            email=request_data.get('email'),
-            birthdate=request_data.get('birthdate'),
-            address=request_data.get('address'),
-            notes=request_data.get('notes'),
-            status=request_data.get('status', 'new'),  # 默认为新客户
-            operator_id=current_user.id,
-            total_hours=request_data.get('totalHours', 0),
-            used_hours=request_data.get('usedHours', 0),
-            remaining_hours=request_data.get('remainingHours', 0)
-        )
+        student = add_student({
+            'name': request_data.get('name'),
+            'phone': request_data.get('phone'),
+            'email': request_data.get('email'),
+            'birthdate': request_data.get('birthdate'),
+            'address': request_data.get('address'),
+            'notes': request_data.get('notes'),
+            'openid': request_data.get('openid'),
+            'status': request_data.get('status', 'new')  # 默认为新客户
+        })
+        if not student:
+            return make_err_response('添加学生失败')
         
         # 格式化输出数据
-        result = {
-            'id': student.id,
-            'name': student.name,
-            'phone': student.phone,
-            'email': student.email,
-            'birthdate': student.birthdate.isoformat() if student.birthdate else None,
-            'address': student.address,
-            'notes': student.notes,
-            'status': student.status,
-            'registerDate': student.register_date.isoformat() if student.register_date else None,
-            'lastClassDate': student.last_class_date.isoformat() if student.last_class_date else None,
-            'remainingHours': student.remaining_hours,
-            'usedHours': student.used_hours
-        }
+        result = serialize(student)
         
         return make_succ_response(result)
     except Exception as e:
         return make_err_response(str(e))
 
+@students_bp.route('/api/students/import', methods=['POST'])
+@login_required
+def api_import_students():
+    """
+    通过CSV批量导入学生及其课时包
+    CSV以 file 字段上传或直接作为请求体；dry_run=1 时只校验并返回报告
+    存在校验错误时不导入，skip_invalid=1 时跳过错误行导入其余行
+    默认每批提交，atomic=1 时在同一事务中导入，出错时全部回滚
+    """
+    try:
+        dry_run = request.args.get('dry_run', '0') in ('1', 'true')
+        skip_invalid = request.args.get('skip_invalid', '0') in ('1', 'true')
+        atomic = request.args.get('atomic', '0') in ('1', 'true')
+        
+        upload = request.files.get('file')
+        content = upload.read() if upload else request.get_data()
+        if not content:
+            return make_err_response('请上传CSV文件')
+        try:
+            rows = read_import_csv(io.StringIO(content.decode('utf-8-sig')))
+        except UnicodeDecodeError:
+            return make_err_response('CSV文件需使用UTF-8编码')
+        
+        started = time.monotonic()
+        records, errors = validate_student_import(rows)
+        report = {
+            'dryRun': dry_run,
+            'total': len(rows),
+            'valid': len(records),
+            'invalid': len(errors),
+            'errors': errors[:500],
+            'imported': 0,
+            'importedPackages': 0
+        }
+        
+        if not dry_run and (not errors or skip_invalid):
+            report['imported'], report['importedPackages'] = import_students(records, atomic=atomic)
+        report['elapsed'] = round(time.monotonic() - started, 3)
+        
+        return make_succ_response(report)
+    except Exception as e:
+        return make_err_response(str(e))
+
 @students_bp.route('/api/students/<int:student_id>', methods=['PUT'])
 @login_required
 def api_update_student(student_id):
@@ -166,35 +298,14 @@ def api_update_student(student_id):
         if not student:
             return make_err_response('学生不存在', 404)
         
-        # 更新学生信息
-        updated_student = update_student(
-            student_id=student_id,
-            name=request_data.get('name'),
-            phone=request_data.get('phone'),
-            email=request_data.get('email'),
-            birthdate=request_data.get('birthdate'),
-            address=request_data.get('address'),
-            notes=request_data.get('notes'),
-            status=request_data.get('status'),
-            remaining_hours=request_data.get('remainingHours'),
-            used_hours=request_data.get('usedHours')
-        )
+        # 更新学生信息（只更新请求中提供的字段，课时由课时包管理）
+        fields = ('name', 'phone', 'email', 'birthdate', 'address', 'notes', 'status', 'openid')
+        updated_student = update_student(student_id, {k: request_data[k] for k in fields if k in request_data})
+        if not updated_student:
+            return make_err_response('更新学生失败')
         
         # 格式化输出数据
-        result = {
-            'id': updated_student.id,
-            'name': updated_student.name,
-            'phone': updated_student.phone,
-            'email': updated_student.email,
-            'birthdate': updated_student.birthdate.isoformat() if updated_student.birthdate else None,
-            'address': updated_student.address,
-            'notes': updated_student.notes,
-            'status': updated_student.status,
-            'registerDate': updated_student.register_date.isoformat() if updated_student.register_date else None,
-            'lastClassDate': updated_student.last_class_date.isoformat() if updated_student.last_class_date else None,
-            'remainingHours': updated_student.remaining_hours,
-            'usedHours': updated_student.used_hours
-        }
+        result = serialize(updated_student)
         
         return make_succ_response(result)
     except Exception as e:
@@ -232,16 +343,33 @@ def recalculate_student_hours_api(student_id):
             return make_err_response('学生不存在', 404)
         
         # 重新计算课时
-        updated_student = recalculate_student_hours(student_id)
+        balance = recalculate_student_hours(student_id)
+        if not balance:
+            return make_err_response('重新计算课时失败')
         
         # 返回更新后的课时信息
-        result = {
-            'id': updated_student.id,
-            'name': updated_student.name,
-            'remainingHours': updated_student.remaining_hours,
-            'usedHours': updated_student.used_hours
-        }
+        result = serialize(student)
         
         return make_succ_response(result)
     except Exception as e:
-        return make_err_response(str(e)) 
\ No newline at end of file
+        return make_err_response(str(e))
+
+@students_bp.route('/api/admin/student-balances/rebuild', methods=['POST'])
+@login_required
+def rebuild_student_balances_api():
+    """
+    在后台重新计算所有学生的课时统计（仅管理员）
+    立即返回执行记录ID，进度和结果通过 /api/admin/job-runs?name=rebuild_balances 查看
+    """
+    try:
+        if not current_user.is_admin:
+            return make_err_response('权限不足，您不是管理员')
+        
+        # 独占任务，已在执行时认领失败
+        run_id = scheduler.submit(current_app._get_current_object(), 'rebuild_balances')
+        if run_id is None:
+            return make_err_response('课时统计正在重新计算')
+        
+        return make_succ_response({'runId': run_id})
+    except Exception as e:
+        return make_err_response(str(e))
@@ -1,7 +1,12 @@
-from flask import Blueprint, request
-from flask_login import login_required
-import requests
-from wxcloudrun.response import make_succ_response, make_err_response
+from flask import Blueprint, request, current_app
+from flask_login import login_required, current_user
+
+import config
+from wxcloudrun.dao import get_message_students, create_message_job, get_message_job
+from wxcloudrun.response import make_succ_response, make_err_response, serialize
+from wxcloudrun.wechat import (
+    wechat_client, token_manager, send_template_message, render_template_data, bulk_sender
+)
 
 # 创建蓝图
 wechat_bp = Blueprint('wechat', __name__)
@@ -19,13 +24,10 @@ def api_get_wechat_token():
         if not appid or not secret:
             return make_err_response('缺少appid或secret参数')
         
-        # 调用微信API
-        response = requests.get(
-            f'https://api.weixin.qq.com/cgi-bin/token?grant_type=client_credential&appid={appid}&secret={secret}'
-        )
-        data = response.json()
+        # 使用缓存的token，过期前自动刷新
+        access_token, expires_in = token_manager.get_token(appid, secret)
         
-        return make_succ_response(data)
+        return make_succ_response({'access_token': access_token, 'expires_in': expires_in})
     except Exception as e:
         return make_err_response(str(e))
 
@@ -44,10 +46,12 @@ def api_get_openid():
             return make_err_response('缺少必要参数')
         
         # 调用微信API
-        response = requests.get(
-            f'https://api.weixin.qq.com/sns/jscode2session?appid={appid}&secret={secret}&js_code={js_code}&grant_type=authorization_code'
-        )
-        data = response.json()
+        data = wechat_client.get('/sns/jscode2session', params={
+            'appid': appid,
+            'secret': secret,
+            'js_code': js_code,
+            'grant_type': 'authorization_code'
+        })
         
         return make_succ_response(data)
     except Exception as e:
@@ -67,10 +71,11 @@ def api_get_user_info():
             return make_err_response('缺少必要参数')
         
         # 调用微信API
-        response = requests.get(
-            f'https://api.weixin.qq.com/sns/userinfo?access_token={access_token}&openid={openid}&lang=zh_CN'
-        )
-        data = response.json()
+        data = wechat_client.get('/sns/userinfo', params={
+            'access_token': access_token,
+            'openid': openid,
+            'lang': 'zh_CN'
+        })
         
         return make_succ_response(data)
     except Exception as e:
@@ -86,24 +91,22 @@ def api_send_message():
         # 获取请求数据
         request_data = request.get_json()
         
-        # 验证必填字段
+        # 未传入access_token时使用服务端的appid和secret获取
         access_token = request_data.get('access_token')
-        if not access_token:
+        appid = request_data.get('appid') or config.WECHAT_APPID
+        secret = request_data.get('secret') or config.WECHAT_SECRET
+        if not access_token and not (appid and secret):
             return make_err_response('缺少access_token参数')
         
-        # 转发请求到微信API
-        response = requests.post(
-            f'https://api.weixin.qq.com/cgi-bin/message/template/send?access_token={access_token}',
-            json={
-                'touser': request_data.get('touser'),
-                'template_id': request_data.get('template_id'),
-                'url': request_data.get('url'),
-                'miniprogram': request_data.get('miniprogram'),
-                'data': request_data.get('data')
-            }
-        )
+        message = {
+            'touser': request_data.get('touser'),
+            'template_id': request_data.get('template_id'),
+            'url': request_data.get('url'),
+            'miniprogram': request_data.get('miniprogram'),
+            'data': request_data.get('data')
+        }
         
-        data = response.json()
+        data = send_template_message(message, appid, secret, access_token)
         
         # 检查微信API响应
         if data.get('errcode') != 0:
@@ -111,4 +114,76 @@ def api_send_message():
         
         return make_succ_response(data)
     except Exception as e:
-        return make_err_response(str(e)) 
\ No newline at end of file
+        return make_err_response(str(e))
+
+# 单个批量发送任务的最大接收人数
+MAX_BULK_RECIPIENTS = 10000
+
+@wechat_bp.route('/wx/act/sendmessage/bulk', methods=['POST'])
+@login_required
+def api_send_message_bulk():
+    """
+    批量发送模板消息，创建任务后在后台发送，立即返回任务ID
+    接收人可以是 recipients（[{touser, data}]），或按 studentIds、maxRemainingHours、status 筛选的学生
+    模板数据中的 {name}、{remainingHours} 会替换为学生的信息
+    """
+    try:
+        request_data = request.get_json()
+        
+        appid = request_data.get('appid') or config.WECHAT_APPID
+        secret = request_data.get('secret') or config.WECHAT_SECRET
+        template_id = request_data.get('template_id')
+        if not appid or not secret:
+            return make_err_response('缺少appid或secret参数')
+        if not template_id:
+            return make_err_response('缺少template_id参数')
+        
+        data = request_data.get('data') or {}
+        if request_data.get('recipients') is not None:
+            recipients = [{
+                'touser': item.get('touser'),
+                'data': item.get('data') or data
+            } for item in request_data['recipients']]
+        else:
+            student_ids = request_data.get('studentIds')
+            max_remaining_hours = request_data.get('maxRemainingHours')
+            if student_ids is None and max_remaining_hours is None:
+                return make_err_response('请指定recipients、studentIds或maxRemainingHours')
+            students = get_message_students(student_ids, max_remaining_hours, request_data.get('status'))
+            recipients = [{
+                'student_id': student.id,
+                'touser': student.openid,
+                'data': render_template_data(data, {'name': student.name, 'remainingHours': '{:g}'.format(student.remaining_hours)})
+            } for student in students]
+        
+        if not recipients:
+            return make_err_response('没有符合条件的接收人')
+        if len(recipients) > MAX_BULK_RECIPIENTS:
+            return make_err_response(f'单次最多发送{MAX_BULK_RECIPIENTS}条')
+        
+        job = create_message_job(template_id, recipients, request_data.get('url'),
+                                 request_data.get('miniprogram'), current_user.id, appid)
+        bulk_sender.start(current_app._get_current_object(), job.id, appid, secret)
+        
+        return make_succ_response(serialize(job))
+    except Exception as e:
+        return make_err_response(str(e))
+
+@wechat_bp.route('/wx/act/sendmessage/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def api_get_message_job(job_id):
+    """
+    获取批量发送任务的进度和每个接收人的发送结果
+    """
+    try:
+        status = request.args.get('status')
+        limit = min(request.args.get('limit', 1000, type=int), 10000)
+        job, recipients = get_message_job(job_id, status, limit)
+        if job is None:
+            return make_err_response('任务不存在')
+        
+        result = serialize(job)
+        result['recipients'] = serialize(recipients)
+        return make_succ_response(result)
+    except Exception as e:
+        return make_err_response(str(e))
@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    进程内的TTL/LRU缓存，线程安全
+    超过ttl秒的条目视为过期，超过maxsize时淘汰最久未使用的条目
+    """
+
+    def __init__(self, ttl=60, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None, allow_stale=False, max_age=None):
+        """
+        获取缓存值
+        :param key: 缓存键
+        :param default: 未命中时的返回值
+        :param allow_stale: 是否允许返回已过期的值
+        :param max_age: 只返回写入不超过该秒数的值（可选，小于ttl时生效）
+        :return: 缓存值
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            now = time.monotonic()
+            if (expires_at < now and not allow_stale) or \
+                    (max_age is not None and expires_at - self.ttl + max_age < now):
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        写入缓存值
+        :param key: 缓存键
+        :param value: 缓存值
+        """
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *keys):
+        """
+        删除指定的缓存键
+        """
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+        获取缓存统计信息
+        :return: 命中数、未命中数、命中率和当前条目数
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self._data)
+            }
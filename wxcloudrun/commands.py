@@ -0,0 +1,150 @@
+import time
+
+import click
+from flask.cli import AppGroup
+
+from wxcloudrun import db
+
+# 数据库管理命令组：flask db ...
+db_cli = AppGroup('db', help='数据库迁移和维护命令')
+
+
+@db_cli.command('upgrade')
+@click.option('--target', type=int, default=None, help='目标版本号，默认升级到最新')
+def db_upgrade(target):
+    """
+    执行尚未执行的数据库迁移
+    """
+    from wxcloudrun import migrations
+    applied = migrations.upgrade(target, echo=click.echo)
+    if not applied:
+        click.echo('Database is up to date.')
+
+
+@db_cli.command('current')
+def db_current():
+    """
+    显示数据库当前的迁移版本和待执行的迁移
+    """
+    from wxcloudrun import migrations
+    with db.engine.connect() as connection:
+        click.echo('Current version: {:04d}'.format(migrations.current_version(connection)))
+        for migration in migrations.pending_migrations(connection):
+            click.echo('Pending {:04d}: {}'.format(migration.version, migration.description))
+
+
+@db_cli.command('create-admin')
+@click.option('--username', default='admin', show_default=True, envvar='ADMIN_USERNAME', help='管理员用户名')
+@click.password_option(envvar='ADMIN_PASSWORD', help='管理员密码，未指定时读取 ADMIN_PASSWORD 或提示输入')
+def db_create_admin(username, password):
+    """
+    创建初始管理员账户，已存在管理员时不做任何操作
+    """
+    from sqlalchemy import func
+    from wxcloudrun.model import User
+    if User.query.filter(User.is_admin.is_(True)).first():
+        click.echo('An admin user already exists, nothing to do.')
+        return
+    if User.query.filter(func.lower(User.username) == func.lower(username)).first():
+        raise click.ClickException('User {} already exists.'.format(username))
+    admin = User(username=username, is_admin=True)
+    admin.set_password(password)
+    db.session.add(admin)
+    db.session.commit()
+    click.echo('Created admin user {}.'.format(username))
+
+
+@db_cli.command('rebuild-balances')
+@click.option('--batch-size', type=int, default=5000, show_default=True, help='每批处理的学生ID跨度')
+def db_rebuild_balances(batch_size):
+    """
+    重新计算所有学生的课时汇总
+    """
+    from wxcloudrun.dao import rebuild_student_balances
+    started = time.monotonic()
+
+    def report(done, total):
+        click.echo('Rebuilt {}/{} student balances ({:.1f}s)'.format(done, total, time.monotonic() - started))
+
+    done = rebuild_student_balances(batch_size, progress=report)
+    click.echo('Done: {} student balances in {:.1f}s.'.format(done, time.monotonic() - started))
+
+
+# 学生数据命令组：flask students ...
+students_cli = AppGroup('students', help='学生数据批量处理命令')
+
+
+@students_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--dry-run', is_flag=True, help='只校验并输出报告，不写入数据库')
+@click.option('--skip-invalid', is_flag=True, help='跳过校验失败的行，导入其余行')
+@click.option('--chunk-size', type=int, default=1000, show_default=True, help='每批提交的行数')
+@click.option('--atomic', is_flag=True, help='在同一事务中导入全部行，出错时全部回滚')
+def students_import(path, dry_run, skip_invalid, chunk_size, atomic):
+    """
+    从CSV批量导入学生及其课时包
+    """
+    from wxcloudrun.dao import read_import_csv, validate_student_import, import_students
+    started = time.monotonic()
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        rows = read_import_csv(f)
+    records, errors = validate_student_import(rows)
+    click.echo('Validated {} rows: {} valid, {} invalid ({:.1f}s)'.format(
+        len(rows), len(records), len(errors), time.monotonic() - started))
+    for error in errors:
+        click.echo('  line {}: {}'.format(error['line'], '; '.join(error['errors'])))
+
+    if dry_run:
+        return
+    if errors and not skip_invalid:
+        raise click.ClickException('Validation failed, nothing imported. Use --skip-invalid to import valid rows.')
+
+    def report(done, total):
+        click.echo('Imported {}/{} students ({:.1f}s)'.format(done, total, time.monotonic() - started))
+
+    students, packages = import_students(records, chunk_size, progress=report, atomic=atomic)
+    elapsed = time.monotonic() - started
+    click.echo('Done: {} students and {} packages in {:.1f}s ({:.0f} rows/s).'.format(
+        students, packages, elapsed, students / elapsed if elapsed else 0))
+
+
+# 定时任务命令组：flask jobs ...
+jobs_cli = AppGroup('jobs', help='定时任务命令')
+
+
+@jobs_cli.command('run')
+@click.argument('name')
+@click.option('--dry-run', is_flag=True, help='只统计不执行')
+def jobs_run(name, dry_run):
+    """
+    立即执行一次定时任务
+    """
+    from wxcloudrun.scheduler import scheduler
+    if name not in scheduler.tasks:
+        raise click.ClickException('Unknown job {}, available: {}'.format(name, ', '.join(sorted(scheduler.tasks))))
+    run_id, result = scheduler.run(name, dry_run=dry_run)
+    if run_id is None:
+        raise click.ClickException('Job {} is already running.'.format(name))
+    click.echo('Run {}: {}'.format(run_id, result))
+
+
+@jobs_cli.command('history')
+@click.option('--name', default=None, help='任务名称')
+@click.option('--limit', type=int, default=20, show_default=True)
+def jobs_history(name, limit):
+    """
+    显示定时任务的执行记录
+    """
+    from wxcloudrun.dao import get_job_runs
+    for run in get_job_runs(name, limit):
+        click.echo('{:>6} {:<12} {:<9} {} {}'.format(
+            run.id, run.name, run.status, run.started_at.strftime('%Y-%m-%d %H:%M:%S'), run.error or run.result or ''))
+
+
+def init_app(app):
+    """
+    注册所有命令行命令
+    """
+    app.cli.add_command(db_cli)
+    app.cli.add_command(students_cli)
+    app.cli.add_command(jobs_cli)
@@ -1,23 +1,133 @@
+import base64
+import binascii
+import csv
+import json
 import logging
-from datetime import datetime
-from sqlalchemy.exc import OperationalError
-from sqlalchemy import func
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import contains_eager, joinedload
+from sqlalchemy import func, text, update, select, case, or_, and_, bindparam
+from sqlalchemy.dialects.mysql import match as mysql_match
 
+import config
 from wxcloudrun import db
-from wxcloudrun.model import Student, ClassRecord, User, CoursePackage, StudentCoursePackage
+from wxcloudrun.cache import TTLCache
+from wxcloudrun.model import (
+    Student, ClassRecord, User, CoursePackage, StudentCoursePackage, ConsumptionRecord, StudentBalance,
+    MessageJob, MessageJobRecipient, JobRun, ReminderLog, reverse_phone_digits
+)
 
 # 初始化日志
 logger = logging.getLogger('log')
 
+# 学生总数缓存，按状态筛选值缓存
+# 缓存在每个进程内，增删学生只清除当前进程的缓存：精确总数在其他进程中最多滞后 EXACT_COUNT_CACHE_TTL 秒，
+# 近似总数最多滞后 COUNT_CACHE_TTL 秒（或更久，直到该进程重新统计）
+student_count_cache = TTLCache(ttl=config.COUNT_CACHE_TTL, maxsize=32)
+
+# 登录用户信息缓存，按用户ID缓存
+user_cache = TTLCache(ttl=config.USER_CACHE_TTL, maxsize=1024)
+
+
+# User 相关操作
+def load_user(user_id):
+    """
+    加载登录用户，优先使用缓存，避免每个请求查询一次数据库
+    缓存的是用户的基本信息，返回的User对象不属于任何数据库会话
+    :param user_id: 用户ID
+    :return: 用户，不存在时返回None
+    """
+    user_id = int(user_id)
+    identity = user_cache.get(user_id)
+    if identity is None:
+        user = User.query.get(user_id)
+        if user is None:
+            return None
+        identity = {'id': user.id, 'username': user.username, 'is_admin': user.is_admin}
+        user_cache.set(user_id, identity)
+    return User(**identity)
+
+
+def invalidate_user(*user_ids):
+    """
+    用户被删除、修改密码或权限后清除缓存
+    :param user_ids: 用户ID
+    """
+    user_cache.invalidate(*[int(user_id) for user_id in user_ids])
+
+
 
 # Student 相关操作
-def get_all_students(page=1, per_page=20, status=None):
+def _student_count_key(status):
+    return status if status and status != 'all' else 'all'
+
+
+def invalidate_student_counts(*statuses):
+    """
+    学生状态变化后清除对应的总数缓存（总是包括全部学生的总数）
+    :param statuses: 受影响的状态值
+    """
+    student_count_cache.invalidate('all', *[_student_count_key(s) for s in statuses])
+
+
+def _estimate_student_rows():
+    """
+    从MySQL表统计信息中读取Student表的估算行数
+    :return: 估算行数，不支持时返回None
+    """
+    if db.engine.dialect.name != 'mysql':
+        return None
+    row = db.session.execute(
+        text("SELECT TABLE_ROWS FROM information_schema.TABLES "
+             "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :name"),
+        {'name': Student.__tablename__}
+    ).first()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+def count_students(status=None, count='exact'):
+    """
+    统计学生总数，优先使用进程内缓存
+    多进程部署时其他进程增删学生不会清除本进程的缓存，精确总数最多滞后 EXACT_COUNT_CACHE_TTL 秒
+    :param status: 状态筛选（可选）
+    :param count: exact-精确（复用 EXACT_COUNT_CACHE_TTL 秒内的统计），approx-允许过期缓存或表统计估算，none-不统计
+    :return: 学生总数，count为none时返回None
+    """
+    if count == 'none':
+        return None
+
+    key = _student_count_key(status)
+    if count == 'approx':
+        total_count = student_count_cache.get(key, allow_stale=True)
+    else:
+        total_count = student_count_cache.get(key, max_age=config.EXACT_COUNT_CACHE_TTL)
+    if total_count is not None:
+        return total_count
+
+    if count == 'approx' and key == 'all':
+        total_count = _estimate_student_rows()
+        if total_count is not None:
+            return total_count
+
+    query = Student.query
+    if key != 'all':
+        query = query.filter(Student.status == status)
+    total_count = query.count()
+    student_count_cache.set(key, total_count)
+    return total_count
+
+
+def get_all_students(page=1, per_page=20, status=None, count='exact', sort='id', order='desc'):
     """
     获取学生信息，支持分页和状态筛选
     :param page: 页码（从1开始）
     :param per_page: 每页数量
     :param status: 状态筛选（可选）
-    :return: 学生列表和总数
+    :param count: 总数统计方式：exact、approx或none
+    :param sort: 排序字段：id 或 remaining_hours（使用课时汇总表，无需实时聚合）
+    :param order: 排序方向：asc 或 desc
+    :return: 学生列表和总数（count为none时总数为None）
     """
     try:
         query = Student.query
@@ -27,19 +137,148 @@ def get_all_students(page=1, per_page=20, status=None):
             query = query.filter(Student.status == status)
             
         # 计算总数
-        total_count = query.count()
+        total_count = count_students(status, count)
         
         # 进行分页
         offset = (page - 1) * per_page
         
         # 排序和分页
-        students = query.order_by(Student.id.desc()).offset(offset).limit(per_page).all()
+        if sort == 'remaining_hours':
+            remaining = func.coalesce(StudentBalance.remaining_hours, 0)
+            query = query.outerjoin(Student.balance).options(contains_eager(Student.balance))
+            if order == 'asc':
+                query = query.order_by(remaining.asc(), Student.id.asc())
+            else:
+                query = query.order_by(remaining.desc(), Student.id.desc())
+        elif order == 'asc':
+            query = query.order_by(Student.id.asc())
+        else:
+            query = query.order_by(Student.id.desc())
+        students = query.offset(offset).limit(per_page).all()
         
         return students, total_count
     except OperationalError as e:
         logger.info("get_all_students errorMsg= {} ".format(e))
         return [], 0
 
+
+def encode_cursor(student_id):
+    """
+    将学生ID编码为不透明的分页游标
+    :param student_id: 学生ID
+    :return: 游标字符串
+    """
+    if student_id is None:
+        return None
+    return base64.urlsafe_b64encode(str(student_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    解析分页游标，同时兼容直接传入的数字ID
+    :param cursor: 游标字符串
+    :return: 学生ID，无法解析时返回None
+    """
+    if not cursor:
+        return None
+    try:
+        if cursor.isdigit():
+            return int(cursor)
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        return None
+
+
+def get_students_by_cursor(per_page=20, status=None, after_id=None, before_id=None):
+    """
+    基于游标（keyset）获取学生信息，按ID倒序，不需要统计总数
+    :param per_page: 每页数量
+    :param status: 状态筛选（可选）
+    :param after_id: 返回ID小于该值的下一页
+    :param before_id: 返回ID大于该值的上一页
+    :return: 学生列表、下一页起点ID、上一页起点ID（不存在时为None）
+    """
+    try:
+        query = Student.query
+
+        # 如果提供了状态筛选
+        if status and status != 'all':
+            query = query.filter(Student.status == status)
+
+        # 多取一条用于判断是否还有更多数据
+        if before_id is not None:
+            query = query.filter(Student.id > before_id).order_by(Student.id.asc())
+            students = query.limit(per_page + 1).all()
+            has_more = len(students) > per_page
+            students = list(reversed(students[:per_page]))
+            next_id = students[-1].id if students else None
+            prev_id = students[0].id if students and has_more else None
+        else:
+            if after_id is not None:
+                query = query.filter(Student.id < after_id)
+            students = query.order_by(Student.id.desc()).limit(per_page + 1).all()
+            has_more = len(students) > per_page
+            students = students[:per_page]
+            next_id = students[-1].id if students and has_more else None
+            prev_id = students[0].id if students and after_id is not None else None
+
+        return students, next_id, prev_id
+    except OperationalError as e:
+        logger.info("get_students_by_cursor errorMsg= {} ".format(e))
+        return [], None, None
+
+
+# 全文检索中有特殊含义的字符
+FULLTEXT_OPERATORS = '+-<>()~*"@'
+
+
+def search_students(q, page=1, per_page=20, status=None):
+    """
+    按姓名、手机号或邮箱检索学生
+    纯数字（至少3位）按手机尾号检索；否则MySQL使用姓名和邮箱的ngram全文索引，其他数据库使用LIKE
+    结果按完全匹配、前缀匹配、相关度、ID倒序排列，不统计总数
+    :param q: 检索关键字
+    :param page: 页码
+    :param per_page: 每页数量
+    :param status: 状态筛选（可选）
+    :return: 学生列表、是否还有下一页
+    """
+    try:
+        query = Student.query
+        if status and status != 'all':
+            query = query.filter(Student.status == status)
+
+        digits = reverse_phone_digits(q)
+        if digits and len(digits) >= 3 and not q.strip(' +-0123456789'):
+            # 尾号反转后做前缀匹配，可以使用索引
+            query = query.filter(Student.phone_suffix.startswith(digits, autoescape=True))
+            order_by = [case((Student.phone_suffix == digits, 0), else_=1), Student.id.desc()]
+        else:
+            rank = case((Student.name == q, 0), (Student.name.startswith(q, autoescape=True), 1), else_=2)
+            phrase = ''.join(c for c in q if c not in FULLTEXT_OPERATORS).strip()
+            if db.engine.dialect.name == 'mysql' and len(phrase) >= 2:
+                # 短语检索，ngram分词下相当于子串匹配
+                score = mysql_match(Student.name, Student.email, against='"{}"'.format(phrase)).in_boolean_mode()
+                query = query.filter(score > 0)
+                order_by = [rank, score.desc(), Student.id.desc()]
+            elif db.engine.dialect.name == 'mysql':
+                # 单个字符低于ngram分词长度，使用姓名前缀索引
+                query = query.filter(Student.name.startswith(q, autoescape=True))
+                order_by = [rank, Student.id.desc()]
+            else:
+                query = query.filter(or_(Student.name.contains(q, autoescape=True),
+                                         Student.email.contains(q, autoescape=True)))
+                order_by = [rank, Student.id.desc()]
+
+        # 多取一条用于判断是否还有更多数据
+        students = query.order_by(*order_by).offset((page - 1) * per_page).limit(per_page + 1).all()
+        return students[:per_page], len(students) > per_page
+    except OperationalError as e:
+        logger.info("search_students errorMsg= {} ".format(e))
+        return [], False
+
+
 def get_student_by_id(student_id):
     """
     根据ID获取学生信息
@@ -74,16 +313,17 @@ def add_student(student_data):
             phone=student_data.get('phone'),
             email=student_data.get('email'),
             birthdate=birthdate,
-            total_hours=0,  # 默认为0，课时信息现在由课时包管理
-            used_hours=0,   # 默认为0，课时信息现在由课时包管理
-            remaining_hours=0,  # 默认为0，课时信息现在由课时包管理
             register_date=datetime.now().date(),
             address=student_data.get('address'),
             notes=student_data.get('notes'),
-            status=student_data.get('status', 'active')
+            status=student_data.get('status', 'active'),
+            openid=student_data.get('openid') or None
         )
+        # 课时信息由课时包管理，汇总从0开始
+        student.balance = StudentBalance(total_hours=0, used_hours=0, remaining_hours=0, active_package_count=0)
         db.session.add(student)
         db.session.commit()
+        invalidate_student_counts(student.status)
         return student
     except OperationalError as e:
         logger.info("add_student errorMsg= {} ".format(e))
@@ -106,6 +346,7 @@ def update_student(student_id, student_data):
         student = Student.query.get(student_id)
         if not student:
             return None
+        old_status = student.status
             
         # 更新学生信息
         if 'name' in student_data:
@@ -126,6 +367,8 @@ def update_student(student_id, student_data):
             student.address = student_data['address']
         if 'notes' in student_data:
             student.notes = student_data['notes']
+        if 'openid' in student_data:
+            student.openid = student_data['openid'] or None
         if 'status' in student_data:
             student.status = student_data['status']
         
@@ -133,6 +376,8 @@ def update_student(student_id, student_data):
         student.updated_at = datetime.now()
         
         db.session.commit()
+        if student.status != old_status:
+            invalidate_student_counts(old_status, student.status)
         return student
     except OperationalError as e:
         logger.info("update_student errorMsg= {} ".format(e))
@@ -154,8 +399,12 @@ def delete_student(student_id):
         student = Student.query.get(student_id)
         if not student:
             return False
+        status = student.status
+        if student.balance:
+            db.session.delete(student.balance)
         db.session.delete(student)
         db.session.commit()
+        invalidate_student_counts(status)
         return True
     except OperationalError as e:
         logger.info("delete_student errorMsg= {} ".format(e))
@@ -164,14 +413,20 @@ def delete_student(student_id):
 
 
 # ClassRecord 相关操作
-def get_student_records(student_id):
+def get_student_records(student_id, limit=None):
     """
     获取学生的上课记录
     :param student_id: 学生ID
+    :param limit: 最多返回的记录数（可选）
     :return: 上课记录列表
     """
     try:
-        return ClassRecord.query.filter_by(student_id=student_id).order_by(ClassRecord.date.desc()).all()
+        # 操作人随记录一起加载，避免逐条懒加载
+        query = ClassRecord.query.options(joinedload(ClassRecord.operator)) \
+            .filter_by(student_id=student_id).order_by(ClassRecord.class_date.desc(), ClassRecord.id.desc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
     except OperationalError as e:
         logger.info("get_student_records errorMsg= {} ".format(e))
         return []
@@ -198,19 +453,11 @@ def add_class_record(record_data):
         # 创建记录
         record = ClassRecord(
             student_id=record_data.get('studentId'),
-            date=class_date,
-            content=record_data.get('content')
+            class_date=class_date,
+            content=record_data.get('content'),
+            operator_id=record_data.get('operatorId')
         )
         db.session.add(record)
-        
-        # 更新学生的最后上课日期
-        student = Student.query.get(record_data.get('studentId'))
-        if student:
-            # 只有当新记录日期更晚，或者之前没有上课记录时，才更新最后上课日期
-            if not student.last_class_date or class_date > student.last_class_date:
-                student.last_class_date = class_date
-            student.updated_at = datetime.now()
-        
         db.session.commit()
         return record
     except OperationalError as e:
@@ -223,84 +470,171 @@ def add_class_record(record_data):
         return None
 
 
-def get_student_consumption_records(student_id, package_id=None):
+def get_student_consumption_records(student_id, package_id=None, limit=None):
     """
     获取学生的课消记录
     :param student_id: 学生ID
     :param package_id: 课时包ID（可选，如果提供则只获取特定课时包的记录）
+    :param limit: 最多返回的记录数（可选）
     :return: 课消记录列表
     """
     try:
-        query = ConsumptionRecord.query.filter_by(student_id=student_id)
+        # 操作人、学生课时包和基础课时包随记录一起加载，避免逐条懒加载
+        query = ConsumptionRecord.query.options(
+            joinedload(ConsumptionRecord.operator),
+            joinedload(ConsumptionRecord.package).joinedload(StudentCoursePackage.course_package)
+        ).filter_by(student_id=student_id)
         
         if package_id is not None:
             query = query.filter_by(package_id=package_id)
             
-        records = query.order_by(ConsumptionRecord.operation_time.desc()).all()
-        return records
+        query = query.order_by(ConsumptionRecord.operation_time.desc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
     except OperationalError as e:
         logger.info(f"get_student_consumption_records errorMsg= {e}")
         return []
 
+class InsufficientHoursError(Exception):
+    """
+    课时包剩余课时不足（或课时包不可用）时抛出
+    """
+    pass
+
+
+def package_not_expired(column=StudentCoursePackage.expire_date):
+    """
+    课时包未过期的条件：没有有效期或有效期不早于今天，与 expire_course_packages 标记过期的条件互补
+    :param column: 有效期列
+    :return: SQL条件
+    """
+    return or_(column.is_(None), column >= datetime.now().date())
+
+
+def deduct_package_hours(package_id, consumption_hours, student_id=None):
+    """
+    以单条条件UPDATE原子扣减学生课时包的课时，不提交事务
+    只有活跃、未过期且剩余课时足够的课时包才会被扣减，并发扣减不会丢失更新
+    已过期但尚未被定时任务标记为 expired 的课时包同样不能扣减
+    :param package_id: 学生课时包ID
+    :param consumption_hours: 消耗课时
+    :param student_id: 学生ID（可选，提供时校验课时包归属）
+    :return: 扣减后的(剩余课时, 已用课时)，条件不满足时返回None
+    """
+    table = StudentCoursePackage.__table__
+    conditions = [
+        table.c.id == package_id,
+        table.c.status == 'active',
+        table.c.remaining_hours >= consumption_hours,
+        package_not_expired(table.c.expire_date)
+    ]
+    if student_id is not None:
+        conditions.append(table.c.student_id == student_id)
+
+    # status 放在最前面，保证在MySQL中也基于扣减前的剩余课时计算
+    stmt = update(table).where(*conditions).ordered_values(
+        (table.c.status, case(
+            (table.c.remaining_hours - consumption_hours <= 0, 'used'),
+            else_=table.c.status
+        )),
+        (table.c.used_hours, table.c.used_hours + consumption_hours),
+        (table.c.remaining_hours, table.c.remaining_hours - consumption_hours),
+        (table.c.updated_at, func.now())
+    )
+    if db.session.execute(stmt).rowcount != 1:
+        return None
+
+    # 该行已被本事务的UPDATE锁定，读取到的就是扣减后的值
+    row = db.session.execute(
+        select(table.c.remaining_hours, table.c.used_hours).where(table.c.id == package_id)
+    ).first()
+    return row.remaining_hours, row.used_hours
+
+
+def _parse_operation_time(record_data):
+    if record_data.get('operationTime'):
+        return datetime.fromisoformat(record_data.get('operationTime').replace('Z', '+00:00'))
+    return datetime.now()
+
+
 def add_consumption_record(record_data):
     """
     添加课消记录
+    扣减课时和写入记录在同一事务中完成，行锁只在UPDATE到提交之间持有
     :param record_data: 包含课消信息的字典
     :return: 新添加的课消记录对象
+    :raises InsufficientHoursError: 课时包剩余课时不足
     """
     try:
         student_id = record_data.get('studentId')
         package_id = record_data.get('packageId')
-        consumption_hours = record_data.get('consumptionHours')
+        consumption_hours = float(record_data.get('consumptionHours'))
+        operation_time = _parse_operation_time(record_data)
         
-        # 如果没有指定课时包ID，则尝试自动选择一个活跃的课时包
-        if not package_id:
-            active_packages = get_active_course_packages(student_id)
-            if not active_packages:
-                raise Exception("没有可用的活跃课时包")
-            
-            # 选择剩余课时最少的课时包（先用完策略）
-            package = min(active_packages, key=lambda p: p.remaining_hours)
-            package_id = package.id
+        # 如果没有指定课时包ID，则按剩余课时从少到多依次尝试（先用完策略）
+        if package_id:
+            candidate_ids = [package_id]
         else:
-            package = get_package_by_id(package_id)
-            if not package:
-                raise Exception(f"课时包 (ID: {package_id}) 不存在")
+            candidate_ids = db.session.execute(
+                select(StudentCoursePackage.id)
+                .where(StudentCoursePackage.student_id == student_id,
+                       StudentCoursePackage.status == 'active',
+                       StudentCoursePackage.remaining_hours >= consumption_hours,
+                       package_not_expired())
+                .order_by(StudentCoursePackage.remaining_hours.asc(), StudentCoursePackage.id.asc())
+            ).scalars().all()
+            if not candidate_ids:
+                raise InsufficientHoursError(f"没有剩余课时足够的活跃课时包，需要消耗: {consumption_hours}")
         
-        # 验证课时包是否有足够的剩余课时
-        if package.remaining_hours < consumption_hours:
-            raise Exception(f"课时包剩余课时不足，当前剩余: {package.remaining_hours}，需要消耗: {consumption_hours}")
+        # 原子扣减课时，并发扣减导致某个课时包不足时尝试下一个
+        balance = None
+        for candidate_id in candidate_ids:
+            balance = deduct_package_hours(candidate_id, consumption_hours, student_id)
+            if balance is not None:
+                package_id = candidate_id
+                break
         
-        # 更新课时包数据
-        old_remaining = package.remaining_hours
-        old_used = package.used_hours
-        
-        package.used_hours += consumption_hours
-        package.remaining_hours -= consumption_hours
+        if balance is None:
+            db.session.rollback()
+            if not package_id:
+                raise InsufficientHoursError(f"没有剩余课时足够的活跃课时包，需要消耗: {consumption_hours}")
+            package = StudentCoursePackage.query.get(package_id)
+            if not package or (student_id and package.student_id != int(student_id)):
+                raise InsufficientHoursError(f"课时包 (ID: {package_id}) 不存在")
+            if package.status != 'active':
+                raise InsufficientHoursError(f"课时包 (ID: {package_id}) 不可用，当前状态: {package.status}")
+            if package.expire_date and package.expire_date < datetime.now().date():
+                raise InsufficientHoursError(f"课时包 (ID: {package_id}) 已于 {package.expire_date.isoformat()} 过期")
+            raise InsufficientHoursError(f"课时包剩余课时不足，当前剩余: {package.remaining_hours}，需要消耗: {consumption_hours}")
         
-        # 如果课时包用完了，更新状态
-        if package.remaining_hours <= 0:
-            package.status = 'used'
+        remaining_hours, used_hours = balance
         
         # 创建新的课消记录
         new_record = ConsumptionRecord(
             student_id=student_id,
             package_id=package_id,
             consumption_hours=consumption_hours,
-            remaining_hours=package.remaining_hours,
-            used_hours=package.used_hours,
-            operation_time=datetime.fromisoformat(record_data.get('operationTime').replace('Z', '+00:00')) if 'operationTime' in record_data else datetime.now(),
+            remaining_hours=remaining_hours,
+            used_hours=used_hours,
+            operation_time=operation_time,
+            operator_id=record_data.get('operatorId'),
             operator_name=record_data.get('operatorName', '系统')
         )
         
         db.session.add(new_record)
         
-        # 不再直接更新学生的冗余课时字段
-        # 这些数据现在从课时包中聚合获取
+        # 同一事务内增量更新学生课时汇总
+        apply_balance_delta(student_id, used=consumption_hours, remaining=-consumption_hours,
+                            active=-1 if remaining_hours <= 0 else 0, consumed_at=operation_time)
         
         db.session.commit()
         
         return new_record
+    except InsufficientHoursError as e:
+        db.session.rollback()
+        logger.info(f"add_consumption_record errorMsg= {e}")
+        raise
     except OperationalError as e:
         db.session.rollback()
         logger.info(f"add_consumption_record errorMsg= {e}")
@@ -311,32 +645,401 @@ def add_consumption_record(record_data):
         raise Exception(f"添加课消记录失败: {str(e)}")
 
 
-# CoursePackage 相关操作
-def get_student_course_packages(student_id):
+def add_attendance_batch(items, class_date=None, operator_id=None, operator_name='系统'):
     """
-    获取学生的所有课时包
+    批量登记一节课的出勤：为每个学生扣减课时并写入课消记录和上课记录
+    所有写入在同一事务中完成，课消记录和上课记录使用批量INSERT
+    单个学生课时不足不会影响其他学生
+    :param items: 列表，每项包含 studentId、packageId（可选，整数）、hours、content
+    :param class_date: 上课日期（date，默认今天）
+    :param operator_id: 操作人ID
+    :param operator_name: 操作人名称
+    :return: 与items一一对应的结果列表
+    """
+    class_date = class_date or datetime.now().date()
+    operation_time = datetime.now()
+    results = [None] * len(items)
+    try:
+        # 未指定课时包的学生，一次性查出候选课时包（剩余课时从少到多）
+        auto_student_ids = {item['studentId'] for item in items if not item.get('packageId')}
+        candidates = {}
+        if auto_student_ids:
+            rows = db.session.execute(
+                select(StudentCoursePackage.id, StudentCoursePackage.student_id)
+                .where(StudentCoursePackage.student_id.in_(auto_student_ids),
+                       StudentCoursePackage.status == 'active',
+                       StudentCoursePackage.remaining_hours > 0,
+                       package_not_expired())
+                .order_by(StudentCoursePackage.remaining_hours.asc(), StudentCoursePackage.id.asc())
+            ).all()
+            for row in rows:
+                candidates.setdefault(row.student_id, []).append(row.id)
+
+        # 扣减前按课时包ID顺序一次锁定本次可能扣减的所有课时包（指定的和自动选择的候选），
+        # 之后的扣减只更新已锁定的行，避免并发批量登记之间按不同顺序加锁导致死锁
+        locked_ids = {item['packageId'] for item in items if item.get('packageId')}
+        for package_ids in candidates.values():
+            locked_ids.update(package_ids)
+        if locked_ids:
+            db.session.execute(
+                select(StudentCoursePackage.id)
+                .where(StudentCoursePackage.id.in_(locked_ids))
+                .order_by(StudentCoursePackage.id.asc())
+                .with_for_update()
+            ).all()
+
+        consumption_rows = []
+        class_rows = []
+        for index, item in enumerate(items):
+            student_id = item['studentId']
+            hours = item['hours']
+            package_ids = [item['packageId']] if item.get('packageId') else candidates.get(student_id, [])
+
+            balance = None
+            for package_id in package_ids:
+                balance = deduct_package_hours(package_id, hours, student_id)
+                if balance is not None:
+                    break
+
+            if balance is None:
+                results[index] = {
+                    'studentId': student_id,
+                    'success': False,
+                    'errorMsg': f"没有剩余课时足够的活跃课时包，需要消耗: {hours}"
+                }
+                continue
+
+            remaining_hours, used_hours = balance
+            consumption_rows.append({
+                'student_id': student_id,
+                'package_id': package_id,
+                'consumption_hours': hours,
+                'remaining_hours': remaining_hours,
+                'used_hours': used_hours,
+                'operation_time': operation_time,
+                'operator_id': operator_id,
+                'operator_name': operator_name
+            })
+            class_rows.append({
+                'student_id': student_id,
+                'class_date': class_date,
+                'content': item.get('content') or '',
+                'operator_id': operator_id
+            })
+            results[index] = {
+                'studentId': student_id,
+                'success': True,
+                'packageId': package_id,
+                'consumptionHours': hours,
+                'remainingHours': remaining_hours
+            }
+
+        if consumption_rows:
+            db.session.execute(ConsumptionRecord.__table__.insert(), consumption_rows)
+            db.session.execute(ClassRecord.__table__.insert(), class_rows)
+        
+        # 同一事务内增量更新学生课时汇总，按学生ID顺序加锁
+        for row in sorted(consumption_rows, key=lambda r: r['student_id']):
+            apply_balance_delta(row['student_id'], used=row['consumption_hours'], remaining=-row['consumption_hours'],
+                                active=-1 if row['remaining_hours'] <= 0 else 0, consumed_at=operation_time)
+        db.session.commit()
+        return results
+    except OperationalError as e:
+        db.session.rollback()
+        logger.info(f"add_attendance_batch errorMsg= {e}")
+        raise Exception(f"批量登记出勤失败: {str(e)}")
+    except Exception as e:
+        db.session.rollback()
+        logger.info(f"add_attendance_batch errorMsg= {e}")
+        raise Exception(f"批量登记出勤失败: {str(e)}")
+
+
+# StudentBalance 学生课时汇总相关操作
+BALANCE_COLUMNS = ['student_id', 'total_hours', 'used_hours', 'remaining_hours',
+                   'active_package_count', 'last_consumption_time']
+
+
+def student_balance_select(student_ids=None, id_range=None):
+    """
+    构造按学生聚合课时包和课消记录的查询
+    :param student_ids: 学生ID列表（可选，默认全部学生）
+    :param id_range: 学生ID范围 (起始ID, 结束ID)，左闭右开（可选）
+    :return: 列与BALANCE_COLUMNS一致的select
+    """
+    package_totals = (
+        select(
+            StudentCoursePackage.student_id.label('student_id'),
+            func.sum(CoursePackage.total_hours).label('total_hours'),
+            func.sum(StudentCoursePackage.used_hours).label('used_hours'),
+            func.sum(StudentCoursePackage.remaining_hours).label('remaining_hours'),
+            func.sum(case((StudentCoursePackage.status == 'active', 1), else_=0)).label('active_package_count')
+        )
+        .join(CoursePackage, CoursePackage.id == StudentCoursePackage.course_package_id)
+        .group_by(StudentCoursePackage.student_id)
+    )
+    last_consumption = (
+        select(
+            ConsumptionRecord.student_id.label('student_id'),
+            func.max(ConsumptionRecord.operation_time).label('last_consumption_time')
+        )
+        .group_by(ConsumptionRecord.student_id)
+    )
+    students = select(Student.id)
+    if student_ids is not None:
+        package_totals = package_totals.where(StudentCoursePackage.student_id.in_(student_ids))
+        last_consumption = last_consumption.where(ConsumptionRecord.student_id.in_(student_ids))
+        students = students.where(Student.id.in_(student_ids))
+    if id_range is not None:
+        start_id, end_id = id_range
+        package_totals = package_totals.where(StudentCoursePackage.student_id >= start_id,
+                                              StudentCoursePackage.student_id < end_id)
+        last_consumption = last_consumption.where(ConsumptionRecord.student_id >= start_id,
+                                                  ConsumptionRecord.student_id < end_id)
+        students = students.where(Student.id >= start_id, Student.id < end_id)
+
+    package_totals = package_totals.subquery()
+    last_consumption = last_consumption.subquery()
+    students = students.subquery()
+    return (
+        select(
+            students.c.id.label('student_id'),
+            func.coalesce(package_totals.c.total_hours, 0).label('total_hours'),
+            func.coalesce(package_totals.c.used_hours, 0).label('used_hours'),
+            func.coalesce(package_totals.c.remaining_hours, 0).label('remaining_hours'),
+            func.coalesce(package_totals.c.active_package_count, 0).label('active_package_count'),
+            last_consumption.c.last_consumption_time
+        )
+        .outerjoin(package_totals, package_totals.c.student_id == students.c.id)
+        .outerjoin(last_consumption, last_consumption.c.student_id == students.c.id)
+    )
+
+
+def refresh_student_balance(student_id):
+    """
+    从课时包聚合重新计算单个学生的课时汇总，不提交事务
+    先以 SELECT ... FOR UPDATE 锁定汇总行再聚合，同时进行的 apply_balance_delta 等到本事务提交后再叠加差值
     :param student_id: 学生ID
-    :return: 课时包列表
+    :return: 学生课时汇总
+    """
+    balance = db.session.get(StudentBalance, student_id, with_for_update=True, populate_existing=True)
+    row = db.session.execute(student_balance_select([student_id])).first()
+    if row is None:
+        return None
+    if balance is None:
+        balance = StudentBalance(student_id=student_id)
+        db.session.add(balance)
+    for name in BALANCE_COLUMNS[1:]:
+        setattr(balance, name, getattr(row, name))
+    return balance
+
+
+def rebuild_student_balances(batch_size=5000, progress=None):
     """
+    以集合操作重新计算所有学生的课时汇总
+    按学生ID分段，每段一次分组聚合加批量删除/插入，并单独提交
+    可以在课消、出勤等写入进行时执行：每段先按ID顺序锁定本段的课时包和汇总行（与扣减课时后更新汇总的加锁顺序一致），
+    同时进行的 apply_balance_delta 等到本段提交后再在重新计算的结果上叠加差值
+    :param batch_size: 每段的学生ID跨度
+    :param progress: 进度回调 progress(已处理学生数, 学生总数)（可选）
+    :return: 已处理的学生数
+    """
+    table = StudentBalance.__table__
     try:
-        packages = StudentCoursePackage.query.filter_by(student_id=student_id).order_by(StudentCoursePackage.purchase_date.desc()).all()
-        return packages
+        min_id, max_id, total = db.session.execute(
+            select(func.min(Student.id), func.max(Student.id), func.count(Student.id))
+        ).one()
+        if not total:
+            return 0
+
+        done = 0
+        for start_id in range(min_id, max_id + 1, batch_size):
+            end_id = start_id + batch_size
+            db.session.execute(
+                select(StudentCoursePackage.id)
+                .where(StudentCoursePackage.student_id >= start_id, StudentCoursePackage.student_id < end_id)
+                .order_by(StudentCoursePackage.id)
+                .with_for_update()
+            ).all()
+            db.session.execute(
+                select(table.c.student_id)
+                .where(table.c.student_id >= start_id, table.c.student_id < end_id)
+                .order_by(table.c.student_id)
+                .with_for_update()
+            ).all()
+
+            aggregate = student_balance_select(id_range=(start_id, end_id)).subquery()
+            db.session.execute(
+                table.delete().where(table.c.student_id >= start_id, table.c.student_id < end_id)
+            )
+            result = db.session.execute(table.insert().from_select(
+                BALANCE_COLUMNS,
+                select(*[aggregate.c[name] for name in BALANCE_COLUMNS])
+            ))
+            db.session.commit()
+
+            done += result.rowcount
+            if progress:
+                progress(done, total)
+        return done
     except OperationalError as e:
-        logger.info(f"get_student_course_packages errorMsg= {e}")
-        return []
+        logger.info(f"rebuild_student_balances errorMsg= {e}")
+        db.session.rollback()
+        raise
+
 
-def get_active_course_packages(student_id):
+def apply_balance_delta(student_id, total=0, used=0, remaining=0, active=0, consumed_at=None):
     """
-    获取学生的所有活跃课时包
+    按差值增量更新学生课时汇总，不提交事务
+    汇总行不存在时从课时包聚合创建
     :param student_id: 学生ID
-    :return: 活跃的课时包列表
+    :param total: 总课时变化
+    :param used: 已用课时变化
+    :param remaining: 剩余课时变化
+    :param active: 活跃课时包数量变化
+    :param consumed_at: 课消时间（可选）
     """
+    table = StudentBalance.__table__
+    values = {
+        table.c.total_hours: table.c.total_hours + total,
+        table.c.used_hours: table.c.used_hours + used,
+        table.c.remaining_hours: table.c.remaining_hours + remaining,
+        table.c.active_package_count: table.c.active_package_count + active
+    }
+    if consumed_at is not None:
+        values[table.c.last_consumption_time] = case(
+            (table.c.last_consumption_time.is_(None), consumed_at),
+            (table.c.last_consumption_time < consumed_at, consumed_at),
+            else_=table.c.last_consumption_time
+        )
+    result = db.session.execute(
+        update(table).where(table.c.student_id == student_id).values(values),
+        execution_options={'synchronize_session': False}
+    )
+    if result.rowcount == 0:
+        refresh_student_balance(student_id)
+
+
+def expire_course_packages(batch_size=1000, dry_run=False, progress=None):
+    """
+    将已用完和已过期的活跃课时包分别标记为 used 和 expired
+    每批先锁定一批符合条件的课时包ID，再按ID批量UPDATE，并重新统计受影响学生的活跃课时包数，每批单独提交
+    :param batch_size: 每批课时包数
+    :param dry_run: 只统计不更新
+    :param progress: 进度回调 progress(状态, 本状态已更新数)（可选）
+    :return: 各状态更新的课时包数
+    """
+    table = StudentCoursePackage.__table__
+    balances = StudentBalance.__table__
+    today = datetime.now().date()
+    # 已用完的先处理，同时过期和用完的课时包记为已用完
+    # 扣减时已排除过期的课时包（package_not_expired），这里只更新状态和活跃课时包数
+    sweeps = [
+        ('used', table.c.remaining_hours <= 0),
+        ('expired', table.c.expire_date < today)
+    ]
+    result = {}
     try:
-        packages = StudentCoursePackage.query.filter_by(student_id=student_id, status='active').order_by(StudentCoursePackage.purchase_date.desc()).all()
-        return packages
+        for status, condition in sweeps:
+            if dry_run:
+                # 前面的状态会先更新，统计时排除已计入的课时包
+                skipped = [~previous for previous_status, previous in sweeps if previous_status in result]
+                result[status] = db.session.execute(
+                    select(func.count()).select_from(table).where(table.c.status == 'active', condition, *skipped)
+                ).scalar()
+                continue
+
+            done = 0
+            while True:
+                rows = db.session.execute(
+                    select(table.c.id, table.c.student_id)
+                    .where(table.c.status == 'active', condition)
+                    .limit(batch_size).with_for_update()
+                ).all()
+                if not rows:
+                    break
+                db.session.execute(
+                    update(table).where(table.c.id.in_([row.id for row in rows]))
+                    .values(status=status, updated_at=func.now()),
+                    execution_options={'synchronize_session': False}
+                )
+                # 按课时包重新统计受影响学生的活跃课时包数
+                student_ids = sorted({row.student_id for row in rows})
+                active_count = select(func.count()).select_from(table).where(
+                    table.c.student_id == balances.c.student_id, table.c.status == 'active'
+                ).scalar_subquery()
+                db.session.execute(
+                    update(balances).where(balances.c.student_id.in_(student_ids))
+                    .values(active_package_count=active_count),
+                    execution_options={'synchronize_session': False}
+                )
+                db.session.commit()
+                done += len(rows)
+                if progress:
+                    progress(status, done)
+            result[status] = done
+        return result
     except OperationalError as e:
-        logger.info(f"get_active_course_packages errorMsg= {e}")
-        return []
+        logger.info(f"expire_course_packages errorMsg= {e}")
+        db.session.rollback()
+        raise
+
+
+# CoursePackage 相关操作
+def add_student_course_package(student_id, package_data):
+    """
+    为学生分配课时包
+    :param student_id: 学生ID
+    :param package_data: 课时包数据字典，包含 coursePackageId、purchaseDate、expireDate、notes
+    :return: 新添加的学生课时包
+    """
+    try:
+        # 获取基础课时包
+        course_package = CoursePackage.query.get(package_data.get('coursePackageId'))
+        if not course_package:
+            logger.warning(f"基础课时包 (ID: {package_data.get('coursePackageId')}) 不存在")
+            return None
+        
+        purchase_date = datetime.now().date()
+        if package_data.get('purchaseDate'):
+            try:
+                purchase_date = datetime.strptime(package_data['purchaseDate'], '%Y-%m-%d').date()
+            except ValueError:
+                logger.warning(f"Invalid purchase_date format: {package_data['purchaseDate']}")
+        
+        expire_date = None
+        if package_data.get('expireDate'):
+            try:
+                expire_date = datetime.strptime(package_data['expireDate'], '%Y-%m-%d').date()
+            except ValueError:
+                logger.warning(f"Invalid expire_date format: {package_data['expireDate']}")
+        
+        total_hours = course_package.total_hours or 0
+        package = StudentCoursePackage(
+            student_id=student_id,
+            course_package_id=course_package.id,
+            used_hours=0,
+            remaining_hours=total_hours,
+            purchase_date=purchase_date,
+            expire_date=expire_date,
+            status='active',
+            notes=package_data.get('notes')
+        )
+        db.session.add(package)
+        db.session.flush()
+        
+        # 同一事务内增量更新学生课时汇总
+        apply_balance_delta(student_id, total=total_hours, remaining=total_hours, active=1)
+        
+        db.session.commit()
+        return package
+    except OperationalError as e:
+        logger.info(f"add_student_course_package errorMsg= {e}")
+        db.session.rollback()
+        return None
+    except Exception as e:
+        logger.error(f"add_student_course_package error: {e}")
+        db.session.rollback()
+        return None
 
 def update_course_package(package_id, package_data):
     """
@@ -357,9 +1060,10 @@ def update_course_package(package_id, package_data):
             logger.warning(f"基础课时包 (ID: {package.course_package_id}) 不存在")
             return None
         
-        # 记录旧值用于更新学生总数 - 这对于监控变化仍然有用
+        # 记录旧值用于增量更新学生课时汇总
         old_used = package.used_hours
         old_remaining = package.remaining_hours
+        old_active = package.status == 'active'
         
         # 更新课时包信息
         if 'used_hours' in package_data:
@@ -391,16 +1095,14 @@ def update_course_package(package_id, package_data):
         # 更新最后修改时间
         package.updated_at = datetime.now()
         
-        # 更新学生的总课时信息
-        student = Student.query.get(package.student_id)
-        if student:
-            # 计算差值并更新
-            used_diff = package.used_hours - old_used
-            remaining_diff = package.remaining_hours - old_remaining
-            
-            student.used_hours += used_diff
-            student.remaining_hours += remaining_diff
-            student.updated_at = datetime.now()
+        # 按差值更新学生课时汇总
+        db.session.flush()
+        apply_balance_delta(
+            package.student_id,
+            used=package.used_hours - old_used,
+            remaining=package.remaining_hours - old_remaining,
+            active=int(package.status == 'active') - int(old_active)
+        )
         
         db.session.commit()
         return package
@@ -434,43 +1136,22 @@ def delete_course_package(package_id):
 
 def recalculate_student_hours(student_id):
     """
-    重新计算学生的总课时信息
+    重新计算学生的课时汇总
     :param student_id: 学生ID
-    :return: 是否成功
+    :return: 更新后的学生课时汇总，学生不存在时返回None
     """
     try:
         student = Student.query.get(student_id)
         if not student:
-            return False
-        
-        # 获取学生的所有课时包
-        student_packages = StudentCoursePackage.query.filter_by(student_id=student_id).all()
-        
-        # 计算总课时、已用课时和剩余课时
-        total_hours = 0
-        used_hours = 0
-        remaining_hours = 0
-        
-        for package in student_packages:
-            # 获取基础课时包总课时
-            course_package = CoursePackage.query.get(package.course_package_id)
-            if course_package:
-                total_hours += course_package.total_hours
-                used_hours += package.used_hours
-                remaining_hours += package.remaining_hours
-        
-        # 更新学生记录
-        student.total_hours = total_hours
-        student.used_hours = used_hours
-        student.remaining_hours = remaining_hours
-        student.updated_at = datetime.now()
+            return None
         
+        balance = refresh_student_balance(student_id)
         db.session.commit()
-        return True
+        return balance
     except OperationalError as e:
         logger.info(f"recalculate_student_hours errorMsg= {e}")
         db.session.rollback()
-        return False
+        return None
 
 # CoursePackage 基础课时包模块相关操作 
 def get_all_course_packages():
@@ -484,6 +1165,25 @@ def get_all_course_packages():
         logger.info(f"get_all_course_packages errorMsg= {e}")
         return []
 
+def get_course_packages_page(page=1, per_page=20, status=None):
+    """
+    分页获取基础课时包，支持状态筛选
+    :param page: 页码（从1开始）
+    :param per_page: 每页数量
+    :param status: 状态筛选（可选）
+    :return: 课时包列表和总数
+    """
+    try:
+        query = CoursePackage.query
+        if status and status != 'all':
+            query = query.filter(CoursePackage.status == status)
+        total_count = query.count()
+        packages = query.order_by(CoursePackage.id.desc()).offset((page - 1) * per_page).limit(per_page).all()
+        return packages, total_count
+    except OperationalError as e:
+        logger.info(f"get_course_packages_page errorMsg= {e}")
+        return [], 0
+
 def add_course_package(package_data):
     """
     添加新基础课时包
@@ -509,28 +1209,36 @@ def add_course_package(package_data):
         return None
 
 # StudentCoursePackage 学生课时包关联相关操作
-def get_student_course_packages(student_id):
+def get_student_course_packages(student_id, limit=None):
     """
     获取学生的所有课时包
     :param student_id: 学生ID
+    :param limit: 最多返回的课时包数（可选）
     :return: 课时包列表
     """
     try:
-        packages = StudentCoursePackage.query.filter_by(student_id=student_id).order_by(StudentCoursePackage.purchase_date.desc()).all()
-        return packages
+        query = StudentCoursePackage.query.options(joinedload(StudentCoursePackage.course_package)) \
+            .filter_by(student_id=student_id).order_by(StudentCoursePackage.purchase_date.desc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
     except OperationalError as e:
         logger.info(f"get_student_course_packages errorMsg= {e}")
         return []
 
-def get_active_course_packages(student_id):
+def get_active_course_packages(student_id, limit=None):
     """
     获取学生的所有活跃课时包
     :param student_id: 学生ID
+    :param limit: 最多返回的课时包数（可选）
     :return: 活跃的课时包列表
     """
     try:
-        packages = StudentCoursePackage.query.filter_by(student_id=student_id, status='active').order_by(StudentCoursePackage.purchase_date.desc()).all()
-        return packages
+        query = StudentCoursePackage.query.options(joinedload(StudentCoursePackage.course_package)) \
+            .filter_by(student_id=student_id, status='active').order_by(StudentCoursePackage.purchase_date.desc())
+        if limit:
+            query = query.limit(limit)
+        return query.all()
     except OperationalError as e:
         logger.info(f"get_active_course_packages errorMsg= {e}")
         return []
@@ -546,3 +1254,661 @@ def get_package_by_id(package_id):
     except OperationalError as e:
         logger.info(f"get_package_by_id errorMsg= {e}")
         return None
+
+
+# 学生概览相关操作
+def get_student_overview(student_id, package_limit=None, record_limit=None, consumption_limit=None,
+                         active_only=False):
+    """
+    一次获取学生详情所需的全部数据，最多固定4条查询：
+    学生（含课时汇总）、课时包、上课记录、课消记录（均已加载关联对象）
+    :param student_id: 学生ID
+    :param package_limit: 课时包数量上限（可选，为0时不查询该部分）
+    :param record_limit: 上课记录数量上限（可选，为0时不查询该部分）
+    :param consumption_limit: 课消记录数量上限（可选，为0时不查询该部分）
+    :param active_only: 是否只返回活跃课时包
+    :return: 包含 student、packages、records、consumptionRecords 的字典，学生不存在时返回None
+    """
+    student = get_student_by_id(student_id)
+    if not student:
+        return None
+    if package_limit == 0:
+        packages = []
+    elif active_only:
+        packages = get_active_course_packages(student_id, package_limit)
+    else:
+        packages = get_student_course_packages(student_id, package_limit)
+    return {
+        'student': student,
+        'packages': packages,
+        'records': get_student_records(student_id, record_limit) if record_limit != 0 else [],
+        'consumptionRecords': get_student_consumption_records(student_id, limit=consumption_limit)
+        if consumption_limit != 0 else []
+    }
+
+
+# 数据导出相关操作
+def _export_spec(entity):
+    """
+    导出实体的列定义、查询、日期字段和状态字段
+    :param entity: students、packages、records 或 consumption
+    :return: (列名列表, select, 日期字段, 状态字段)，不支持的实体返回None
+    """
+    if entity == 'students':
+        columns = [
+            ('id', Student.id), ('name', Student.name), ('phone', Student.phone), ('email', Student.email),
+            ('birthdate', Student.birthdate), ('registerDate', Student.register_date),
+            ('address', Student.address), ('status', Student.status), ('notes', Student.notes),
+            ('totalHours', StudentBalance.total_hours), ('usedHours', StudentBalance.used_hours),
+            ('remainingHours', StudentBalance.remaining_hours)
+        ]
+        query = select(*[c for _, c in columns]).outerjoin(StudentBalance, StudentBalance.student_id == Student.id)
+        return [n for n, _ in columns], query.order_by(Student.id), Student.register_date, Student.status
+    if entity == 'packages':
+        columns = [
+            ('id', StudentCoursePackage.id), ('studentId', StudentCoursePackage.student_id),
+            ('studentName', Student.name), ('coursePackageId', StudentCoursePackage.course_package_id),
+            ('packageName', CoursePackage.name), ('totalHours', CoursePackage.total_hours),
+            ('usedHours', StudentCoursePackage.used_hours), ('remainingHours', StudentCoursePackage.remaining_hours),
+            ('purchaseDate', StudentCoursePackage.purchase_date), ('expireDate', StudentCoursePackage.expire_date),
+            ('status', StudentCoursePackage.status), ('notes', StudentCoursePackage.notes)
+        ]
+        query = select(*[c for _, c in columns]) \
+            .outerjoin(Student, Student.id == StudentCoursePackage.student_id) \
+            .outerjoin(CoursePackage, CoursePackage.id == StudentCoursePackage.course_package_id)
+        return ([n for n, _ in columns], query.order_by(StudentCoursePackage.id),
+                StudentCoursePackage.purchase_date, StudentCoursePackage.status)
+    if entity == 'records':
+        columns = [
+            ('id', ClassRecord.id), ('studentId', ClassRecord.student_id), ('studentName', Student.name),
+            ('date', ClassRecord.class_date), ('content', ClassRecord.content),
+            ('operatorId', ClassRecord.operator_id), ('operatorName', User.username),
+            ('createdAt', ClassRecord.created_at)
+        ]
+        query = select(*[c for _, c in columns]) \
+            .outerjoin(Student, Student.id == ClassRecord.student_id) \
+            .outerjoin(User, User.id == ClassRecord.operator_id)
+        return [n for n, _ in columns], query.order_by(ClassRecord.id), ClassRecord.class_date, None
+    if entity == 'consumption':
+        columns = [
+            ('id', ConsumptionRecord.id), ('studentId', ConsumptionRecord.student_id), ('studentName', Student.name),
+            ('packageId', ConsumptionRecord.package_id), ('packageName', CoursePackage.name),
+            ('consumptionHours', ConsumptionRecord.consumption_hours),
+            ('remainingHours', ConsumptionRecord.remaining_hours), ('usedHours', ConsumptionRecord.used_hours),
+            ('operationTime', ConsumptionRecord.operation_time), ('operatorId', ConsumptionRecord.operator_id),
+            ('operatorName', ConsumptionRecord.operator_name)
+        ]
+        query = select(*[c for _, c in columns]) \
+            .outerjoin(Student, Student.id == ConsumptionRecord.student_id) \
+            .outerjoin(StudentCoursePackage, StudentCoursePackage.id == ConsumptionRecord.package_id) \
+            .outerjoin(CoursePackage, CoursePackage.id == StudentCoursePackage.course_package_id)
+        return [n for n, _ in columns], query.order_by(ConsumptionRecord.id), ConsumptionRecord.operation_time, None
+    return None
+
+
+EXPORT_ENTITIES = ('students', 'packages', 'records', 'consumption')
+
+
+def get_export_columns(entity):
+    """
+    获取导出实体的列名
+    :param entity: 导出实体
+    :return: 列名列表
+    """
+    return _export_spec(entity)[0]
+
+
+def iter_export_rows(entity, start_date=None, end_date=None, status=None, chunk_size=1000):
+    """
+    使用服务端游标分批读取导出数据，内存占用与总行数无关
+    使用独立连接，不占用请求的数据库会话
+    :param entity: 导出实体
+    :param start_date: 起始日期（可选，包含）
+    :param end_date: 结束日期（可选，包含）
+    :param status: 状态筛选（可选，仅学生和课时包支持）
+    :param chunk_size: 每批行数
+    :return: 生成器，每次产出一批行（元组列表）
+    """
+    _, query, date_column, status_column = _export_spec(entity)
+    if start_date:
+        query = query.where(date_column >= start_date)
+    if end_date:
+        query = query.where(date_column < end_date + timedelta(days=1))
+    if status and status != 'all' and status_column is not None:
+        query = query.where(status_column == status)
+
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(query)
+        for rows in result.partitions(chunk_size):
+            yield rows
+
+
+# 学生批量导入相关操作
+IMPORT_STUDENT_STATUSES = ('active', 'inactive', 'new')
+
+
+def read_import_csv(stream):
+    """
+    读取导入CSV，首行为列名，列名与导出一致
+    学生列：name、phone、email、birthdate、registerDate、address、status、notes
+    课时包列（可选）：coursePackageId、purchaseDate、expireDate、packageNotes
+    :param stream: 文本流或字符串行的可迭代对象
+    :return: 字典列表
+    """
+    rows = []
+    for row in csv.DictReader(stream):
+        # 去掉Excel保存时带上的BOM和首尾空白
+        rows.append({(key or '').lstrip('\ufeff').strip(): (value or '').strip() for key, value in row.items()})
+    return rows
+
+
+def _parse_import_date(row, field, errors, required=False):
+    value = row.get(field)
+    if not value:
+        if required:
+            errors.append(f"{field} 不能为空")
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        errors.append(f"{field} 日期格式错误，应为 YYYY-MM-DD: {value}")
+        return None
+
+
+def validate_student_import(rows):
+    """
+    一次性校验导入数据，不写入数据库
+    课时包和已有手机号各用一次批量查询校验
+    :param rows: read_import_csv 返回的字典列表
+    :return: (可导入的记录列表, 错误列表)；错误项包含 line（CSV行号）和 errors
+    """
+    today = datetime.now().date()
+    package_hours = dict(db.session.execute(select(CoursePackage.id, CoursePackage.total_hours)).all())
+
+    # 手机号在文件内和数据库中均不能重复
+    phones = {row.get('phone') for row in rows if row.get('phone')}
+    existing_phones = set()
+    phone_list = list(phones)
+    for i in range(0, len(phone_list), 1000):
+        existing_phones.update(db.session.execute(
+            select(Student.phone).where(Student.phone.in_(phone_list[i:i + 1000]))
+        ).scalars())
+    seen_phones = set()
+
+    records = []
+    errors = []
+    for index, row in enumerate(rows):
+        line = index + 2
+        row_errors = []
+
+        name = row.get('name')
+        if not name:
+            row_errors.append('name 不能为空')
+        elif len(name) > 50:
+            row_errors.append('name 不能超过50个字符')
+
+        phone = row.get('phone') or None
+        if phone:
+            if len(phone) > 20:
+                row_errors.append('phone 不能超过20个字符')
+            elif phone in existing_phones:
+                row_errors.append(f"手机号已存在: {phone}")
+            elif phone in seen_phones:
+                row_errors.append(f"手机号在文件中重复: {phone}")
+            seen_phones.add(phone)
+
+        email = row.get('email') or None
+        if email and len(email) > 100:
+            row_errors.append('email 不能超过100个字符')
+        address = row.get('address') or None
+        if address and len(address) > 200:
+            row_errors.append('address 不能超过200个字符')
+
+        status = row.get('status') or 'new'
+        if status not in IMPORT_STUDENT_STATUSES:
+            row_errors.append(f"无效的状态: {status}")
+
+        student = {
+            'name': name,
+            'phone': phone,
+            'phone_suffix': reverse_phone_digits(phone),
+            'email': email,
+            'birthdate': _parse_import_date(row, 'birthdate', row_errors),
+            'register_date': _parse_import_date(row, 'registerDate', row_errors) or today,
+            'address': address,
+            'notes': row.get('notes') or None,
+            'status': status
+        }
+
+        package = None
+        if row.get('coursePackageId'):
+            try:
+                course_package_id = int(row['coursePackageId'])
+            except ValueError:
+                course_package_id = None
+            if course_package_id not in package_hours:
+                row_errors.append(f"基础课时包不存在: {row['coursePackageId']}")
+            else:
+                package = {
+                    'course_package_id': course_package_id,
+                    'total_hours': package_hours[course_package_id] or 0,
+                    'purchase_date': _parse_import_date(row, 'purchaseDate', row_errors) or today,
+                    'expire_date': _parse_import_date(row, 'expireDate', row_errors),
+                    'notes': row.get('packageNotes') or None
+                }
+
+        if row_errors:
+            errors.append({'line': line, 'name': name, 'errors': row_errors})
+        else:
+            records.append({'line': line, 'student': student, 'package': package})
+    return records, errors
+
+
+def _fetch_inserted_student_ids(batch, count):
+    """
+    取回刚插入的一批学生的ID：按导入批次查询，同一事务中依次插入的自增ID按插入顺序递增
+    批量INSERT在MySQL上无法返回每行的自增ID
+    :param batch: 导入批次
+    :param count: 该批插入的学生数
+    :return: 按插入顺序排列的ID列表
+    """
+    ids = db.session.execute(
+        select(Student.id).where(Student.import_batch == batch).order_by(Student.id)
+    ).scalars().all()
+    if len(ids) != count:
+        raise Exception('无法确定导入学生的ID')
+    return ids
+
+
+def import_students(records, chunk_size=1000, progress=None, atomic=False):
+    """
+    批量写入校验通过的学生及其课时包
+    每批学生、课时包和课时汇总各使用一次批量INSERT，每批单独提交，出错时只回滚当前批，之前的批次已导入
+    atomic为True时整个导入在同一事务中完成，出错时全部回滚，但导入期间一直持有所有新插入行的锁
+    每批学生带有唯一的导入批次（import_batch），插入后按批次取回ID，与已有学生的姓名、手机号是否重复无关
+    :param records: validate_student_import 返回的记录列表
+    :param chunk_size: 每批行数
+    :param progress: 进度回调 progress(已写入数, 总数)（可选），atomic为False时每批提交后调用
+    :param atomic: 是否在同一事务中导入全部记录
+    :return: (导入的学生数, 导入的课时包数)
+    """
+    import_id = uuid.uuid4().hex
+    student_count = 0
+    package_count = 0
+    try:
+        for number, start in enumerate(range(0, len(records), chunk_size)):
+            chunk = records[start:start + chunk_size]
+            batch = '{}-{}'.format(import_id, number)
+            students = [dict(record['student'], import_batch=batch) for record in chunk]
+
+            db.session.execute(Student.__table__.insert(), students)
+            student_ids = _fetch_inserted_student_ids(batch, len(students))
+
+            package_rows = []
+            balance_rows = []
+            for student_id, record in zip(student_ids, chunk):
+                package = record['package']
+                total_hours = package['total_hours'] if package else 0
+                if package:
+                    package_rows.append({
+                        'student_id': student_id,
+                        'course_package_id': package['course_package_id'],
+                        'used_hours': 0,
+                        'remaining_hours': total_hours,
+                        'purchase_date': package['purchase_date'],
+                        'expire_date': package['expire_date'],
+                        'status': 'active',
+                        'notes': package['notes']
+                    })
+                balance_rows.append({
+                    'student_id': student_id,
+                    'total_hours': total_hours,
+                    'used_hours': 0,
+                    'remaining_hours': total_hours,
+                    'active_package_count': 1 if package else 0
+                })
+            if package_rows:
+                db.session.execute(StudentCoursePackage.__table__.insert(), package_rows)
+            db.session.execute(StudentBalance.__table__.insert(), balance_rows)
+
+            if not atomic:
+                db.session.commit()
+
+            student_count += len(students)
+            package_count += len(package_rows)
+            if progress:
+                progress(student_count, len(records))
+        db.session.commit()
+        return student_count, package_count
+    except Exception as e:
+        logger.info(f"import_students errorMsg= {e}, committed={0 if atomic else student_count}")
+        db.session.rollback()
+        raise
+    finally:
+        invalidate_student_counts(*IMPORT_STUDENT_STATUSES)
+
+
+# 批量发送模板消息相关操作
+def get_message_students(student_ids=None, max_remaining_hours=None, status=None):
+    """
+    查询批量发送消息的学生及其课时汇总
+    :param student_ids: 学生ID列表（可选）
+    :param max_remaining_hours: 只包括剩余课时不超过该值的学生（可选）
+    :param status: 学生状态筛选（可选）
+    :return: 行列表，包含 id、name、openid、remaining_hours
+    """
+    query = select(Student.id, Student.name, Student.openid,
+                   func.coalesce(StudentBalance.remaining_hours, 0).label('remaining_hours')) \
+        .outerjoin(StudentBalance, StudentBalance.student_id == Student.id)
+    if student_ids is not None:
+        query = query.where(Student.id.in_(student_ids))
+    if max_remaining_hours is not None:
+        query = query.where(func.coalesce(StudentBalance.remaining_hours, 0) <= max_remaining_hours)
+    if status and status != 'all':
+        query = query.where(Student.status == status)
+    return db.session.execute(query.order_by(Student.id)).all()
+
+
+def create_message_job(template_id, recipients, url=None, miniprogram=None, operator_id=None, appid=None):
+    """
+    创建批量发送任务，接收人一次批量写入
+    没有openid的接收人直接记为跳过
+    :param template_id: 模板ID
+    :param recipients: 列表，每项包含 touser、student_id（可选）、data
+    :param url: 消息跳转链接（可选）
+    :param miniprogram: 跳转小程序配置（可选）
+    :param operator_id: 操作人ID
+    :param appid: 发送使用的appid（appsecret不保存）
+    :return: 新建的任务
+    """
+    try:
+        skipped = sum(1 for r in recipients if not r.get('touser'))
+        job = MessageJob(
+            template_id=template_id,
+            url=url,
+            miniprogram=json.dumps(miniprogram, ensure_ascii=False) if miniprogram else None,
+            status='pending',
+            appid=appid,
+            total=len(recipients),
+            skipped=skipped,
+            operator_id=operator_id,
+            heartbeat_at=datetime.now()
+        )
+        db.session.add(job)
+        db.session.flush()
+        if recipients:
+            db.session.execute(MessageJobRecipient.__table__.insert(), [{
+                'job_id': job.id,
+                'student_id': r.get('student_id'),
+                'touser': r.get('touser'),
+                'data': json.dumps(r.get('data') or {}, ensure_ascii=False),
+                'status': 'pending' if r.get('touser') else 'skipped',
+                'errmsg': None if r.get('touser') else '未绑定微信'
+            } for r in recipients])
+        db.session.commit()
+        return job
+    except OperationalError as e:
+        logger.info(f"create_message_job errorMsg= {e}")
+        db.session.rollback()
+        raise
+
+
+def start_message_job(job_id):
+    """
+    将任务标记为发送中，返回待发送的接收人
+    :param job_id: 任务ID
+    :return: (任务, 待发送接收人的 (id, touser, data) 列表)
+    """
+    job = MessageJob.query.get(job_id)
+    job.status = 'running'
+    job.heartbeat_at = datetime.now()
+    db.session.commit()
+    rows = db.session.execute(
+        select(MessageJobRecipient.id, MessageJobRecipient.touser, MessageJobRecipient.data)
+        .where(MessageJobRecipient.job_id == job_id, MessageJobRecipient.status == 'pending')
+        .order_by(MessageJobRecipient.id)
+    ).all()
+    return job, [(row.id, row.touser, json.loads(row.data or '{}')) for row in rows]
+
+
+def save_message_results(job_id, results):
+    """
+    批量写入接收人的发送结果并累加任务计数
+    同时更新任务的心跳时间，没有结果时只更新心跳时间
+    :param job_id: 任务ID
+    :param results: 列表，每项包含 id、status、errcode、errmsg、sent_at
+    """
+    table = MessageJobRecipient.__table__
+    jobs = MessageJob.__table__
+    try:
+        if results:
+            db.session.execute(
+                update(table).where(table.c.id == bindparam('recipient_id')).values(
+                    status=bindparam('status'), errcode=bindparam('errcode'),
+                    errmsg=bindparam('errmsg'), sent_at=bindparam('sent_at')
+                ),
+                [dict(r, recipient_id=r['id']) for r in results]
+            )
+        sent = sum(1 for r in results if r['status'] == 'sent')
+        db.session.execute(update(jobs).where(jobs.c.id == job_id).values(
+            sent=jobs.c.sent + sent, failed=jobs.c.failed + len(results) - sent, heartbeat_at=datetime.now()
+        ))
+        db.session.commit()
+    except OperationalError as e:
+        logger.info(f"save_message_results errorMsg= {e}")
+        db.session.rollback()
+        raise
+
+
+def finish_message_job(job_id, error=None):
+    """
+    将任务标记为已完成，出错时标记为失败并记录原因（未发送的接收人保持pending）
+    :param job_id: 任务ID
+    :param error: 错误信息（可选）
+    """
+    db.session.rollback()
+    jobs = MessageJob.__table__
+    db.session.execute(update(jobs).where(jobs.c.id == job_id).values(
+        status='failed' if error else 'finished', error=error, finished_at=datetime.now()
+    ))
+    db.session.commit()
+
+
+def claim_stale_message_jobs(stale_before, limit=10):
+    """
+    认领心跳超时的 pending/running 任务（发送进程已退出），多个进程同时认领时每个任务只有一个成功
+    :param stale_before: 心跳时间早于该时间的任务视为中断
+    :param limit: 最多认领的任务数
+    :return: 认领到的任务列表
+    """
+    jobs = MessageJob.__table__
+    # 升级前创建的任务没有心跳时间
+    stale = or_(jobs.c.heartbeat_at.is_(None), jobs.c.heartbeat_at < stale_before)
+    job_ids = db.session.execute(
+        select(jobs.c.id).where(jobs.c.status.in_(('pending', 'running')), stale)
+        .order_by(jobs.c.id).limit(limit)
+    ).scalars().all()
+    claimed = []
+    for job_id in job_ids:
+        # 条件更新心跳时间，只有一个进程能更新成功
+        result = db.session.execute(
+            update(jobs).where(jobs.c.id == job_id, jobs.c.status.in_(('pending', 'running')), stale)
+            .values(heartbeat_at=datetime.now())
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            claimed.append(MessageJob.query.get(job_id))
+    return claimed
+
+
+def get_message_job(job_id, recipient_status=None, limit=1000):
+    """
+    获取任务进度和接收人发送结果
+    :param job_id: 任务ID
+    :param recipient_status: 接收人状态筛选（可选）
+    :param limit: 最多返回的接收人数
+    :return: (任务, 接收人列表)，任务不存在时返回 (None, [])
+    """
+    job = MessageJob.query.get(job_id)
+    if job is None:
+        return None, []
+    query = MessageJobRecipient.query.filter(MessageJobRecipient.job_id == job_id)
+    if recipient_status:
+        query = query.filter(MessageJobRecipient.status == recipient_status)
+    return job, query.order_by(MessageJobRecipient.id).limit(limit).all()
+
+
+# 定时任务执行记录相关操作
+# 独占任务手动执行时认领的周期编号，执行结束或超时后改为 -ID 释放
+JOB_RUN_EXCLUSIVE_SLOT = 0
+
+
+def _release_exclusive_slot(table):
+    return case((table.c.slot == JOB_RUN_EXCLUSIVE_SLOT, -table.c.id), else_=table.c.slot)
+
+
+def claim_job_run(name, slot):
+    """
+    认领定时任务的一个执行周期，多个进程同时认领时只有一个成功
+    已被认领但超过 JOB_RUN_TIMEOUT 仍为 running 的周期（执行进程已退出）可以重新认领
+    :param name: 任务名称
+    :param slot: 执行周期编号
+    :return: 执行记录ID，已被其他进程认领时返回None
+    """
+    try:
+        run = JobRun(name=name, slot=slot, status='running')
+        db.session.add(run)
+        db.session.commit()
+        fail_stale_job_runs(name)
+        return run.id
+    except IntegrityError:
+        db.session.rollback()
+
+    table = JobRun.__table__
+    cutoff = datetime.now() - timedelta(seconds=config.JOB_RUN_TIMEOUT)
+    condition = and_(table.c.name == name, table.c.slot == slot,
+                     table.c.status == 'running', table.c.started_at < cutoff)
+    run_id = db.session.execute(select(table.c.id).where(condition)).scalar()
+    if run_id is None:
+        db.session.rollback()
+        return None
+    # 条件UPDATE保证多个进程同时重新认领时只有一个成功
+    result = db.session.execute(update(table).where(condition).values(started_at=datetime.now()))
+    db.session.commit()
+    if result.rowcount != 1:
+        return None
+    logger.warning("job {} slot {} reclaimed: run {} timed out".format(name, slot, run_id))
+    fail_stale_job_runs(name)
+    return run_id
+
+
+def fail_stale_job_runs(name):
+    """
+    将超过 JOB_RUN_TIMEOUT 仍为 running 的执行记录标记为失败
+    :param name: 任务名称
+    :return: 标记的记录数
+    """
+    table = JobRun.__table__
+    cutoff = datetime.now() - timedelta(seconds=config.JOB_RUN_TIMEOUT)
+    result = db.session.execute(
+        update(table).where(table.c.name == name, table.c.status == 'running', table.c.started_at < cutoff)
+        .values(status='failed', error='执行超时，执行进程可能已退出', finished_at=datetime.now(),
+                slot=_release_exclusive_slot(table))
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def finish_job_run(run_id, result=None, error=None):
+    """
+    记录定时任务的执行结果，独占任务同时释放其周期
+    :param run_id: 执行记录ID
+    :param result: 执行结果字典（可选）
+    :param error: 错误信息（可选），不为空时状态为failed
+    """
+    db.session.rollback()
+    table = JobRun.__table__
+    db.session.execute(update(table).where(table.c.id == run_id).values(
+        slot=_release_exclusive_slot(table),
+        status='failed' if error else 'finished',
+        result=json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+        error=error,
+        finished_at=datetime.now()
+    ))
+    db.session.commit()
+
+
+def get_job_runs(name=None, limit=50):
+    """
+    获取定时任务的执行记录，按开始时间倒序
+    :param name: 任务名称（可选）
+    :param limit: 最多返回条数
+    :return: 执行记录列表
+    """
+    query = JobRun.query
+    if name:
+        query = query.filter(JobRun.name == name)
+    return query.order_by(JobRun.id.desc()).limit(limit).all()
+
+
+# 课时包提醒相关操作
+def find_reminder_candidates(kind, threshold, after_id=0, limit=500):
+    """
+    查找需要提醒且尚未提醒过的活跃课时包，只包括已绑定微信的学生
+    按 (status, remaining_hours) 或 (status, expire_date) 索引范围查询，按ID分批
+    :param kind: low_balance-剩余课时不超过threshold，expiring-在今天到threshold（日期）之间过期
+    :param threshold: 剩余课时上限或过期日期上限
+    :param after_id: 返回ID大于该值的课时包
+    :param limit: 每批数量
+    :return: 行列表
+    """
+    query = (
+        select(StudentCoursePackage.id, StudentCoursePackage.student_id,
+               StudentCoursePackage.remaining_hours, StudentCoursePackage.expire_date,
+               CoursePackage.name.label('package_name'), Student.name.label('student_name'), Student.openid)
+        .join(Student, Student.id == StudentCoursePackage.student_id)
+        .outerjoin(CoursePackage, CoursePackage.id == StudentCoursePackage.course_package_id)
+        .outerjoin(ReminderLog, and_(ReminderLog.package_id == StudentCoursePackage.id, ReminderLog.kind == kind))
+        .where(StudentCoursePackage.status == 'active',
+               StudentCoursePackage.id > after_id,
+               ReminderLog.id.is_(None),
+               Student.openid.isnot(None))
+    )
+    if kind == 'low_balance':
+        query = query.where(StudentCoursePackage.remaining_hours <= threshold)
+    else:
+        query = query.where(StudentCoursePackage.expire_date >= datetime.now().date(),
+                            StudentCoursePackage.expire_date <= threshold)
+    return db.session.execute(query.order_by(StudentCoursePackage.id).limit(limit)).all()
+
+
+def record_reminders(kind, rows, run_id=None):
+    """
+    批量记录已提醒的课时包，唯一约束保证每个课时包的每种提醒只记录一次
+    :param kind: 提醒类型
+    :param rows: find_reminder_candidates 返回的行
+    :param run_id: 定时任务执行记录ID
+    """
+    try:
+        now = datetime.now()
+        db.session.execute(ReminderLog.__table__.insert(), [{
+            'package_id': row.id,
+            'student_id': row.student_id,
+            'kind': kind,
+            'run_id': run_id,
+            'created_at': now
+        } for row in rows])
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise Exception('课时包已被其他任务提醒')
+
+
+def set_reminder_message_job(kind, package_ids, message_job_id):
+    """
+    关联提醒记录和批量发送任务
+    """
+    table = ReminderLog.__table__
+    db.session.execute(update(table).where(table.c.kind == kind, table.c.package_id.in_(package_ids))
+                       .values(message_job_id=message_job_id))
+    db.session.commit()
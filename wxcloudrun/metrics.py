@@ -0,0 +1,357 @@
+import glob
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import Response, g, request
+from flask_login import current_user
+
+import config
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# 请求耗时分桶上限（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# 连接池指标说明
+POOL_HELP = {
+    'checkouts': '从连接池获取连接的次数',
+    'timeouts': '获取连接超时的次数',
+    'connects': '新建数据库连接的次数',
+    'invalidations': '连接失效被丢弃的次数',
+    'size': '连接池大小',
+    'checked_in': '连接池中空闲的连接数',
+    'checked_out': '正在使用的连接数',
+    'overflow': '超出连接池大小的连接数'
+}
+
+
+class _Shard:
+    """
+    单个线程的请求统计，只由所属线程写入
+    """
+
+    __slots__ = ('requests', 'app_errors', 'latency')
+
+    def __init__(self):
+        # (blueprint, endpoint, method, status) -> 请求数
+        self.requests = {}
+        # (blueprint, endpoint) -> 返回 code: -1 的请求数
+        self.app_errors = {}
+        # (blueprint, endpoint) -> 各分桶次数 + [耗时总和, 请求数]
+        self.latency = {}
+
+
+class RequestMetrics:
+    """
+    按蓝图和endpoint统计请求数、错误数和耗时分布，输出Prometheus文本格式
+    每个线程写入自己的统计分片，记录请求时不加锁，导出时汇总所有分片
+    多进程部署时每个进程定期把汇总结果写入共享目录，导出时合并所有进程的文件
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher_pid = None
+        self.directory = None
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe(self, blueprint, endpoint, method, status, seconds, app_error=False):
+        """
+        记录一次请求
+        :param blueprint: 蓝图名称
+        :param endpoint: endpoint名称
+        :param method: 请求方法
+        :param status: HTTP状态码
+        :param seconds: 处理耗时（秒）
+        :param app_error: 是否返回了 code: -1
+        """
+        shard = self._shard()
+        key = (blueprint, endpoint, method, status)
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        key = (blueprint, endpoint)
+        if app_error:
+            shard.app_errors[key] = shard.app_errors.get(key, 0) + 1
+        latency = shard.latency.get(key)
+        if latency is None:
+            latency = shard.latency[key] = [0] * (len(LATENCY_BUCKETS) + 3)
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        latency[index] += 1
+        latency[-2] += seconds
+        latency[-1] += 1
+
+    def collect(self):
+        """
+        汇总当前进程的所有统计，包括连接池和缓存
+        需要在应用上下文中调用
+        :return: 可编码为JSON的字典
+        """
+        from wxcloudrun import db
+        from wxcloudrun.dao import user_cache, student_count_cache
+        from wxcloudrun.pool import pool_stats
+
+        with self._lock:
+            shards = list(self._shards)
+        requests, app_errors, latency = {}, {}, {}
+        for shard in shards:
+            # dict.copy() 在持有GIL时完成，不会与所属线程的写入冲突
+            for key, count in shard.requests.copy().items():
+                requests[key] = requests.get(key, 0) + count
+            for key, count in shard.app_errors.copy().items():
+                app_errors[key] = app_errors.get(key, 0) + count
+            for key, values in shard.latency.copy().items():
+                total = latency.setdefault(key, [0] * len(values))
+                for i, value in enumerate(list(values)):
+                    total[i] += value
+        return {
+            'pid': os.getpid(),
+            'requests': [list(key) + [count] for key, count in requests.items()],
+            'app_errors': [list(key) + [count] for key, count in app_errors.items()],
+            'latency': [list(key) + [values] for key, values in latency.items()],
+            'pool': pool_stats(db.engine),
+            'caches': {'user': user_cache.stats(), 'student_count': student_count_cache.stats()}
+        }
+
+    def multiprocess(self, directory):
+        """
+        开启多进程汇总：清空目录中上次运行留下的文件，需要在启动工作进程之前调用
+        :param directory: 各进程写入统计文件的共享目录
+        """
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+            os.remove(path)
+        self.directory = directory
+
+    def flush(self):
+        """
+        把当前进程的统计写入共享目录，需要在应用上下文中调用
+        """
+        if not self.directory or not self._flush_lock.acquire(blocking=False):
+            return
+        try:
+            path = os.path.join(self.directory, 'metrics_{}.json'.format(os.getpid()))
+            with open(path + '.tmp', 'w') as f:
+                json.dump(self.collect(), f)
+            os.replace(path + '.tmp', path)
+        finally:
+            self._flush_lock.release()
+
+    def start_flusher(self, app):
+        """
+        多进程部署时在当前进程中启动定期写入统计的线程，重复调用时只启动一次
+        :param app: Flask应用
+        """
+        if not self.directory or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        thread = threading.Thread(target=self._flush_loop, args=(app,), name='metrics-flusher', daemon=True)
+        thread.start()
+
+    def _flush_loop(self, app):
+        while True:
+            time.sleep(config.METRICS_FLUSH_INTERVAL)
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.info(f"metrics flush errorMsg= {e}")
+
+    def snapshots(self):
+        """
+        获取所有进程的统计，当前进程的统计直接汇总，其他进程的读取共享目录中的文件
+        :return: (统计字典, 进程是否仍在运行) 列表
+        """
+        current = self.collect()
+        result = [(current, True)]
+        if not self.directory:
+            return result
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if snapshot['pid'] == current['pid']:
+                continue
+            result.append((snapshot, _pid_alive(snapshot['pid'])))
+        return result
+
+    def render(self):
+        """
+        按Prometheus文本格式输出所有进程汇总后的统计
+        已退出进程的计数仍然计入（保证计数单调递增），连接池和缓存的当前值只计入仍在运行的进程
+        """
+        requests, app_errors, latency = {}, {}, {}
+        pool_counters = {'checkouts': 0, 'timeouts': 0, 'connects': 0, 'invalidations': 0}
+        pool_gauges = {'size': 0, 'checked_in': 0, 'checked_out': 0, 'overflow': 0}
+        pool_wait = None
+        cache_counters, cache_sizes = {}, {}
+        for snapshot, alive in self.snapshots():
+            for *key, count in snapshot['requests']:
+                key = tuple(key)
+                requests[key] = requests.get(key, 0) + count
+            for *key, count in snapshot['app_errors']:
+                key = tuple(key)
+                app_errors[key] = app_errors.get(key, 0) + count
+            for blueprint, endpoint, values in snapshot['latency']:
+                total = latency.setdefault((blueprint, endpoint), [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+            pool = snapshot['pool']
+            for name in pool_counters:
+                pool_counters[name] += pool.get(name, 0)
+            histogram = pool.get('wait_histogram', {})
+            if pool_wait is None:
+                pool_wait = dict.fromkeys(histogram, 0)
+                pool_wait['sum'] = 0.0
+            for name, count in histogram.items():
+                pool_wait[name] = pool_wait.get(name, 0) + count
+            pool_wait['sum'] += pool.get('wait_total_ms', 0) / 1000
+            for name, stats in snapshot['caches'].items():
+                counters = cache_counters.setdefault(name, {'hits': 0, 'misses': 0})
+                counters['hits'] += stats['hits']
+                counters['misses'] += stats['misses']
+                if alive:
+                    cache_sizes[name] = cache_sizes.get(name, 0) + stats['size']
+            if alive:
+                for name in pool_gauges:
+                    pool_gauges[name] += pool.get(name, 0)
+
+        lines = []
+        _header(lines, 'http_requests_total', 'counter', 'HTTP请求数')
+        for (blueprint, endpoint, method, status), count in sorted(requests.items()):
+            lines.append(_sample('http_requests_total', count, blueprint=blueprint, endpoint=endpoint,
+                                 method=method, status=status))
+
+        _header(lines, 'http_request_errors_total', 'counter', '出错的请求数：HTTP 4xx/5xx 或返回 code: -1')
+        errors = {}
+        for (blueprint, endpoint, method, status), count in requests.items():
+            if int(status) >= 400:
+                key = (blueprint, endpoint, 'server' if int(status) >= 500 else 'client')
+                errors[key] = errors.get(key, 0) + count
+        for (blueprint, endpoint), count in app_errors.items():
+            errors[(blueprint, endpoint, 'app')] = count
+        for (blueprint, endpoint, kind), count in sorted(errors.items()):
+            lines.append(_sample('http_request_errors_total', count, blueprint=blueprint, endpoint=endpoint, kind=kind))
+
+        _header(lines, 'http_request_duration_seconds', 'histogram', '请求处理耗时')
+        for (blueprint, endpoint), values in sorted(latency.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values):
+                cumulative += count
+                lines.append(_sample('http_request_duration_seconds_bucket', cumulative, blueprint=blueprint,
+                                     endpoint=endpoint, le=bound))
+            lines.append(_sample('http_request_duration_seconds_sum', values[-2], blueprint=blueprint, endpoint=endpoint))
+            lines.append(_sample('http_request_duration_seconds_count', values[-1], blueprint=blueprint, endpoint=endpoint))
+
+        for name, count in pool_counters.items():
+            _header(lines, 'db_pool_{}_total'.format(name), 'counter', POOL_HELP[name])
+            lines.append(_sample('db_pool_{}_total'.format(name), count))
+        for name, value in pool_gauges.items():
+            _header(lines, 'db_pool_{}'.format(name), 'gauge', POOL_HELP[name])
+            lines.append(_sample('db_pool_{}'.format(name), value))
+        if pool_wait:
+            _header(lines, 'db_pool_wait_seconds', 'histogram', '获取数据库连接的等待时间')
+            for name, count in pool_wait.items():
+                if name == 'sum':
+                    continue
+                bound = '+Inf' if name == 'le_inf' else float(name[3:-2]) / 1000
+                lines.append(_sample('db_pool_wait_seconds_bucket', count, le=bound))
+            lines.append(_sample('db_pool_wait_seconds_sum', pool_wait['sum']))
+            lines.append(_sample('db_pool_wait_seconds_count', pool_counters['checkouts']))
+
+        _header(lines, 'cache_hits_total', 'counter', '进程内缓存命中次数')
+        for name, counters in sorted(cache_counters.items()):
+            lines.append(_sample('cache_hits_total', counters['hits'], cache=name))
+        _header(lines, 'cache_misses_total', 'counter', '进程内缓存未命中次数')
+        for name, counters in sorted(cache_counters.items()):
+            lines.append(_sample('cache_misses_total', counters['misses'], cache=name))
+        _header(lines, 'cache_entries', 'gauge', '进程内缓存条目数')
+        for name, size in sorted(cache_sizes.items()):
+            lines.append(_sample('cache_entries', size, cache=name))
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _header(lines, name, kind, help_text):
+    lines.append('# HELP {} {}'.format(name, help_text))
+    lines.append('# TYPE {} {}'.format(name, kind))
+
+
+def _sample(name, value, **labels):
+    if labels:
+        name = '{}{{{}}}'.format(name, ','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels.items()))
+    return '{} {}'.format(name, value)
+
+
+# 当前进程的请求统计
+metrics = RequestMetrics()
+
+
+def init_app(app):
+    """
+    统计每个请求（METRICS_ENABLED），并注册 /metrics 接口
+    /metrics 不公开：需要携带 Authorization: Bearer <METRICS_TOKEN>（未配置令牌时不可用），或以管理员身份登录
+    """
+    if not config.METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        metrics.start_flusher(app)
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            metrics.observe(request.blueprint or '', request.endpoint or 'unmatched', request.method,
+                            response.status_code, time.perf_counter() - started,
+                            getattr(response, 'app_error', False))
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        if not _metrics_authorized():
+            return Response('unauthorized\n', status=401, mimetype='text/plain')
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _metrics_authorized():
+    """
+    请求是否携带了正确的 METRICS_TOKEN，或当前登录用户是管理员
+    """
+    if config.METRICS_TOKEN:
+        expected = 'Bearer {}'.format(config.METRICS_TOKEN)
+        if hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            return True
+    return current_user.is_authenticated and current_user.is_admin
@@ -0,0 +1,94 @@
+import importlib
+import logging
+import pkgutil
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, select, text
+
+from wxcloudrun import db
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# 记录已执行迁移版本的表
+version_table = Table(
+    'schema_migrations', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(200), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+# 执行迁移时持有的MySQL命名锁及等待秒数
+LOCK_NAME = 'funclassroom_schema_migrations'
+LOCK_TIMEOUT = 600
+
+
+def load_migrations():
+    """
+    加载本包下所有迁移模块（文件名形如 v0001_xxx.py）
+    每个模块需定义 version、description 和 upgrade(connection)
+    :return: 按版本号排序的迁移模块列表
+    """
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        if not module_info.name.startswith('v'):
+            continue
+        module = importlib.import_module('{}.{}'.format(__name__, module_info.name))
+        migrations.append(module)
+    migrations.sort(key=lambda m: m.version)
+    return migrations
+
+
+def current_version(connection):
+    """
+    获取数据库当前的迁移版本
+    :param connection: 数据库连接
+    :return: 当前版本号，未执行过迁移时为0
+    """
+    version_table.create(connection, checkfirst=True)
+    versions = connection.execute(select(version_table.c.version)).scalars().all()
+    return max(versions) if versions else 0
+
+
+def pending_migrations(connection):
+    """
+    获取尚未执行的迁移
+    :param connection: 数据库连接
+    :return: 迁移模块列表
+    """
+    version = current_version(connection)
+    return [m for m in load_migrations() if m.version > version]
+
+
+def upgrade(target=None, echo=print):
+    """
+    依次执行尚未执行的迁移，每个迁移在独立事务中执行
+    :param target: 目标版本号（可选，默认升级到最新）
+    :param echo: 进度输出函数
+    :return: 已执行的迁移版本号列表
+    """
+    applied = []
+    with db.engine.connect() as connection:
+        # 多个实例同时启动时，MySQL上用命名锁保证只有一个实例执行迁移，其他实例等待后跳过已执行的迁移
+        locked = connection.dialect.name == 'mysql'
+        if locked and not connection.execute(
+                text('SELECT GET_LOCK(:name, :timeout)'), {'name': LOCK_NAME, 'timeout': LOCK_TIMEOUT}).scalar():
+            raise RuntimeError('Timed out waiting for another instance to finish migrating.')
+        try:
+            for migration in pending_migrations(connection):
+                if target is not None and migration.version > target:
+                    break
+                echo('Applying {:04d}: {}'.format(migration.version, migration.description))
+                with connection.begin():
+                    migration.upgrade(connection)
+                    connection.execute(version_table.insert().values(
+                        version=migration.version,
+                        description=migration.description,
+                        applied_at=datetime.now()
+                    ))
+                logger.info("applied migration {:04d}".format(migration.version))
+                applied.append(migration.version)
+        finally:
+            if locked:
+                connection.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': LOCK_NAME})
+    return applied
@@ -0,0 +1,13 @@
+from wxcloudrun import db
+from wxcloudrun import model  # noqa: F401 注册模型元数据
+
+version = 1
+description = '创建基础数据表'
+
+TABLES = ['User', 'CoursePackage', 'Student', 'StudentCoursePackage', 'ClassRecord']
+
+
+def upgrade(connection):
+    # 已存在的表保持不变，便于在已有部署上执行
+    for name in TABLES:
+        db.Model.metadata.tables[name].create(connection, checkfirst=True)
@@ -0,0 +1,16 @@
+from wxcloudrun.model import Student, StudentCoursePackage, ClassRecord
+
+version = 2
+description = '为学生列表、课时包和上课记录查询添加复合索引'
+
+INDEXES = [
+    (Student, 'ix_student_status_id'),
+    (StudentCoursePackage, 'ix_student_course_package_student_status_purchase'),
+    (ClassRecord, 'ix_class_record_student_date'),
+]
+
+
+def upgrade(connection):
+    for model, name in INDEXES:
+        index = next(i for i in model.__table__.indexes if i.name == name)
+        index.create(connection, checkfirst=True)
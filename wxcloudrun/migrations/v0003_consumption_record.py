@@ -0,0 +1,11 @@
+from wxcloudrun.model import ConsumptionRecord
+
+version = 3
+description = '创建课消记录表'
+
+
+def upgrade(connection):
+    ConsumptionRecord.__table__.create(connection, checkfirst=True)
+    # 表已由旧版本创建时补充索引
+    for index in ConsumptionRecord.__table__.indexes:
+        index.create(connection, checkfirst=True)
@@ -0,0 +1,20 @@
+from sqlalchemy import insert, select
+
+from wxcloudrun.dao import student_balance_select, BALANCE_COLUMNS
+from wxcloudrun.model import StudentBalance
+
+version = 4
+description = '创建学生课时汇总表并回填数据'
+
+
+def upgrade(connection):
+    StudentBalance.__table__.create(connection, checkfirst=True)
+
+    # 从课时包和课消记录聚合回填尚无汇总的学生
+    aggregate = student_balance_select().subquery()
+    existing = select(StudentBalance.student_id)
+    connection.execute(insert(StudentBalance.__table__).from_select(
+        BALANCE_COLUMNS,
+        select(*[aggregate.c[name] for name in BALANCE_COLUMNS])
+        .where(aggregate.c.student_id.not_in(existing))
+    ))
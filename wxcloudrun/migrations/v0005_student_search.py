@@ -0,0 +1,37 @@
+from sqlalchemy import inspect, select, text, update
+
+from wxcloudrun.model import Student, reverse_phone_digits, student_fulltext_index
+
+version = 5
+description = '添加学生检索所需的手机尾号字段、姓名索引和全文索引'
+
+INDEXES = ['ix_student_name', 'ix_student_phone_suffix']
+
+
+def upgrade(connection):
+    table = Student.__table__
+    inspector = inspect(connection)
+    if 'phone_suffix' not in [c['name'] for c in inspector.get_columns(table.name)]:
+        connection.execute(text('ALTER TABLE Student ADD COLUMN phone_suffix VARCHAR(20) NULL'))
+
+    for index in table.indexes:
+        if index.name in INDEXES:
+            index.create(connection, checkfirst=True)
+    if connection.dialect.name == 'mysql' and \
+            'ft_student_name_email' not in [i['name'] for i in inspector.get_indexes(table.name)]:
+        student_fulltext_index(table, connection)
+
+    # 按ID分批回填手机尾号
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(table.c.id, table.c.phone)
+            .where(table.c.id > last_id, table.c.phone.isnot(None), table.c.phone_suffix.is_(None))
+            .order_by(table.c.id).limit(5000)
+        ).all()
+        if not rows:
+            break
+        for row in rows:
+            connection.execute(update(table).where(table.c.id == row.id)
+                               .values(phone_suffix=reverse_phone_digits(row.phone)))
+        last_id = rows[-1].id
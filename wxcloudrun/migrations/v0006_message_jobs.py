@@ -0,0 +1,13 @@
+from sqlalchemy import inspect, text
+
+from wxcloudrun.model import MessageJob, MessageJobRecipient
+
+version = 6
+description = '添加学生微信openid字段，创建批量发送模板消息任务表'
+
+
+def upgrade(connection):
+    if 'openid' not in [c['name'] for c in inspect(connection).get_columns('Student')]:
+        connection.execute(text('ALTER TABLE Student ADD COLUMN openid VARCHAR(64) NULL'))
+    MessageJob.__table__.create(connection, checkfirst=True)
+    MessageJobRecipient.__table__.create(connection, checkfirst=True)
@@ -0,0 +1,14 @@
+from wxcloudrun.model import StudentCoursePackage, JobRun, ReminderLog
+
+version = 7
+description = '添加课时包提醒所需的索引，创建定时任务执行记录表和提醒记录表'
+
+INDEXES = ['ix_student_course_package_status_remaining', 'ix_student_course_package_status_expire']
+
+
+def upgrade(connection):
+    for index in StudentCoursePackage.__table__.indexes:
+        if index.name in INDEXES:
+            index.create(connection, checkfirst=True)
+    JobRun.__table__.create(connection, checkfirst=True)
+    ReminderLog.__table__.create(connection, checkfirst=True)
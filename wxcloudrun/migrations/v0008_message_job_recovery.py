@@ -0,0 +1,17 @@
+from sqlalchemy import inspect, text
+
+version = 8
+description = '批量发送任务添加appid、心跳时间和失败原因字段，用于恢复中断的任务'
+
+COLUMNS = {
+    'appid': 'VARCHAR(64) NULL',
+    'heartbeat_at': 'DATETIME NULL',
+    'error': 'TEXT NULL',
+}
+
+
+def upgrade(connection):
+    existing = [c['name'] for c in inspect(connection).get_columns('MessageJob')]
+    for name, definition in COLUMNS.items():
+        if name not in existing:
+            connection.execute(text('ALTER TABLE MessageJob ADD COLUMN {} {}'.format(name, definition)))
@@ -0,0 +1,15 @@
+from sqlalchemy import inspect, text
+
+from wxcloudrun.model import Student
+
+version = 9
+description = '学生添加导入批次字段和索引，批量导入时按批次取回新插入学生的ID'
+
+
+def upgrade(connection):
+    table = Student.__table__
+    if 'import_batch' not in [c['name'] for c in inspect(connection).get_columns(table.name)]:
+        connection.execute(text('ALTER TABLE Student ADD COLUMN import_batch VARCHAR(40) NULL'))
+    for index in table.indexes:
+        if index.name == 'ix_student_import_batch':
+            index.create(connection, checkfirst=True)
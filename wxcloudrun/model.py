@@ -2,7 +2,8 @@ from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from wxcloudrun import db
-from sqlalchemy import func
+from sqlalchemy import DDL, event, func
+from sqlalchemy.orm import validates
 
 
 # 用户表 - 移动到文件开头
@@ -37,30 +38,72 @@ class CoursePackage(db.Model):
     updated_at = db.Column('updated_at', db.TIMESTAMP, nullable=False, server_default=func.now(), onupdate=func.now())
 
 
+def reverse_phone_digits(phone):
+    """
+    提取手机号中的数字并反转，按尾号检索可转为前缀匹配
+    :param phone: 手机号
+    :return: 反转后的数字串，没有数字时返回None
+    """
+    digits = ''.join(c for c in phone or '' if c.isdigit())
+    return digits[::-1] or None
+
+
 # 学生/客户表
 class Student(db.Model):
     __tablename__ = 'Student'
+    __table_args__ = (
+        # 按状态筛选并按ID倒序分页
+        db.Index('ix_student_status_id', 'status', 'id'),
+        # 按姓名前缀检索
+        db.Index('ix_student_name', 'name'),
+        # 按手机尾号检索（反转后做前缀匹配）
+        db.Index('ix_student_phone_suffix', 'phone_suffix'),
+        # 批量导入时按批次取回新插入学生的ID
+        db.Index('ix_student_import_batch', 'import_batch'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(50), nullable=False, comment='姓名')
     phone = db.Column(db.String(20), nullable=True, comment='联系电话')
+    phone_suffix = db.Column(db.String(20), nullable=True, comment='反转后的手机号数字，用于按尾号检索')
     email = db.Column(db.String(100), nullable=True, comment='电子邮箱')
     birthdate = db.Column(db.Date, nullable=True, comment='出生日期')
     register_date = db.Column(db.Date, nullable=False, default=datetime.now().date(), comment='注册日期')
     address = db.Column(db.String(200), nullable=True, comment='地址')
     notes = db.Column(db.Text, nullable=True, comment='备注')
     status = db.Column(db.String(20), default='active', comment='状态：active-活跃，inactive-已结课，new-新客户')
+    openid = db.Column(db.String(64), nullable=True, comment='微信openid，用于发送模板消息')
+    import_batch = db.Column(db.String(40), nullable=True, comment='批量导入的批次，手动添加的学生为空')
     created_at = db.Column('created_at', db.TIMESTAMP, nullable=False, server_default=func.now())
     updated_at = db.Column('updated_at', db.TIMESTAMP, nullable=False, server_default=func.now(), onupdate=func.now())
 
+    @validates('phone')
+    def _update_phone_suffix(self, key, phone):
+        self.phone_suffix = reverse_phone_digits(phone)
+        return phone
+
     # # 定义关系但不在这里级联删除
     # class_records = db.relationship('ClassRecord', backref='student', lazy=True)
     # consumption_records = db.relationship('ConsumptionRecord', backref='student', lazy=True)
 
 
+# 姓名和邮箱的全文索引（ngram分词以支持中文），仅MySQL
+student_fulltext_index = DDL(
+    'CREATE FULLTEXT INDEX ft_student_name_email ON Student (name, email) WITH PARSER ngram'
+).execute_if(dialect='mysql')
+event.listen(Student.__table__, 'after_create', student_fulltext_index)
+
+
 # 学生课时包关联表
 class StudentCoursePackage(db.Model):
     __tablename__ = 'StudentCoursePackage'
+    __table_args__ = (
+        # 按学生和状态查询课时包并按购买日期排序
+        db.Index('ix_student_course_package_student_status_purchase', 'student_id', 'status', 'purchase_date'),
+        # 按剩余课时和过期日期查找需要提醒的课时包
+        db.Index('ix_student_course_package_status_remaining', 'status', 'remaining_hours'),
+        db.Index('ix_student_course_package_status_expire', 'status', 'expire_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     student_id = db.Column(db.Integer, db.ForeignKey('Student.id'), nullable=False, comment='学生ID')
@@ -74,15 +117,18 @@ class StudentCoursePackage(db.Model):
     created_at = db.Column('created_at', db.TIMESTAMP, nullable=False, server_default=func.now())
     updated_at = db.Column('updated_at', db.TIMESTAMP, nullable=False, server_default=func.now(), onupdate=func.now())
 
-    # # 关联关系
+    # 关联关系
+    course_package = db.relationship('CoursePackage', backref=db.backref('student_packages', lazy=True))
     # student = db.relationship('Student', backref=db.backref('packages', lazy=True))
-    # course_package = db.relationship('CoursePackage', backref=db.backref('student_packages', lazy=True))
-    # consumption_records = db.relationship('ConsumptionRecord', backref='student_package', lazy=True)
 
 
 # 上课记录表
 class ClassRecord(db.Model):
     __tablename__ = 'ClassRecord'
+    __table_args__ = (
+        # 按学生查询上课记录并按上课日期排序
+        db.Index('ix_class_record_student_date', 'student_id', 'class_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     student_id = db.Column(db.Integer, db.ForeignKey('Student.id'), nullable=False, comment='学生ID')
@@ -93,4 +139,122 @@ class ClassRecord(db.Model):
     updated_at = db.Column('updated_at', db.TIMESTAMP, nullable=False, server_default=func.now(), onupdate=func.now())
     
     # 关联关系
-    operator = db.relationship('User', backref=db.backref('class_records', lazy=True))
\ No newline at end of file
+    operator = db.relationship('User', backref=db.backref('class_records', lazy=True))
+
+# 课消记录表
+class ConsumptionRecord(db.Model):
+    __tablename__ = 'ConsumptionRecord'
+    __table_args__ = (
+        # 按学生查询课消记录并按操作时间排序
+        db.Index('ix_consumption_record_student_time', 'student_id', 'operation_time'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('Student.id'), nullable=False, comment='学生ID')
+    package_id = db.Column(db.Integer, db.ForeignKey('StudentCoursePackage.id'), nullable=False, comment='学生课时包ID')
+    consumption_hours = db.Column(db.Float, nullable=False, comment='消耗课时')
+    remaining_hours = db.Column(db.Float, default=0, comment='消耗后剩余课时')
+    used_hours = db.Column(db.Float, default=0, comment='消耗后已用课时')
+    operation_time = db.Column(db.DateTime, nullable=False, default=datetime.now, comment='操作时间')
+    operator_id = db.Column(db.Integer, db.ForeignKey('User.id'), nullable=True, comment='操作人ID')
+    operator_name = db.Column(db.String(64), nullable=True, comment='操作人名称')
+    created_at = db.Column('created_at', db.TIMESTAMP, nullable=False, server_default=func.now())
+    updated_at = db.Column('updated_at', db.TIMESTAMP, nullable=False, server_default=func.now(), onupdate=func.now())
+    
+    # 关联关系
+    operator = db.relationship('User', backref=db.backref('consumption_records', lazy=True))
+    package = db.relationship('StudentCoursePackage', backref=db.backref('consumption_records', lazy=True))
+
+
+# 学生课时汇总表，随课消、课时包更新和分配在同一事务中维护
+class StudentBalance(db.Model):
+    __tablename__ = 'StudentBalance'
+    __table_args__ = (
+        # 按剩余课时排序学生列表
+        db.Index('ix_student_balance_remaining', 'remaining_hours', 'student_id'),
+    )
+    
+    student_id = db.Column(db.Integer, db.ForeignKey('Student.id'), primary_key=True, comment='学生ID')
+    total_hours = db.Column(db.Float, nullable=False, default=0, comment='总课时')
+    used_hours = db.Column(db.Float, nullable=False, default=0, comment='已用课时')
+    remaining_hours = db.Column(db.Float, nullable=False, default=0, comment='剩余课时')
+    active_package_count = db.Column(db.Integer, nullable=False, default=0, comment='活跃课时包数量')
+    last_consumption_time = db.Column(db.DateTime, nullable=True, comment='最近课消时间')
+    updated_at = db.Column('updated_at', db.TIMESTAMP, nullable=False, server_default=func.now(), onupdate=func.now())
+    
+    # 关联关系，加载学生时一并加载汇总
+    student = db.relationship('Student', backref=db.backref('balance', uselist=False, lazy='joined'))
+
+
+# 批量发送模板消息任务表
+class MessageJob(db.Model):
+    __tablename__ = 'MessageJob'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    template_id = db.Column(db.String(64), nullable=False, comment='模板ID')
+    url = db.Column(db.String(500), nullable=True, comment='消息跳转链接')
+    miniprogram = db.Column(db.Text, nullable=True, comment='跳转小程序配置（JSON）')
+    status = db.Column(db.String(20), nullable=False, default='pending',
+                       comment='状态：pending-等待，running-发送中，finished-已完成，failed-失败')
+    appid = db.Column(db.String(64), nullable=True, comment='发送使用的appid，恢复任务时使用')
+    total = db.Column(db.Integer, nullable=False, default=0, comment='接收人数')
+    sent = db.Column(db.Integer, nullable=False, default=0, comment='发送成功数')
+    failed = db.Column(db.Integer, nullable=False, default=0, comment='发送失败数')
+    skipped = db.Column(db.Integer, nullable=False, default=0, comment='跳过数（未绑定微信）')
+    operator_id = db.Column(db.Integer, db.ForeignKey('User.id'), nullable=True, comment='操作人ID')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, comment='创建时间')
+    heartbeat_at = db.Column(db.DateTime, nullable=True, comment='发送进程最近一次更新进度的时间，超时未更新的任务会被恢复')
+    finished_at = db.Column(db.DateTime, nullable=True, comment='完成时间')
+    error = db.Column(db.Text, nullable=True, comment='失败原因')
+
+
+# 批量发送任务的接收人表
+class MessageJobRecipient(db.Model):
+    __tablename__ = 'MessageJobRecipient'
+    __table_args__ = (
+        # 按任务查询接收人
+        db.Index('ix_message_job_recipient_job', 'job_id', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('MessageJob.id'), nullable=False, comment='任务ID')
+    student_id = db.Column(db.Integer, nullable=True, comment='学生ID')
+    touser = db.Column(db.String(64), nullable=True, comment='接收人openid')
+    data = db.Column(db.Text, nullable=True, comment='模板数据（JSON）')
+    status = db.Column(db.String(20), nullable=False, default='pending', comment='状态：pending-等待，sent-成功，failed-失败，skipped-跳过')
+    errcode = db.Column(db.Integer, nullable=True, comment='微信错误码')
+    errmsg = db.Column(db.String(200), nullable=True, comment='错误信息')
+    sent_at = db.Column(db.DateTime, nullable=True, comment='发送时间')
+
+
+# 定时任务执行记录表，同一任务的同一周期只能被一个进程认领
+class JobRun(db.Model):
+    __tablename__ = 'JobRun'
+    __table_args__ = (
+        db.UniqueConstraint('name', 'slot', name='uq_job_run_name_slot'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String(50), nullable=False, comment='任务名称')
+    slot = db.Column(db.BigInteger, nullable=False, comment='执行周期编号，手动执行时为负数')
+    status = db.Column(db.String(20), nullable=False, default='running', comment='状态：running-执行中，finished-完成，failed-失败')
+    result = db.Column(db.Text, nullable=True, comment='执行结果（JSON）')
+    error = db.Column(db.Text, nullable=True, comment='错误信息')
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.now, comment='开始时间')
+    finished_at = db.Column(db.DateTime, nullable=True, comment='结束时间')
+
+
+# 课时包提醒记录表，每个课时包的每种提醒只发送一次
+class ReminderLog(db.Model):
+    __tablename__ = 'ReminderLog'
+    __table_args__ = (
+        db.UniqueConstraint('package_id', 'kind', name='uq_reminder_log_package_kind'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    package_id = db.Column(db.Integer, db.ForeignKey('StudentCoursePackage.id'), nullable=False, comment='学生课时包ID')
+    student_id = db.Column(db.Integer, nullable=False, comment='学生ID')
+    kind = db.Column(db.String(20), nullable=False, comment='提醒类型：low_balance-课时不足，expiring-即将过期')
+    run_id = db.Column(db.Integer, nullable=True, comment='定时任务执行记录ID')
+    message_job_id = db.Column(db.Integer, nullable=True, comment='批量发送任务ID')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, comment='提醒时间')
@@ -0,0 +1,122 @@
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    """
+    连接池统计，进程内累计，线程安全
+    获取连接的等待时间按毫秒分桶统计
+    """
+
+    # 等待时间分桶上限（毫秒），最后一个桶包括超过上限的所有等待
+    buckets = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        清零所有统计
+        """
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.wait_counts = [0] * (len(self.buckets) + 1)
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def observe_wait(self, seconds):
+        """
+        记录一次获取连接的等待时间
+        :param seconds: 等待秒数
+        """
+        ms = seconds * 1000
+        index = next((i for i, bound in enumerate(self.buckets) if ms <= bound), len(self.buckets))
+        with self._lock:
+            self.checkouts += 1
+            self.wait_counts[index] += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def increment(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        """
+        获取统计快照
+        :return: 字典，wait_histogram 为各分桶的累计次数
+        """
+        with self._lock:
+            histogram = {}
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], self.wait_counts):
+                cumulative += count
+                histogram['le_{}ms'.format(bound) if bound != '+Inf' else 'le_inf'] = cumulative
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'wait_avg_ms': round(self.wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                'wait_total_ms': round(self.wait_total * 1000, 3),
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+                'wait_histogram': histogram
+            }
+
+
+# 当前进程的连接池统计
+pool_metrics = PoolMetrics()
+
+
+class TimedQueuePool(QueuePool):
+    """
+    记录获取连接等待时间的QueuePool，等待时间包括排队、新建连接和pre_ping
+    """
+
+    def connect(self):
+        started = time.monotonic()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            pool_metrics.increment('timeouts')
+            raise
+        pool_metrics.observe_wait(time.monotonic() - started)
+        return connection
+
+
+@event.listens_for(TimedQueuePool, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    pool_metrics.increment('connects')
+
+
+@event.listens_for(TimedQueuePool, 'invalidate')
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    pool_metrics.increment('invalidations')
+
+
+def pool_stats(engine):
+    """
+    获取连接池当前状态和累计统计
+    :param engine: 数据库引擎
+    :return: 字典
+    """
+    pool = engine.pool
+    stats = {'pool_class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+            'max_overflow': pool._max_overflow,
+            'timeout': pool.timeout()
+        })
+    stats.update(pool_metrics.snapshot())
+    return stats
@@ -0,0 +1,102 @@
+import contextvars
+import logging
+import random
+import time
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import config
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# 当前请求的SQL统计，未抽中的请求和后台线程为None
+_current_profile = contextvars.ContextVar('sql_profile', default=None)
+
+
+class RequestProfile:
+    """
+    单个请求的SQL统计：语句数和数据库耗时
+    """
+
+    __slots__ = ('queries', 'elapsed', 'token')
+
+    def __init__(self):
+        self.queries = 0
+        self.elapsed = 0.0
+        self.token = None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is None:
+        return
+    conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    if profile is None:
+        return
+    started = conn.info.get('profile_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    profile.queries += 1
+    profile.elapsed += elapsed
+    if elapsed * 1000 >= config.SQL_SLOW_QUERY_MS:
+        # 只记录语句，不记录参数，避免日志中出现学生信息
+        logger.warning("slow query {:.1f}ms endpoint={} {} {}".format(
+            elapsed * 1000, request.endpoint, request.method, ' '.join(statement.split())[:1000]))
+
+
+def _handle_error(exception_context):
+    # 语句执行失败时不会触发after_cursor_execute，丢弃对应的开始时间
+    started = exception_context.connection.info.get('profile_started') if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def start_profile():
+    """
+    按采样率决定是否统计当前请求的SQL
+    """
+    if random.random() >= config.SQL_PROFILE_SAMPLE_RATE:
+        return
+    profile = RequestProfile()
+    profile.token = _current_profile.set(profile)
+
+
+def add_profile_headers(response):
+    """
+    在响应头中返回当前请求的SQL语句数和数据库耗时（毫秒）
+    """
+    profile = _current_profile.get()
+    if profile is not None:
+        response.headers['X-DB-Queries'] = str(profile.queries)
+        response.headers['X-DB-Time'] = '{:.3f}'.format(profile.elapsed * 1000)
+    return response
+
+
+def end_profile(exception=None):
+    profile = _current_profile.get()
+    if profile is not None:
+        _current_profile.reset(profile.token)
+
+
+def init_app(app):
+    """
+    开启按请求的SQL统计（SQL_PROFILE_ENABLED），抽中的请求返回 X-DB-Queries、X-DB-Time 响应头并记录慢查询
+    未开启或未抽中的请求只多一次ContextVar读取
+    """
+    if not config.SQL_PROFILE_ENABLED:
+        return
+    # 监听所有引擎，重复创建应用时只注册一次
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+    app.before_request(start_profile)
+    app.after_request(add_profile_headers)
+    app.teardown_request(end_profile)
@@ -1,18 +1,224 @@
 import json
+from datetime import date, datetime
 
 from flask import Response
 
+from wxcloudrun.model import (
+    Student, CoursePackage, StudentCoursePackage, ClassRecord, ConsumptionRecord, MessageJob, MessageJobRecipient,
+    JobRun
+)
+
+try:
+    import orjson
+except ImportError:  # 未安装时使用标准库json
+    orjson = None
+
+
+# 模型序列化函数注册表：模型类 -> 序列化函数
+serializers = {}
+
+
+def register_serializer(model):
+    """
+    注册模型的序列化函数，序列化函数返回可直接编码为JSON的字典（日期字段可保留为date/datetime）
+    :param model: 模型类
+    """
+    def decorator(func):
+        serializers[model] = func
+        return func
+    return decorator
+
+
+def serialize(obj):
+    """
+    使用已注册的序列化函数序列化模型对象
+    :param obj: 模型对象或模型对象列表
+    :return: 字典或字典列表
+    """
+    if obj is None:
+        return None
+    if isinstance(obj, (list, tuple)):
+        return [serialize(item) for item in obj]
+    return serializers[type(obj)](obj)
+
+
+def _default(obj):
+    """
+    JSON编码器无法直接处理的对象：日期转为ISO格式，模型对象使用已注册的序列化函数
+    """
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    if type(obj) in serializers:
+        return serializers[type(obj)](obj)
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+def _orjson_dumps(data):
+    return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _stdlib_dumps(data):
+    return json.dumps(data, default=_default)
+
+
+# 当前使用的JSON编码函数，安装了orjson时优先使用
+json_dumps = _orjson_dumps if orjson is not None else _stdlib_dumps
+
+
+def set_json_encoder(dumps):
+    """
+    替换JSON编码函数
+    :param dumps: 接收数据、返回str或bytes的函数；传入 'orjson' 或 'json' 选择内置实现
+    """
+    global json_dumps
+    if dumps == 'orjson':
+        if orjson is None:
+            raise RuntimeError('orjson is not installed')
+        dumps = _orjson_dumps
+    elif dumps == 'json':
+        dumps = _stdlib_dumps
+    json_dumps = dumps
+
+
+# 各模型的序列化函数
+@register_serializer(Student)
+def serialize_student(student):
+    balance = student.balance
+    return {
+        'id': student.id,
+        'name': student.name,
+        'phone': student.phone,
+        'email': student.email,
+        'birthdate': student.birthdate,
+        'address': student.address,
+        'notes': student.notes,
+        'status': student.status,
+        'openid': student.openid,
+        'registerDate': student.register_date,
+        'totalHours': balance.total_hours if balance else 0,
+        'usedHours': balance.used_hours if balance else 0,
+        'remainingHours': balance.remaining_hours if balance else 0,
+        'activePackageCount': balance.active_package_count if balance else 0,
+        'lastConsumptionTime': balance.last_consumption_time if balance else None
+    }
+
+
+@register_serializer(CoursePackage)
+def serialize_course_package(package):
+    return {
+        'id': package.id,
+        'name': package.name,
+        'totalHours': package.total_hours,
+        'status': package.status,
+        'notes': package.notes,
+        'createdAt': package.created_at
+    }
+
+
+@register_serializer(StudentCoursePackage)
+def serialize_student_course_package(package):
+    course_package = package.course_package
+    return {
+        'id': package.id,
+        'studentId': package.student_id,
+        'coursePackageId': package.course_package_id,
+        'name': course_package.name if course_package else None,
+        'totalHours': course_package.total_hours if course_package else None,
+        'usedHours': package.used_hours,
+        'remainingHours': package.remaining_hours,
+        'status': package.status,
+        'purchaseDate': package.purchase_date,
+        'expireDate': package.expire_date,
+        'createdAt': package.created_at
+    }
+
+
+@register_serializer(ClassRecord)
+def serialize_class_record(record):
+    return {
+        'id': record.id,
+        'studentId': record.student_id,
+        'date': record.class_date,
+        'content': record.content,
+        'createdAt': record.created_at,
+        'operatorId': record.operator_id,
+        'operatorName': record.operator.username if record.operator else None
+    }
+
+
+@register_serializer(ConsumptionRecord)
+def serialize_consumption_record(record):
+    package = record.package
+    return {
+        'id': record.id,
+        'studentId': record.student_id,
+        'packageId': record.package_id,
+        'packageName': package.course_package.name if package and package.course_package else f'课时包 #{record.package_id}',
+        'consumptionHours': record.consumption_hours,
+        'remainingHours': record.remaining_hours,
+        'usedHours': record.used_hours,
+        'operationTime': record.operation_time,
+        'operatorId': record.operator_id,
+        'operatorName': record.operator.username if record.operator else record.operator_name
+    }
+
+
+@register_serializer(MessageJob)
+def serialize_message_job(job):
+    return {
+        'id': job.id,
+        'templateId': job.template_id,
+        'status': job.status,
+        'total': job.total,
+        'sent': job.sent,
+        'failed': job.failed,
+        'skipped': job.skipped,
+        'pending': job.total - job.sent - job.failed - job.skipped,
+        'error': job.error,
+        'createdAt': job.created_at,
+        'finishedAt': job.finished_at
+    }
+
+
+@register_serializer(MessageJobRecipient)
+def serialize_message_job_recipient(recipient):
+    return {
+        'id': recipient.id,
+        'studentId': recipient.student_id,
+        'touser': recipient.touser,
+        'status': recipient.status,
+        'errcode': recipient.errcode,
+        'errmsg': recipient.errmsg,
+        'sentAt': recipient.sent_at
+    }
+
+
+@register_serializer(JobRun)
+def serialize_job_run(run):
+    return {
+        'id': run.id,
+        'name': run.name,
+        'status': run.status,
+        'result': json.loads(run.result) if run.result else None,
+        'error': run.error,
+        'startedAt': run.started_at,
+        'finishedAt': run.finished_at
+    }
+
 
 def make_succ_empty_response():
-    data = json.dumps({'code': 0, 'data': {}})
+    data = json_dumps({'code': 0, 'data': {}})
     return Response(data, mimetype='application/json')
 
 
 def make_succ_response(data):
-    data = json.dumps({'code': 0, 'data': data})
+    data = json_dumps({'code': 0, 'data': data})
     return Response(data, mimetype='application/json')
 
 
 def make_err_response(err_msg):
-    data = json.dumps({'code': -1, 'errorMsg': err_msg})
-    return Response(data, mimetype='application/json')
+    data = json_dumps({'code': -1, 'errorMsg': err_msg})
+    response = Response(data, mimetype='application/json')
+    # 标记业务错误，供请求统计区分 code: -1 的响应
+    response.app_error = True
+    return response
@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+import time
+
+import config
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+
+class Scheduler:
+    """
+    进程内的定时任务调度
+    每个Web进程各自运行调度线程，同一任务的同一周期通过 JobRun 表的唯一约束只由一个进程执行
+    执行记录（开始/结束时间、结果、错误）保存在 JobRun 表中
+    执行进程退出后遗留的 running 记录超过 JOB_RUN_TIMEOUT 后标记为失败，同一周期可以重新认领
+    独占任务的手动执行都认领同一个周期（JOB_RUN_EXCLUSIVE_SLOT），执行结束后释放，同一时间只有一次执行
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self.exclusive = set()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def task(self, name, interval, exclusive=False):
+        """
+        注册定时任务，任务函数接收 run_id 和 dry_run，返回结果字典
+        :param name: 任务名称
+        :param interval: 执行间隔（秒），为0时只能手动执行
+        :param exclusive: 手动执行时是否独占，已在执行时不能再次执行
+        """
+        def decorator(func):
+            self.tasks[name] = (interval, func)
+            if exclusive:
+                self.exclusive.add(name)
+            return func
+        return decorator
+
+    def run(self, name, slot=None, dry_run=False):
+        """
+        执行一次任务并记录执行结果，需要在应用上下文中调用
+        :param name: 任务名称
+        :param slot: 执行周期编号，默认为手动执行
+        :param dry_run: 只统计不执行
+        :return: (执行记录ID, 结果)；周期已被其他进程认领或独占任务正在执行时返回 (None, None)
+        """
+        from wxcloudrun.dao import claim_job_run
+        run_id = claim_job_run(name, slot if slot is not None else self._manual_slot(name))
+        if run_id is None:
+            return None, None
+        return run_id, self._execute(name, run_id, dry_run)
+
+    def submit(self, app, name, dry_run=False):
+        """
+        认领一次手动执行后在后台线程中执行，立即返回，执行结果通过 JobRun 表查看
+        :param app: Flask应用
+        :param name: 任务名称
+        :param dry_run: 只统计不执行
+        :return: 执行记录ID，独占任务正在执行时返回None
+        """
+        from wxcloudrun.dao import claim_job_run
+        run_id = claim_job_run(name, self._manual_slot(name))
+        if run_id is None:
+            return None
+        thread = threading.Thread(target=self._execute_in_context, args=(app, name, run_id, dry_run),
+                                  name='job-{}'.format(run_id), daemon=True)
+        thread.start()
+        return run_id
+
+    def _manual_slot(self, name):
+        from wxcloudrun.dao import JOB_RUN_EXCLUSIVE_SLOT
+        if name in self.exclusive:
+            return JOB_RUN_EXCLUSIVE_SLOT
+        return -time.time_ns() // 1000
+
+    def _execute_in_context(self, app, name, run_id, dry_run):
+        from wxcloudrun import db
+        with app.app_context():
+            try:
+                self._execute(name, run_id, dry_run)
+            except Exception:
+                logger.exception("job {} run {} did not finish".format(name, run_id))
+            finally:
+                db.session.remove()
+
+    def _execute(self, name, run_id, dry_run):
+        from wxcloudrun.dao import finish_job_run
+        interval, func = self.tasks[name]
+        started = time.monotonic()
+        try:
+            result = func(run_id, dry_run=dry_run)
+            result['elapsed'] = round(time.monotonic() - started, 3)
+            finish_job_run(run_id, result)
+            logger.info("job {} run {} finished: {}".format(name, run_id, result))
+            return result
+        except Exception as e:
+            logger.error("job {} run {} failed: {}".format(name, run_id, e))
+            finish_job_run(run_id, error=str(e))
+            raise
+
+    def start(self, app):
+        """
+        在当前进程中启动调度线程，重复调用时只启动一次
+        :param app: Flask应用
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        thread = threading.Thread(target=self._loop, args=(app,), name='scheduler', daemon=True)
+        thread.start()
+
+    def _loop(self, app):
+        from wxcloudrun import db
+        last_slots = {}
+        while True:
+            for name, (interval, func) in self.tasks.items():
+                if interval <= 0:
+                    continue
+                slot = int(time.time() // interval)
+                if last_slots.get(name) == slot:
+                    continue
+                last_slots[name] = slot
+                with app.app_context():
+                    try:
+                        self.run(name, slot)
+                    except Exception:
+                        logger.exception("job {} slot {} did not finish".format(name, slot))
+                    finally:
+                        db.session.remove()
+            time.sleep(config.SCHEDULER_TICK)
+
+
+# 当前进程的定时任务调度器
+scheduler = Scheduler()
@@ -58,6 +58,18 @@ const StudentAPI = {
     return  handleApiRequest(url);
   },
   
+  // 基于游标获取学生列表，cursor 为 { after, before }，均为空时获取第一页
+  // count 为总数统计方式：exact、approx 或 none
+  getStudentsByCursor: (perPage = 10, status = 'all', cursor = {}, count = 'approx') => {
+    let url = `${API_BASE_URL}/students?mode=cursor&per_page=${perPage}&count=${count}${status !== 'all' ? `&status=${status}` : ''}`;
+    if (cursor.after) {
+      url += `&after_id=${encodeURIComponent(cursor.after)}`;
+    } else if (cursor.before) {
+      url += `&before_id=${encodeURIComponent(cursor.before)}`;
+    }
+    return handleApiRequest(url);
+  },
+  
   // 获取单个学生信息
   getStudent: (studentId) => {
     return handleApiRequest(`${API_BASE_URL}/students/${studentId}`);
@@ -106,6 +118,28 @@ const StudentAPI = {
     });
   },
   
+  // 按姓名、手机号（支持尾号）或邮箱检索学生
+  searchStudents: (q, page = 1, perPage = 10, status = 'all') => {
+    const params = new URLSearchParams({ q, page, per_page: perPage, status });
+    return handleApiRequest(`${API_BASE_URL}/students/search?${params.toString()}`);
+  },
+  
+  // 获取学生详情概览（学生信息、课时包、上课记录、课消记录）
+  // options 可包含各部分数量上限，为0时不返回该部分
+  getStudentOverview: (studentId, options = {}) => {
+    const params = new URLSearchParams();
+    ['packages_limit', 'records_limit', 'consumption_limit'].forEach(name => {
+      if (options[name] !== undefined && options[name] !== null) {
+        params.append(name, options[name]);
+      }
+    });
+    if (options.activeOnly) {
+      params.append('active_only', 'true');
+    }
+    const query = params.toString();
+    return handleApiRequest(`${API_BASE_URL}/students/${studentId}/overview${query ? `?${query}` : ''}`);
+  },
+  
   // 获取学生的学习记录
   getStudentRecords: (studentId) => {
     return handleApiRequest(`${API_BASE_URL}/students/${studentId}/records`);
@@ -140,6 +174,14 @@ const StudentAPI = {
       method: 'POST',
       body: JSON.stringify(consumptionData)
     });
+  },
+  
+  // 批量登记一节课的出勤，items 为 [{ studentId, packageId, hours, content }]
+  addAttendanceBatch: (date, items, content = '') => {
+    return handleApiRequest(`${API_BASE_URL}/attendance/batch`, {
+      method: 'POST',
+      body: JSON.stringify({ date, content, items })
+    });
   }
 };
 
@@ -83,5 +83,60 @@ const PaginationUtils = {
     } else if (containerSelector === '.pagination-packages') {
       $('#packagePerPageSelect').val(per_page.toString());
     }
+  },
+  
+  // 更新游标分页控件（只有上一页/下一页，不依赖总数）
+  updateCursorPagination: function(pagination, containerSelector, onNavigate) {
+    const { per_page, next_cursor, prev_cursor, has_next, has_prev, total } = pagination;
+    
+    // 游标分页不一定返回总数
+    if (containerSelector === '.pagination') {
+      $('#totalRecords').text(total !== undefined && total !== null ? total : '-');
+    }
+    
+    // 清空现有分页
+    const $pagination = $(containerSelector);
+    $pagination.empty();
+    
+    // 添加"上一页"和"下一页"按钮
+    $pagination.append($(`
+      <li class="page-item${has_prev ? '' : ' disabled'}">
+        <a class="page-link" href="#" data-direction="before" tabindex="-1" aria-disabled="${!has_prev}">上一页</a>
+      </li>
+    `));
+    $pagination.append($(`
+      <li class="page-item${has_next ? '' : ' disabled'}">
+        <a class="page-link" href="#" data-direction="after" aria-disabled="${!has_next}">下一页</a>
+      </li>
+    `));
+    
+    // 绑定翻页点击事件
+    $pagination.find('.page-link').on('click', function(e) {
+      e.preventDefault();
+      
+      // 如果是禁用状态，不执行操作
+      if ($(this).parent().hasClass('disabled')) {
+        return;
+      }
+      
+      // 根据方向构造游标
+      const direction = $(this).data('direction');
+      const cursor = direction === 'after' ? { after: next_cursor } : { before: prev_cursor };
+      
+      // 调用翻页回调函数
+      if (typeof onNavigate === 'function') {
+        onNavigate(cursor);
+      }
+      
+      // 滚动到表格顶部
+      $('html, body').animate({
+        scrollTop: $(containerSelector).closest('table').offset().top - 20
+      }, 200);
+    });
+    
+    // 更新每页显示数量选择器
+    if (containerSelector === '.pagination') {
+      $('#perPageSelect').val(per_page.toString());
+    }
   }
 }; 
\ No newline at end of file
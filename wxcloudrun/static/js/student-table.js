@@ -8,7 +8,9 @@ const StudentTable = {
   state: {
     currentPage: 1,
     perPage: 10,
-    status: 'all'
+    status: 'all',
+    // 当前页的游标，{ after } 或 { before }，空对象表示第一页
+    cursor: {}
   },
   
   // 初始化学生表格
@@ -26,6 +28,7 @@ const StudentTable = {
     $('#statusFilter').on('change', () => {
       this.state.status = $('#statusFilter').val();
       this.state.currentPage = 1; // 重置到第一页
+      this.state.cursor = {};
       this.loadData();
     });
     
@@ -33,6 +36,7 @@ const StudentTable = {
     $('#perPageSelect').on('change', () => {
       this.state.perPage = parseInt($('#perPageSelect').val());
       this.state.currentPage = 1; // 重置到第一页
+      this.state.cursor = {};
       this.loadData();
     });
     
@@ -58,16 +62,13 @@ const StudentTable = {
     $('#studentsTable tbody').empty();
     
     // 获取学生数据
-    StudentAPI.getAllStudents(this.state.currentPage, this.state.perPage, this.state.status)
+    StudentAPI.getStudentsByCursor(this.state.perPage, this.state.status, this.state.cursor)
       .then(response => {
           // 渲染学生表格
           this.renderTable(response.data.items);
           
-          // 更新分页控件
+          // 更新分页控件（同时更新总记录数显示）
           this.updatePagination(response.data.pagination);
-        
-          // 更新总记录数显示
-          $('#totalRecords').text(response.data.pagination.total);
           
           // 如果没有记录，显示空状态
           if (response.data.items.length === 0) {
@@ -129,6 +130,7 @@ const StudentTable = {
           <td>${student.name}</td>
           <td>${student.phone || '-'}</td>
           <td>${DateFormatterUtils.formatDate(student.registerDate)}</td>
+          <td>${student.remainingHours}</td>
           <td><span class="${statusClass}">${statusText}</span></td>
           <td>
             <div class="btn-group" role="group" aria-label="操作按钮">
@@ -162,12 +164,12 @@ const StudentTable = {
   
   // 更新分页控件
   updatePagination: function(pagination) {
-    // 使用通用分页工具更新分页控件
-    PaginationUtils.updatePagination(
+    // 使用通用分页工具更新游标分页控件
+    PaginationUtils.updateCursorPagination(
       pagination,
       '.pagination',
-      (page) => {
-        this.state.currentPage = page;
+      (cursor) => {
+        this.state.cursor = cursor;
         this.loadData();
       }
     );
@@ -222,9 +224,9 @@ const StudentTable = {
   
   // 处理编辑个人信息
   handleEditPersonal: function(event) {
-    // const $button = $(event.currentTarget);
-    // const $row = $button.closest('tr');
-    // const studentId = parseInt($row.attr('data-id'));
+    const $button = $(event.currentTarget);
+    const $row = $button.closest('tr');
+    const studentId = parseInt($row.attr('data-id'));
     // const studentName = $row.find('td:eq(1)').text();  // 假设姓名在第二列
     
     // console.log(`正在加载学生信息，ID: ${studentId}, 姓名: ${studentName}`);
@@ -261,12 +263,12 @@ const StudentTable = {
           // 显示加载指示器
           NotificationUtils.showLoading('#editPersonalModal .modal-body', '加载客户信息中...');
           
-          // 加载学生数据
-          StudentAPI.getStudent(studentId)
+          // 通过学生详情概览加载学生数据，不返回课时包和记录
+          StudentAPI.getStudentOverview(studentId, { packages_limit: 0, records_limit: 0, consumption_limit: 0 })
             .then(response => {
               // 填充表单数据
               try {
-                const student = response.data;
+                const student = response.data.student;
                 console.log("student:" + JSON.stringify(student, null, 2));
                 $('#editPersonalId').val(student.id);
                 $('#editPersonalName').val(student.name);
@@ -337,10 +339,10 @@ const StudentTable = {
     // 显示加载指示器
     NotificationUtils.showLoading('#studentRecordsTable tbody', '加载上课记录中...');
     
-    // 获取学生的上课记录
-    StudentAPI.getStudentRecords(studentId)
+    // 通过学生详情概览获取学生的上课记录，不返回课时包和课消记录
+    StudentAPI.getStudentOverview(studentId, { packages_limit: 0, consumption_limit: 0 })
       .then(response => {
-        const records = response.data;
+        const records = response.data.records;
         const $tableBody = $('#studentRecordsTable tbody');
         $tableBody.empty();
         
@@ -404,101 +406,105 @@ const StudentTable = {
     // 重置表单
     $('#addConsumptionForm')[0].reset();
     
-    // 加载学生课时包和课消记录
-    this.loadStudentPackages(studentId);
-    this.loadConsumptionRecords(studentId);
+    // 一次请求加载学生课时包和课消记录
+    this.loadStudentOverview(studentId);
   },
   
-  // 加载学生的课时包
-  loadStudentPackages: function(studentId) {
+  // 加载学生详情概览，同时填充课时包选择和课消记录
+  loadStudentOverview: function(studentId) {
     // 显示加载指示器
     NotificationUtils.showLoading('#packageSelector', '加载课时包中...');
+    NotificationUtils.showLoading('#consumptionRecordsTable tbody', '加载课消记录中...');
     
-    // 获取学生的活跃课时包
-    StudentAPI.getStudentPackages(studentId, true)
+    StudentAPI.getStudentOverview(studentId, { activeOnly: true, records_limit: 0 })
       .then(response => {
-        const packages = response.data;
-        const $selector = $('#packageSelector');
-        $selector.empty();
-        
-        if (packages.length === 0) {
-          $selector.html('<option value="">-- 无可用课时包 --</option>');
-          $('#consumptionHours, #consumptionSubmit').prop('disabled', true);
-        } else {
-          $selector.append('<option value="">-- 请选择课时包 --</option>');
-          packages.forEach(pkg => {
-            $selector.append(`<option value="${pkg.id}" data-remaining="${pkg.remainingHours}" data-used="${pkg.usedHours}">${pkg.name || '课时包 #' + pkg.id} (剩余: ${pkg.remainingHours})</option>`);
-          });
-          $('#consumptionHours, #consumptionSubmit').prop('disabled', false);
-        }
-        
-        // 清除加载指示器
-        NotificationUtils.clearLoading('#packageSelector');
+        this.renderStudentPackages(response.data.packages);
+        this.renderConsumptionRecords(response.data.consumptionRecords);
       })
       .catch(error => {
-        // 显示错误信息
-        NotificationUtils.clearLoading('#packageSelector');
-        $('#packageSelector').html('<option value="">-- 加载失败 --</option>');
-        $('#consumptionHours, #consumptionSubmit').prop('disabled', true);
-        NotificationUtils.showAlert('danger', `加载课时包失败: ${error.message}`);
+        this.showPackagesError(error);
+        this.showConsumptionRecordsError(error);
       });
   },
   
-  // 加载学生的课消记录
-  loadConsumptionRecords: function(studentId) {
-    // 显示加载指示器
-    NotificationUtils.showLoading('#consumptionRecordsTable tbody', '加载课消记录中...');
+  // 渲染课时包选择框
+  renderStudentPackages: function(packages) {
+    const $selector = $('#packageSelector');
+    $selector.empty();
     
-    // 获取学生的课消记录
-    StudentAPI.getConsumptionRecords(studentId)
-      .then(response => {
-        const records = response.data;
-        const $tableBody = $('#consumptionRecordsTable tbody');
-        $tableBody.empty();
-        
-        if (records.length === 0) {
-          $tableBody.html(`
-            <tr>
-              <td colspan="5" class="text-center py-4">
-                <div class="empty-state">
-                  <i class="bi bi-clock-history" style="font-size: 2rem; opacity: 0.5;"></i>
-                  <p class="mt-2">暂无课消记录</p>
-                </div>
-              </td>
-            </tr>
-          `);
-        } else {
-          records.forEach(record => {
-            const $row = $(`
-              <tr>
-                <td>${record.packageName}</td>
-                <td>${record.consumptionHours}</td>
-                <td>${record.remainingHours}</td>
-                <td>${DateFormatterUtils.formatDateTime(record.operationTime)}</td>
-                <td>${record.operatorName}</td>
-              </tr>
-            `);
-            $tableBody.append($row);
-          });
-        }
-        
-        // 清除加载指示器
-        NotificationUtils.clearLoading('#consumptionRecordsTable tbody');
-      })
-      .catch(error => {
-        // 显示错误信息
-        NotificationUtils.clearLoading('#consumptionRecordsTable tbody');
-        $('#consumptionRecordsTable tbody').html(`
+    if (packages.length === 0) {
+      $selector.html('<option value="">-- 无可用课时包 --</option>');
+      $('#consumptionHours, #consumptionSubmit').prop('disabled', true);
+    } else {
+      $selector.append('<option value="">-- 请选择课时包 --</option>');
+      packages.forEach(pkg => {
+        $selector.append(`<option value="${pkg.id}" data-remaining="${pkg.remainingHours}" data-used="${pkg.usedHours}">${pkg.name || '课时包 #' + pkg.id} (剩余: ${pkg.remainingHours})</option>`);
+      });
+      $('#consumptionHours, #consumptionSubmit').prop('disabled', false);
+    }
+    
+    // 清除加载指示器
+    NotificationUtils.clearLoading('#packageSelector');
+  },
+  
+  // 显示课时包加载失败
+  showPackagesError: function(error) {
+    // 显示错误信息
+    NotificationUtils.clearLoading('#packageSelector');
+    $('#packageSelector').html('<option value="">-- 加载失败 --</option>');
+    $('#consumptionHours, #consumptionSubmit').prop('disabled', true);
+    NotificationUtils.showAlert('danger', `加载课时包失败: ${error.message}`);
+  },
+  
+  // 渲染课消记录表格
+  renderConsumptionRecords: function(records) {
+    const $tableBody = $('#consumptionRecordsTable tbody');
+    $tableBody.empty();
+    
+    if (records.length === 0) {
+      $tableBody.html(`
+        <tr>
+          <td colspan="5" class="text-center py-4">
+            <div class="empty-state">
+              <i class="bi bi-clock-history" style="font-size: 2rem; opacity: 0.5;"></i>
+              <p class="mt-2">暂无课消记录</p>
+            </div>
+          </td>
+        </tr>
+      `);
+    } else {
+      records.forEach(record => {
+        const $row = $(`
           <tr>
-            <td colspan="5" class="text-center py-4">
-              <div class="alert alert-danger" role="alert">
-                <i class="bi bi-exclamation-triangle-fill me-2"></i>
-                加载课消记录失败: ${error.message}
-              </div>
-            </td>
+            <td>${record.packageName}</td>
+            <td>${record.consumptionHours}</td>
+            <td>${record.remainingHours}</td>
+            <td>${DateFormatterUtils.formatDateTime(record.operationTime)}</td>
+            <td>${record.operatorName}</td>
           </tr>
         `);
+        $tableBody.append($row);
       });
+    }
+    
+    // 清除加载指示器
+    NotificationUtils.clearLoading('#consumptionRecordsTable tbody');
+  },
+  
+  // 显示课消记录加载失败
+  showConsumptionRecordsError: function(error) {
+    // 显示错误信息
+    NotificationUtils.clearLoading('#consumptionRecordsTable tbody');
+    $('#consumptionRecordsTable tbody').html(`
+      <tr>
+        <td colspan="5" class="text-center py-4">
+          <div class="alert alert-danger" role="alert">
+            <i class="bi bi-exclamation-triangle-fill me-2"></i>
+            加载课消记录失败: ${error.message}
+          </div>
+        </td>
+      </tr>
+    `);
   },
   
   // 刷新表格数据
@@ -511,6 +517,7 @@ const StudentTable = {
     $('#statusFilter').val(status);
     this.state.status = status;
     this.state.currentPage = 1;
+    this.state.cursor = {};
     this.loadData();
   }
 }; 
\ No newline at end of file
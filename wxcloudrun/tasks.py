@@ -0,0 +1,136 @@
+import json
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+import config
+from wxcloudrun.scheduler import scheduler
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# 每批处理的课时包数
+REMINDER_BATCH_SIZE = 500
+
+
+@scheduler.task('reminders', config.REMINDER_INTERVAL)
+def scan_reminders(run_id, dry_run=False):
+    """
+    查找剩余课时不足或即将过期的课时包，通过模板消息提醒家长
+    每个课时包的每种提醒只发送一次；未配置模板或微信appid时只统计不发送
+    :param run_id: 执行记录ID
+    :param dry_run: 只统计不发送
+    :return: 各类提醒的数量
+    """
+    from wxcloudrun.dao import (
+        find_reminder_candidates, record_reminders, set_reminder_message_job, create_message_job
+    )
+    from wxcloudrun.wechat import bulk_sender, render_template_data
+
+    configured = bool(config.REMINDER_TEMPLATE_ID and config.WECHAT_APPID and config.WECHAT_SECRET)
+    send = configured and not dry_run
+    template_data = json.loads(config.REMINDER_TEMPLATE_DATA)
+    expire_before = datetime.now().date() + timedelta(days=config.REMINDER_EXPIRE_DAYS)
+
+    result = {'sent': send, 'message_jobs': []}
+    for kind, threshold in (('low_balance', config.REMINDER_LOW_HOURS), ('expiring', expire_before)):
+        count = 0
+        after_id = 0
+        while True:
+            rows = find_reminder_candidates(kind, threshold, after_id, REMINDER_BATCH_SIZE)
+            if not rows:
+                break
+            # 不发送时没有写入提醒记录，按ID继续向后查找
+            after_id = rows[-1].id
+            count += len(rows)
+            if not send:
+                continue
+
+            # 先记录再发送，发送失败不会导致重复提醒
+            record_reminders(kind, rows, run_id)
+            recipients = []
+            for row in rows:
+                if kind == 'low_balance':
+                    reason = '剩余课时{:g}'.format(row.remaining_hours)
+                else:
+                    reason = '将于{}到期'.format(row.expire_date.isoformat())
+                recipients.append({
+                    'student_id': row.student_id,
+                    'touser': row.openid,
+                    'data': render_template_data(template_data, {
+                        'name': row.student_name,
+                        'packageName': row.package_name or '',
+                        'reason': reason,
+                        'remainingHours': '{:g}'.format(row.remaining_hours or 0),
+                        'expireDate': row.expire_date.isoformat() if row.expire_date else ''
+                    })
+                })
+            job = create_message_job(config.REMINDER_TEMPLATE_ID, recipients, appid=config.WECHAT_APPID)
+            set_reminder_message_job(kind, [row.id for row in rows], job.id)
+            bulk_sender.start(current_app._get_current_object(), job.id, config.WECHAT_APPID, config.WECHAT_SECRET)
+            result['message_jobs'].append(job.id)
+        result[kind] = count
+    return result
+
+
+@scheduler.task('expire_packages', config.PACKAGE_EXPIRY_INTERVAL)
+def sweep_expired_packages(run_id, dry_run=False):
+    """
+    将已用完和已过期的活跃课时包标记为 used 和 expired
+    :param run_id: 执行记录ID
+    :param dry_run: 只统计不更新
+    :return: 各状态更新（或待更新）的课时包数
+    """
+    from wxcloudrun.dao import expire_course_packages
+    return expire_course_packages(dry_run=dry_run)
+
+
+@scheduler.task('rebuild_balances', 0, exclusive=True)
+def rebuild_balances(run_id, dry_run=False):
+    """
+    重新计算所有学生的课时汇总，只能手动执行（flask jobs run rebuild_balances 或管理员接口），同一时间只执行一次
+    :param run_id: 执行记录ID
+    :param dry_run: 只统计学生数
+    :return: 处理的学生数
+    """
+    from wxcloudrun.dao import rebuild_student_balances
+    from wxcloudrun.model import Student
+    if dry_run:
+        return {'students': Student.query.count()}
+    return {'rebuilt': rebuild_student_balances()}
+
+
+@scheduler.task('resume_message_jobs', config.MESSAGE_JOB_RESUME_INTERVAL)
+def resume_message_jobs(run_id, dry_run=False):
+    """
+    恢复发送进程退出后中断的批量发送任务（心跳超过 MESSAGE_JOB_STALE_SECONDS 未更新）
+    appsecret不保存，只能恢复使用服务端配置的appid发送的任务，其他任务标记为失败
+    已发送但尚未写入结果的接收人（每个任务最多 BulkSender.flush_size 条）恢复后会再发送一次
+    :param run_id: 执行记录ID
+    :param dry_run: 只统计不恢复
+    :return: 恢复和标记失败的任务ID
+    """
+    from wxcloudrun.dao import claim_stale_message_jobs, finish_message_job
+    from wxcloudrun.model import MessageJob
+    from wxcloudrun.wechat import bulk_sender
+
+    stale_before = datetime.now() - timedelta(seconds=config.MESSAGE_JOB_STALE_SECONDS)
+    if dry_run:
+        stale = MessageJob.query.filter(
+            MessageJob.status.in_(('pending', 'running')),
+            (MessageJob.heartbeat_at.is_(None)) | (MessageJob.heartbeat_at < stale_before)
+        ).count()
+        return {'stale': stale}
+
+    resumed, failed = [], []
+    for job in claim_stale_message_jobs(stale_before):
+        if job.appid and job.appid == config.WECHAT_APPID and config.WECHAT_SECRET:
+            bulk_sender.start(current_app._get_current_object(), job.id, config.WECHAT_APPID, config.WECHAT_SECRET)
+            resumed.append(job.id)
+        else:
+            finish_message_job(job.id, error='发送进程中断，任务使用的appid未配置在服务端，无法恢复')
+            failed.append(job.id)
+    if resumed or failed:
+        logger.info("resume_message_jobs resumed={} failed={}".format(resumed, failed))
+    return {'resumed': resumed, 'failed': failed}
@@ -0,0 +1,430 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+# 初始化日志
+logger = logging.getLogger('log')
+
+# access_token 无效或已过期的错误码
+INVALID_TOKEN_ERRCODES = (40001, 40014, 42001)
+
+# 可以重试的HTTP状态码
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+
+class WechatError(Exception):
+    """
+    微信接口返回错误
+    """
+
+    def __init__(self, errcode, errmsg):
+        super().__init__('微信API错误: {} {}'.format(errcode, errmsg))
+        self.errcode = errcode
+        self.errmsg = errmsg
+
+
+class WechatRequestError(Exception):
+    """
+    请求微信接口失败（连接失败、超时或HTTP错误），错误信息中不包含请求参数
+    """
+
+    def __init__(self, path, error):
+        if isinstance(error, requests.HTTPError):
+            reason = 'HTTP {}'.format(error.response.status_code)
+        else:
+            reason = type(error).__name__
+        super().__init__('请求微信接口失败: {} {}'.format(path, reason))
+        self.path = path
+
+
+class EndpointMetrics:
+    """
+    按接口路径统计的调用次数、失败次数、重试次数和耗时分布，线程安全
+    """
+
+    # 耗时分桶上限（毫秒），最后一个桶包括超过上限的所有请求
+    buckets = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def _endpoint(self, path):
+        entry = self._endpoints.get(path)
+        if entry is None:
+            entry = self._endpoints[path] = {
+                'count': 0, 'errors': 0, 'retries': 0, 'total': 0.0, 'max': 0.0,
+                'histogram': [0] * (len(self.buckets) + 1)
+            }
+        return entry
+
+    def observe(self, path, seconds, error=False):
+        """
+        记录一次调用（包括重试在内的总耗时）
+        """
+        ms = seconds * 1000
+        index = next((i for i, bound in enumerate(self.buckets) if ms <= bound), len(self.buckets))
+        with self._lock:
+            entry = self._endpoint(path)
+            entry['count'] += 1
+            entry['errors'] += 1 if error else 0
+            entry['total'] += seconds
+            entry['max'] = max(entry['max'], seconds)
+            entry['histogram'][index] += 1
+
+    def retried(self, path):
+        with self._lock:
+            self._endpoint(path)['retries'] += 1
+
+    def snapshot(self):
+        """
+        :return: 接口路径 -> 统计字典，histogram 为各分桶的累计次数
+        """
+        with self._lock:
+            result = {}
+            for path, entry in self._endpoints.items():
+                histogram = {}
+                cumulative = 0
+                for bound, count in zip(self.buckets + (None,), entry['histogram']):
+                    cumulative += count
+                    histogram['le_{}ms'.format(bound) if bound else 'le_inf'] = cumulative
+                result[path] = {
+                    'count': entry['count'],
+                    'errors': entry['errors'],
+                    'retries': entry['retries'],
+                    'avg_ms': round(entry['total'] * 1000 / entry['count'], 3) if entry['count'] else 0.0,
+                    'max_ms': round(entry['max'] * 1000, 3),
+                    'histogram': histogram
+                }
+            return result
+
+
+class WechatClient:
+    """
+    访问微信接口的共享HTTP客户端
+    复用keep-alive连接，所有请求都有连接和读取超时
+    幂等请求在连接失败、超时或5xx时按指数退避重试；非幂等请求只在连接建立失败时重试
+    """
+
+    def __init__(self, api_base=None, connect_timeout=None, read_timeout=None, retries=None,
+                 backoff=0.2, pool_size=None):
+        self.api_base = (api_base or config.WECHAT_API_BASE).rstrip('/')
+        self.timeout = (connect_timeout or config.WECHAT_CONNECT_TIMEOUT, read_timeout or config.WECHAT_READ_TIMEOUT)
+        self.retries = config.WECHAT_RETRIES if retries is None else retries
+        self.backoff = backoff
+        self.metrics = EndpointMetrics()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_size or config.WECHAT_HTTP_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path, idempotent=None, **kwargs):
+        """
+        请求微信接口
+        :param method: HTTP方法
+        :param path: 接口路径，如 /cgi-bin/stable_token；同时作为统计的接口名
+        :param idempotent: 是否可以安全重试，默认GET可以重试
+        :param kwargs: 传给 requests 的参数（params、json等）
+        :return: 响应的JSON数据
+        """
+        if idempotent is None:
+            idempotent = method.upper() == 'GET'
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, self.api_base + path, **kwargs)
+                if response.status_code in RETRY_STATUS_CODES and idempotent and attempt < self.retries:
+                    raise requests.HTTPError(response=response)
+                response.raise_for_status()
+                data = response.json()
+                self.metrics.observe(path, time.monotonic() - started)
+                return data
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                retryable = isinstance(e, requests.ConnectTimeout) or (
+                    idempotent and (not isinstance(e, requests.HTTPError)
+                                    or e.response.status_code in RETRY_STATUS_CODES))
+                if not retryable or attempt >= self.retries:
+                    self.metrics.observe(path, time.monotonic() - started, error=True)
+                    logger.info("wechat {} {} failed: {}".format(method, path, type(e).__name__))
+                    raise WechatRequestError(path, e) from e
+                self.metrics.retried(path)
+                time.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+            except ValueError as e:
+                # 响应不是JSON
+                self.metrics.observe(path, time.monotonic() - started, error=True)
+                raise WechatRequestError(path, e) from e
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+
+# 当前进程共享的微信接口客户端
+wechat_client = WechatClient()
+
+
+class AccessTokenManager:
+    """
+    微信 access_token 管理：按 appid 缓存，在过期前 refresh_margin 秒提前刷新
+    同一 appid 的并发请求只触发一次刷新，其他请求等待并复用结果
+    使用 stable_token 接口，多个进程各自刷新时拿到的是同一个token，不会互相顶替
+    """
+
+    def __init__(self, client=None, refresh_margin=None, clock=time.monotonic):
+        self.client = client or wechat_client
+        self.refresh_margin = config.WECHAT_TOKEN_REFRESH_MARGIN if refresh_margin is None else refresh_margin
+        self.clock = clock
+        self._tokens = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.fetches = 0
+
+    @staticmethod
+    def _key(appid, secret):
+        # 同一appid使用不同secret时不共享缓存，避免错误的secret拿到缓存的token
+        return appid, hashlib.sha256(secret.encode('utf-8')).hexdigest()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _cached(self, key):
+        entry = self._tokens.get(key)
+        if entry and entry[1] - self.refresh_margin > self.clock():
+            return entry
+        return None
+
+    def get_token(self, appid, secret):
+        """
+        获取 access_token，缓存有效时不请求微信接口
+        :param appid: 小程序或公众号appid
+        :param secret: appsecret
+        :return: (access_token, 剩余有效秒数)
+        """
+        key = self._key(appid, secret)
+        entry = self._cached(key)
+        if entry is None:
+            with self._key_lock(key):
+                # 等待锁期间其他线程可能已经刷新
+                entry = self._cached(key)
+                if entry is None:
+                    entry = self._fetch(appid, secret)
+                    self._tokens[key] = entry
+                    return entry[0], int(entry[1] - self.clock())
+        with self._lock:
+            self.hits += 1
+        return entry[0], int(entry[1] - self.clock())
+
+    def _fetch(self, appid, secret):
+        started = self.clock()
+        # force_refresh为false时重复请求返回同一个token，可以安全重试
+        data = self.client.post(
+            '/cgi-bin/stable_token',
+            json={'grant_type': 'client_credential', 'appid': appid, 'secret': secret, 'force_refresh': False},
+            idempotent=True
+        )
+        with self._lock:
+            self.fetches += 1
+        if not data.get('access_token'):
+            raise WechatError(data.get('errcode'), data.get('errmsg'))
+        logger.info("fetched wechat access_token for {}, expires_in={}".format(appid, data.get('expires_in')))
+        return data['access_token'], started + int(data.get('expires_in', 7200))
+
+    def invalidate(self, appid, secret):
+        """
+        微信返回token无效时清除缓存，下次获取时重新请求
+        """
+        self._tokens.pop(self._key(appid, secret), None)
+
+    def stats(self):
+        """
+        :return: 缓存命中数、请求微信接口次数和缓存的appid数
+        """
+        with self._lock:
+            return {'hits': self.hits, 'fetches': self.fetches, 'size': len(self._tokens)}
+
+
+# 当前进程的 access_token 管理器
+token_manager = AccessTokenManager()
+
+
+def send_template_message(message, appid=None, secret=None, access_token=None):
+    """
+    发送一条模板消息
+    未传入access_token时通过 token_manager 获取，token失效时刷新后重试一次
+    :param message: 消息内容，包含 touser、template_id、url、miniprogram、data
+    :param appid: appid（未传入access_token时必填）
+    :param secret: appsecret（未传入access_token时必填）
+    :param access_token: 调用方提供的access_token（可选）
+    :return: 微信接口返回的数据
+    """
+    def send(token):
+        # 转发请求到微信API
+        return wechat_client.post('/cgi-bin/message/template/send', params={'access_token': token}, json=message)
+
+    if access_token:
+        return send(access_token)
+    data = send(token_manager.get_token(appid, secret)[0])
+    # token被其他系统刷新而失效时，重新获取后重试一次
+    if data.get('errcode') in INVALID_TOKEN_ERRCODES:
+        token_manager.invalidate(appid, secret)
+        data = send(token_manager.get_token(appid, secret)[0])
+    return data
+
+
+def render_template_data(data, context):
+    """
+    用接收人的信息替换模板数据中的占位符，如 {name}、{remainingHours}
+    未知的占位符保持不变
+    :param data: 模板数据，如 {'thing1': {'value': '{name}同学'}}
+    :param context: 占位符取值
+    :return: 替换后的模板数据
+    """
+    class Missing(dict):
+        def __missing__(self, key):
+            return '{' + key + '}'
+
+    values = Missing(context)
+    rendered = {}
+    for key, item in (data or {}).items():
+        if isinstance(item, dict) and isinstance(item.get('value'), str):
+            try:
+                item = dict(item, value=item['value'].format_map(values))
+            except (ValueError, IndexError):
+                pass
+        rendered[key] = item
+    return rendered
+
+
+class RateLimiter:
+    """
+    令牌桶限流，线程安全
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        取得一个令牌，没有令牌时等待
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class BulkSender:
+    """
+    后台批量发送模板消息
+    每个任务由一个后台线程调度，消息由有界线程池并发发送，所有任务共享同一个限流器
+    发送线程只请求微信接口，结果由调度线程分批写入数据库，任务进度保存在数据库中，任意进程都可以查询
+    调度线程写入结果时更新任务心跳，进程退出后由 resume_message_jobs 定时任务恢复
+    """
+
+    # 每累计多少条结果写入一次数据库
+    flush_size = 50
+
+    # 没有新结果时至少每隔多少秒更新一次任务心跳
+    heartbeat_interval = 30
+
+    def __init__(self, workers=None, rate=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers or config.WECHAT_SEND_WORKERS,
+                                           thread_name_prefix='wechat-send')
+        # WECHAT_SEND_RATE 是整个实例的发送速率，由各工作进程平分
+        processes = 1 if config.DEBUG else max(1, config.WEB_WORKERS)
+        self.limiter = RateLimiter(rate or config.WECHAT_SEND_RATE / processes)
+
+    def start(self, app, job_id, appid, secret):
+        """
+        在后台线程中执行任务
+        :param app: Flask应用（后台线程中需要应用上下文访问数据库）
+        :param job_id: 任务ID
+        :param appid: appid
+        :param secret: appsecret（只保存在内存中）
+        :return: 后台线程
+        """
+        thread = threading.Thread(target=self._run, args=(app, job_id, appid, secret),
+                                  name='wechat-job-{}'.format(job_id), daemon=True)
+        thread.start()
+        return thread
+
+    def _send_one(self, base, recipient_id, touser, data, appid, secret):
+        self.limiter.acquire()
+        message = dict(base, touser=touser, data=data)
+        try:
+            result = send_template_message(message, appid, secret)
+            errcode = result.get('errcode', 0)
+            return {
+                'id': recipient_id,
+                'status': 'sent' if errcode == 0 else 'failed',
+                'errcode': errcode,
+                'errmsg': None if errcode == 0 else (result.get('errmsg') or '')[:200],
+                'sent_at': datetime.now()
+            }
+        except Exception as e:
+            return {'id': recipient_id, 'status': 'failed', 'errcode': None, 'errmsg': str(e)[:200],
+                    'sent_at': datetime.now()}
+
+    def _run(self, app, job_id, appid, secret):
+        from wxcloudrun import db
+        from wxcloudrun.dao import start_message_job, save_message_results, finish_message_job
+        with app.app_context():
+            try:
+                job, recipients = start_message_job(job_id)
+                base = {
+                    'template_id': job.template_id,
+                    'url': job.url,
+                    'miniprogram': json.loads(job.miniprogram) if job.miniprogram else None
+                }
+                futures = {self.executor.submit(self._send_one, base, recipient_id, touser, data, appid, secret)
+                           for recipient_id, touser, data in recipients}
+                results = []
+                flushed = time.monotonic()
+                while futures:
+                    done, futures = wait(futures, timeout=self.heartbeat_interval, return_when=FIRST_COMPLETED)
+                    results.extend(future.result() for future in done)
+                    # 攒够一批结果或距上次写入超过心跳间隔时写入数据库（没有结果时只更新心跳）
+                    if len(results) >= self.flush_size or time.monotonic() - flushed >= self.heartbeat_interval:
+                        save_message_results(job_id, results)
+                        results = []
+                        flushed = time.monotonic()
+                save_message_results(job_id, results)
+                error = None
+                logger.info("message job {} finished, {} recipients".format(job_id, len(recipients)))
+            except Exception as e:
+                error = str(e)[:1000]
+                logger.error("message job {} error: {}".format(job_id, e))
+            try:
+                finish_message_job(job_id, error)
+            finally:
+                db.session.remove()
+
+
+# 当前进程的批量发送器
+bulk_sender = BulkSender()